@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Memory used by a synthetic library of results maps, as returned by
+get_full_dataset, with and without the compact mode.
+
+Usage:
+    python -m benchmarks.bench_compact_memory [--wafers 100] [--phases 30] [--coverage 0.05]
+
+@author: williamrigaut
+"""
+import argparse
+import numpy as np
+import xarray as xr
+from packages.readers.read_hdf5 import XRD_RESULT_LABELS, compact_dataset
+
+
+def make_synthetic_dataset(rng, n_phases, coverage, n_elements=5, grid=17):
+    """
+    Creates a dataset with the variables of get_full_dataset: dense composition and MOKE maps,
+    and phase results measured at a fraction 'coverage' of the positions.
+    """
+    positions = np.linspace(-40, 40, grid)
+    data = xr.Dataset(coords={"y": positions, "x": positions})
+
+    for i in range(n_elements):
+        data[f"E{i} Composition"] = (["y", "x"], rng.random((grid, grid)))
+        data[f"E{i} Composition"].attrs["units"] = "at.%"
+    for name in ["coercivity_m0", "coercivity_dmdh", "max_kerr_rotation"]:
+        data[name] = (["y", "x"], rng.random((grid, grid)))
+        data[name].attrs["units"] = "T"
+
+    for i in range(n_phases):
+        measured = rng.random((grid, grid)) < coverage
+        for _, label in XRD_RESULT_LABELS:
+            values = np.where(measured, rng.random((grid, grid)), np.nan)
+            data[f"Phase{i} {label}"] = (["y", "x"], values)
+            data[f"Phase{i} {label}"].attrs["units"] = "A"
+
+    return data
+
+
+def get_nbytes(data):
+    """
+    Returns the memory used by the values of a dataset, including the coordinates of the sparse arrays.
+    """
+    nbytes = 0
+    for variable in data.variables.values():
+        array = variable.data
+        if hasattr(array, "coords") and hasattr(array, "data"):
+            nbytes += array.coords.nbytes + array.data.nbytes
+        else:
+            nbytes += array.nbytes
+
+    return nbytes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.bench_compact_memory",
+        description="Memory used by a synthetic library of results maps.",
+    )
+    parser.add_argument("--wafers", type=int, default=100, help="Number of wafers.")
+    parser.add_argument(
+        "--phases", type=int, default=30, help="Number of XRD phases per wafer."
+    )
+    parser.add_argument(
+        "--coverage",
+        type=float,
+        default=0.05,
+        help="Fraction of the positions where each phase is refined.",
+    )
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(0)
+    library = [
+        make_synthetic_dataset(rng, args.phases, args.coverage)
+        for _ in range(args.wafers)
+    ]
+
+    results = {
+        "float64 (default)": [get_nbytes(data) for data in library],
+        "compact": [get_nbytes(compact_dataset(data)) for data in library],
+    }
+    try:
+        results["compact + sparse"] = [
+            get_nbytes(compact_dataset(data, sparse_threshold=0.1)) for data in library
+        ]
+    except ImportError as error:
+        print(f"Warning, {error}")
+
+    print(
+        f"{args.wafers} wafers, {args.phases} phases, {args.coverage:.0%} coverage, "
+        f"{len(library[0].data_vars)} variables per wafer"
+    )
+    reference = sum(results["float64 (default)"])
+    for mode, nbytes in results.items():
+        print(
+            f"{mode:>20}: {sum(nbytes) / 1024**2:8.2f} MiB ({sum(nbytes) / reference:.1%})"
+        )
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Import time of the readers, measured with 'python -X importtime' in a new
+interpreter for each import, and the heavy libraries each import loads.
+
+Usage:
+    python -m benchmarks.bench_import_time [--repeat 5] [--top 5]
+
+@author: williamrigaut
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+
+# Imports measured, as (description, statement)
+IMPORTS = [
+    ("package", "import packages.readers"),
+    ("metadata", "from packages.readers.inspect_hdf5 import inspect"),
+    (
+        "single position",
+        "from packages.readers.read_hdf5 import search_measurement_data_from_type",
+    ),
+    ("full dataset", "from packages.readers.read_hdf5 import get_full_dataset"),
+    ("catalog", "from packages.readers.catalog import query_catalog"),
+    ("xarray", "import xarray"),
+]
+
+# Libraries whose import is reported
+HEAVY_LIBRARIES = ["xarray", "pandas", "plotly", "matplotlib", "fabio", "scipy"]
+
+
+def measure_import(statement):
+    """
+    Runs an import statement in a new interpreter with -X importtime.
+
+    Returns
+    -------
+    dict
+        The cumulative import time of every module imported, in microseconds, with the module names as keys.
+        The names are indented by two spaces per level of nested import, as in the output of -X importtime.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    times = {}
+    for line in result.stderr.splitlines():
+        # 'import time: self [us] | cumulative | imported package'
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times[name[1:].rstrip()] = int(cumulative)
+
+    return times
+
+
+def get_top_level_time(times):
+    """
+    Returns the total import time, as the sum of the cumulative times of the top level imports.
+    """
+    return sum(
+        cumulative for name, cumulative in times.items() if not name.startswith(" ")
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.bench_import_time",
+        description="Import time of the readers.",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="Number of runs of each import."
+    )
+    parser.add_argument(
+        "--top", type=int, default=5, help="Number of slowest modules listed."
+    )
+    args = parser.parse_args(argv)
+
+    for description, statement in IMPORTS:
+        runs = [measure_import(statement) for _ in range(args.repeat)]
+        total = statistics.median(get_top_level_time(times) for times in runs)
+        names = set(name.strip() for name in runs[-1])
+        heavy = [
+            library
+            for library in HEAVY_LIBRARIES
+            if any(name.split(".")[0] == library for name in names)
+        ]
+
+        print(f"{description:>16}: {total / 1000:8.1f} ms  ({statement})")
+        print(f"{'':>18}heavy libraries: {', '.join(heavy) if heavy else 'none'}")
+        slowest = sorted(
+            ((cumulative, name) for name, cumulative in runs[-1].items()),
+            reverse=True,
+        )[: args.top]
+        for cumulative, name in slowest:
+            print(f"{'':>18}{cumulative / 1000:8.1f} ms {name.strip()}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
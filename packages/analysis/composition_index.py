@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+"""
+Index of the positions of one or many wafers in composition space, to find
+the positions close to a composition and to aggregate their properties by
+composition bins without reading the files again.
+
+@author: williamrigaut
+"""
+import numpy as np
+from packages.readers.read_hdf5 import get_full_dataset
+from packages.readers.lazy_import import lazy_import
+
+pd = lazy_import("pandas")
+
+
+def _get_library(datasets):
+    """
+    Returns a dictionary {wafer name: dataset} from a dataset, a list of datasets or files, or a dictionary.
+    """
+    if isinstance(datasets, dict):
+        return dict(datasets)
+    if hasattr(datasets, "data_vars"):
+        return {"wafer": datasets}
+
+    library = {}
+    for i, dataset in enumerate(datasets):
+        if hasattr(dataset, "data_vars"):
+            library[str(i)] = dataset
+        else:
+            # Files are read once, the index is then queried in memory
+            library[str(dataset)] = get_full_dataset(dataset)
+
+    return library
+
+
+def _make_tree(compositions):
+    """
+    Builds a k-d tree of the compositions if scipy is installed, None otherwise.
+    """
+    try:
+        from scipy.spatial import cKDTree
+    except ImportError:
+        return None
+
+    return cKDTree(compositions)
+
+
+def build_composition_index(
+    datasets, elements=None, properties=None, bin_width=1.0, normalize=True
+):
+    """
+    Builds an index of the positions of one or many wafers in composition space.
+
+    Parameters
+    ----------
+    datasets : xarray.Dataset, list or dict
+        A dataset returned by get_full_dataset, a list of datasets (named by their index in the list) or paths to
+        HDF5 files (read with get_full_dataset and named by their path), or a dictionary {wafer name: dataset}.
+    elements : list of str, optional
+        The elements of the composition space, for example ['Nd', 'Ce', 'Fe']. If None, all the elements with a
+        '<element> Composition' map in every dataset are used.
+    properties : list of str, optional
+        The (y, x) maps stored in the index, for example ['coercivity_m0', 'Nd2Fe14B Lattice Parameter A']. If None,
+        all the (y, x) maps which are not compositions are stored, NaN for the wafers without the map.
+    bin_width : float, optional
+        The width of the composition bins used by aggregate_by_composition, in at.%. Defaults to 1.
+    normalize : bool, optional
+        If True, the compositions are rescaled to sum to 100 at.% over the elements of the index. Defaults to True.
+
+    Returns
+    -------
+    dict
+        The index, a dictionary with the keys:
+        - 'elements' and 'properties' : the names of the elements and properties.
+        - 'compositions' : the (n_positions, n_elements) compositions, in at.%.
+        - 'values' : the (n_positions, n_properties) values of the properties.
+        - 'wafer', 'x', 'y' : the (n_positions,) wafer names and positions.
+        - 'tree' : the k-d tree of the compositions, None if scipy is not installed.
+        - 'order' : the positions sorted by the composition of the first element, used without scipy.
+        - 'bin_width' and 'bins' : the width of the bins and the (n_positions, n_elements) bin of every position.
+
+    Notes
+    -----
+    The positions where one of the compositions is not measured are not indexed.
+    """
+    library = _get_library(datasets)
+    if len(library) == 0:
+        raise ValueError("No dataset to index.")
+
+    if elements is None:
+        for data in library.values():
+            found = [
+                name[: -len(" Composition")]
+                for name in data.data_vars
+                if name.endswith(" Composition")
+            ]
+            elements = (
+                found if elements is None else [e for e in elements if e in found]
+            )
+    if len(elements) == 0:
+        raise ValueError("No element composition found in the datasets.")
+
+    if properties is None:
+        properties = []
+        for data in library.values():
+            for name in data.data_vars:
+                if (
+                    data[name].dims == ("y", "x")
+                    and not name.endswith(" Composition")
+                    and name not in properties
+                ):
+                    properties.append(name)
+
+    compositions, values, wafers, x_pos, y_pos = [], [], [], [], []
+    for wafer, data in library.items():
+        grid_x, grid_y = np.meshgrid(data["x"].values, data["y"].values)
+        composition = np.stack(
+            [data[f"{element} Composition"].values.ravel() for element in elements],
+            axis=-1,
+        ).astype(np.float64)
+        measured = ~np.isnan(composition).any(axis=-1)
+        if normalize:
+            total = composition.sum(axis=-1, keepdims=True)
+            measured &= total[:, 0] > 0
+            with np.errstate(invalid="ignore", divide="ignore"):
+                composition = 100 * composition / total
+
+        compositions.append(composition[measured])
+        n_measured = np.count_nonzero(measured)
+        wafer_values = np.empty((n_measured, len(properties)))
+        for i, name in enumerate(properties):
+            if name in data and data[name].dims == ("y", "x"):
+                wafer_values[:, i] = data[name].values.ravel()[measured]
+            else:
+                wafer_values[:, i] = np.nan
+        values.append(wafer_values)
+        wafers += [wafer] * n_measured
+        x_pos.append(grid_x.ravel()[measured])
+        y_pos.append(grid_y.ravel()[measured])
+
+    compositions = np.concatenate(compositions)
+
+    return {
+        "elements": list(elements),
+        "properties": list(properties),
+        "compositions": compositions,
+        "values": np.concatenate(values),
+        "wafer": np.array(wafers),
+        "x": np.concatenate(x_pos),
+        "y": np.concatenate(y_pos),
+        "tree": _make_tree(compositions),
+        "order": np.argsort(compositions[:, 0], kind="stable"),
+        "bin_width": bin_width,
+        "bins": np.floor(compositions / bin_width).astype(np.int64),
+    }
+
+
+def _get_composition_vector(index, composition):
+    """
+    Converts a composition given as a dictionary {element: at.%} to a vector in the order of the index.
+    """
+    if isinstance(composition, dict):
+        missing = [
+            element for element in index["elements"] if element not in composition
+        ]
+        if len(missing) > 0:
+            raise ValueError(f"The composition of {missing} is missing.")
+        composition = [composition[element] for element in index["elements"]]
+
+    composition = np.asarray(composition, dtype=np.float64)
+    if composition.shape != (len(index["elements"]),):
+        raise ValueError(f"The composition must be given for {index['elements']}.")
+
+    return composition
+
+
+def _to_dataframe(index, rows, extra=None):
+    """
+    Returns the positions of the index given by rows as a pandas DataFrame.
+    """
+    columns = {
+        "wafer": index["wafer"][rows],
+        "x": index["x"][rows],
+        "y": index["y"][rows],
+    }
+    for i, element in enumerate(index["elements"]):
+        columns[f"{element} Composition"] = index["compositions"][rows, i]
+    for name, values in (extra or {}).items():
+        columns[name] = values
+    for i, name in enumerate(index["properties"]):
+        columns[name] = index["values"][rows, i]
+
+    return pd.DataFrame(columns)
+
+
+def query_composition(index, composition, tolerance=1.0):
+    """
+    Finds the positions whose composition is within a tolerance of a composition, for every element.
+
+    Parameters
+    ----------
+    index : dict
+        The index returned by build_composition_index.
+    composition : dict or array-like
+        The composition, as a dictionary {element: at.%} or in the order of index['elements'].
+    tolerance : float, optional
+        The maximum difference of composition for each element, in at.%. Defaults to 1.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The positions found, sorted by distance (largest difference of composition over the elements), with the
+        columns 'wafer', 'x', 'y', the compositions, 'distance' and the properties.
+
+    Examples
+    --------
+    >>> index = build_composition_index(library, elements=["Nd", "Ce", "Fe"])
+    >>> query_composition(index, {"Nd": 12, "Ce": 3, "Fe": 85}, tolerance=0.5)["coercivity_m0"].mean()
+    """
+    composition = _get_composition_vector(index, composition)
+    compositions = index["compositions"]
+
+    if index["tree"] is not None:
+        rows = np.array(
+            index["tree"].query_ball_point(composition, tolerance, p=np.inf),
+            dtype=np.intp,
+        )
+    else:
+        # Positions in the tolerance for the first element, then checked for all the elements
+        order = index["order"]
+        first = compositions[order, 0]
+        start = np.searchsorted(first, composition[0] - tolerance, side="left")
+        stop = np.searchsorted(first, composition[0] + tolerance, side="right")
+        rows = order[start:stop]
+
+    rows = np.sort(rows)
+    distance = np.abs(compositions[rows] - composition).max(axis=-1)
+    kept = distance <= tolerance
+    rows, distance = rows[kept], distance[kept]
+    sorting = np.argsort(distance, kind="stable")
+
+    return _to_dataframe(
+        index, rows[sorting], {"distance": distance[sorting]}
+    ).reset_index(drop=True)
+
+
+def aggregate_by_composition(index, properties=None, bin_width=None, min_count=1):
+    """
+    Aggregates the properties of the positions by composition bins.
+
+    Parameters
+    ----------
+    index : dict
+        The index returned by build_composition_index.
+    properties : list of str, optional
+        The properties aggregated. If None, all the properties of the index are aggregated.
+    bin_width : float, optional
+        The width of the bins, in at.%. If None, the bins of the index are used.
+    min_count : int, optional
+        The bins with fewer positions are dropped. Defaults to 1.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per bin, with the compositions of the center of the bin, the number of positions 'count' and the
+        '<property> mean', '<property> std' and '<property> count' (number of measured values) of each property.
+    """
+    if bin_width is None:
+        bin_width = index["bin_width"]
+        bins = index["bins"]
+    else:
+        bins = np.floor(index["compositions"] / bin_width).astype(np.int64)
+    if properties is None:
+        properties = index["properties"]
+
+    # Each bin is encoded as a single integer, much faster than np.unique on rows
+    lowest = bins.min(axis=0)
+    sizes = bins.max(axis=0) - lowest + 1
+    codes = np.ravel_multi_index((bins - lowest).T, sizes)
+    codes, inverse, counts = np.unique(codes, return_inverse=True, return_counts=True)
+    keys = np.column_stack(np.unravel_index(codes, sizes)) + lowest
+
+    columns = {}
+    for i, element in enumerate(index["elements"]):
+        columns[f"{element} Composition"] = (keys[:, i] + 0.5) * bin_width
+    columns["count"] = counts
+
+    for name in properties:
+        values = index["values"][:, index["properties"].index(name)]
+        measured = ~np.isnan(values)
+        n = np.bincount(inverse, weights=measured, minlength=len(keys))
+        sums = np.bincount(
+            inverse, weights=np.where(measured, values, 0), minlength=len(keys)
+        )
+        squares = np.bincount(
+            inverse, weights=np.where(measured, values, 0) ** 2, minlength=len(keys)
+        )
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = sums / n
+            columns[f"{name} mean"] = mean
+            columns[f"{name} std"] = np.sqrt(np.maximum(squares / n - mean**2, 0))
+        columns[f"{name} count"] = n.astype(np.int64)
+
+    table = pd.DataFrame(columns)
+
+    return table[table["count"] >= min_count].reset_index(drop=True)
@@ -0,0 +1,377 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental decompositions (PCA and NMF) of the EDX spectra and XRD patterns
+of one or many wafers, read by batches of positions so that the memory used
+does not depend on the number of wafers.
+
+@author: williamrigaut
+"""
+import numpy as np
+from packages.readers.inspect_hdf5 import inspect, get_manifest_positions
+from packages.readers.read_hdf5 import search_measurement_data_from_type
+from packages.readers.lazy_import import lazy_import
+
+xr = lazy_import("xarray")
+
+# Measurement decomposed for each data type, as (signal, axis)
+DECOMPOSITION_SIGNALS = {
+    "EDX": ("counts", "energy"),
+    "XRD": ("intensity", "angle"),
+}
+
+
+def _get_signal(hdf5_file, data_type, x_pos, y_pos):
+    """
+    Reads the spectrum (EDX) or pattern (XRD) of a position, with the same length as in get_measurement_data.
+    """
+    signal_key, axis_key = DECOMPOSITION_SIGNALS[data_type]
+    # Wafers are read once per pass, they would only fill the cache
+    measurement, units = search_measurement_data_from_type(
+        hdf5_file, data_type, x_pos, y_pos, use_cache=False
+    )
+    signal = np.asarray(measurement[signal_key], dtype=np.float64)
+    # Special case for intensity where it is stored with an extra first dimension
+    if signal_key == "intensity":
+        signal = signal[0][:2986]
+
+    return signal, np.asarray(measurement[axis_key]), units.get(axis_key, None)
+
+
+def iter_measurement_batches(
+    hdf5_files, data_type, batch_size=64, exclude_wafer_edges=True
+):
+    """
+    Reads the spectra (EDX) or patterns (XRD) of many wafers by batches of positions.
+
+    Parameters
+    ----------
+    hdf5_files : list of str or pathlib.Path
+        The paths to the HDF5 files to read.
+    data_type : str
+        The type of data, either 'EDX' or 'XRD'.
+    batch_size : int, optional
+        The maximum number of positions of a batch. Defaults to 64.
+    exclude_wafer_edges : bool, optional
+        If True, the positions at the edges of the wafer are skipped, as in get_measurement_data. Defaults to True.
+
+    Yields
+    ------
+    tuple
+        (hdf5_file, positions, batch, axis, axis_units) with the list of (x, y) positions of the batch, the
+        (n_positions, n_points) array of the measurements and the energy or angle axis of the first measurement.
+        The batches never mix two files.
+    """
+    data_type = data_type.upper()
+    if data_type not in DECOMPOSITION_SIGNALS:
+        raise ValueError("data_type must be one of 'EDX' or 'XRD'.")
+
+    for hdf5_file in hdf5_files:
+        positions = [
+            (x, y)
+            for x, y in get_manifest_positions(inspect(hdf5_file), data_type)
+            if not (np.abs(x) + np.abs(y) > 60 and exclude_wafer_edges)
+        ]
+
+        for start in range(0, len(positions), batch_size):
+            batch_positions = positions[start : start + batch_size]
+            signals = []
+            axis, axis_units = None, None
+            for x, y in batch_positions:
+                signal, position_axis, position_units = _get_signal(
+                    hdf5_file, data_type, x, y
+                )
+                if axis is None:
+                    axis, axis_units = position_axis, position_units
+                signals.append(signal)
+            yield hdf5_file, batch_positions, np.array(signals), axis, axis_units
+
+
+def _make_result_dataset(hdf5_files, data_type, components, axis, axis_units):
+    """
+    Creates the dataset returned by the decompositions, with NaN loading maps on the grid of all the positions.
+    """
+    signal_key, axis_key = DECOMPOSITION_SIGNALS[data_type]
+    n_components = components.shape[0]
+
+    data = xr.Dataset(
+        {
+            "components": xr.DataArray(
+                components,
+                coords={"component": np.arange(n_components), axis_key: axis},
+                dims=["component", axis_key],
+            )
+        }
+    )
+    if axis_units is not None:
+        data[axis_key].attrs["units"] = axis_units
+    data.attrs["data_type"] = data_type
+    data.attrs["files"] = [str(hdf5_file) for hdf5_file in hdf5_files]
+
+    return data
+
+
+def _fill_loadings(data, loadings, hdf5_files, single_file):
+    """
+    Puts the loadings of every position, given as {hdf5_file: {(x, y): loadings}}, into (wafer, component, y, x) maps.
+    """
+    positions = [position for wafer in loadings.values() for position in wafer]
+    x_vals = sorted(set(x for x, _ in positions))
+    y_vals = sorted(set(y for _, y in positions))
+    x_index = {x: i for i, x in enumerate(x_vals)}
+    y_index = {y: j for j, y in enumerate(y_vals)}
+
+    maps = np.full(
+        (len(hdf5_files), data.sizes["component"], len(y_vals), len(x_vals)), np.nan
+    )
+    for k, hdf5_file in enumerate(hdf5_files):
+        for (x, y), values in loadings[str(hdf5_file)].items():
+            maps[k, :, y_index[y], x_index[x]] = values
+
+    data["loadings"] = xr.DataArray(
+        maps,
+        coords={
+            "wafer": [str(hdf5_file) for hdf5_file in hdf5_files],
+            "component": data["component"],
+            "y": y_vals,
+            "x": x_vals,
+        },
+        dims=["wafer", "component", "y", "x"],
+    )
+    if single_file:
+        data = data.isel(wafer=0, drop=True)
+
+    return data
+
+
+def incremental_pca(
+    hdf5_files, data_type, n_components=5, batch_size=64, exclude_wafer_edges=True
+):
+    """
+    Principal component analysis of the spectra (EDX) or patterns (XRD) of one or many wafers, computed by batches
+    of positions with the incremental SVD of Ross et al. (2008). The files are read twice: once to fit the components
+    and once to compute the loadings.
+
+    Parameters
+    ----------
+    hdf5_files : str, pathlib.Path or list of them
+        The path to the HDF5 file, or the paths to the files of a library of wafers.
+    data_type : str
+        The type of data, either 'EDX' or 'XRD'.
+    n_components : int, optional
+        The number of components. Defaults to 5.
+    batch_size : int, optional
+        The number of positions read at once, it must not be lower than n_components. The memory used is about
+        (batch_size + n_components) times the size of a measurement. Defaults to 64.
+    exclude_wafer_edges : bool, optional
+        If True, the positions at the edges of the wafer are skipped. Defaults to True.
+
+    Returns
+    -------
+    xarray.Dataset
+        A dataset with the variables:
+        - 'components' : the (component, energy or angle) principal components.
+        - 'mean' : the mean measurement subtracted before the decomposition.
+        - 'explained_variance' and 'explained_variance_ratio' : the variance along each component.
+        - 'loadings' : the (wafer, component, y, x) projections of the measurements on the components, NaN where a
+          wafer was not measured. There is no 'wafer' dimension when a single file is given.
+
+    Examples
+    --------
+    >>> pca = incremental_pca(hdf5_files, "XRD", n_components=4)
+    >>> pca["loadings"].sel(component=0).plot(col="wafer")
+    """
+    single_file = isinstance(hdf5_files, (str, bytes)) or not hasattr(
+        hdf5_files, "__iter__"
+    )
+    hdf5_files = [hdf5_files] if single_file else list(hdf5_files)
+    if batch_size < n_components:
+        raise ValueError("batch_size must not be lower than n_components.")
+
+    n_seen = 0
+    mean = None
+    sum_squares = None
+    components = None
+    singular_values = None
+    axis, axis_units = None, None
+
+    for _, _, batch, batch_axis, batch_units in iter_measurement_batches(
+        hdf5_files, data_type, batch_size, exclude_wafer_edges
+    ):
+        if axis is None:
+            axis, axis_units = batch_axis, batch_units
+        n_batch = batch.shape[0]
+        batch_mean = batch.mean(axis=0)
+
+        if mean is None:
+            new_mean = batch_mean
+            stacked = batch - batch_mean
+            sum_squares = ((batch - batch_mean) ** 2).sum(axis=0)
+        else:
+            n_total = n_seen + n_batch
+            new_mean = mean + (batch_mean - mean) * n_batch / n_total
+            # The previous components, the centered batch and a correction for the shift of the mean
+            correction = np.sqrt(n_seen * n_batch / n_total) * (mean - batch_mean)
+            stacked = np.vstack(
+                [
+                    singular_values[:, np.newaxis] * components,
+                    batch - batch_mean,
+                    correction,
+                ]
+            )
+            # Pooled sum of the squared deviations (Chan et al.)
+            sum_squares = (
+                sum_squares
+                + ((batch - batch_mean) ** 2).sum(axis=0)
+                + (mean - batch_mean) ** 2 * n_seen * n_batch / n_total
+            )
+
+        _, s, vt = np.linalg.svd(stacked, full_matrices=False)
+        components = vt[:n_components]
+        singular_values = s[:n_components]
+        mean = new_mean
+        n_seen += n_batch
+
+    if n_seen == 0:
+        raise ValueError(f"No {data_type} measurement found in the files.")
+
+    explained_variance = singular_values**2 / max(n_seen - 1, 1)
+    total_variance = sum_squares.sum() / max(n_seen - 1, 1)
+    data = _make_result_dataset(hdf5_files, data_type, components, axis, axis_units)
+    axis_key = DECOMPOSITION_SIGNALS[data_type.upper()][1]
+    data["mean"] = xr.DataArray(
+        mean, coords={axis_key: data[axis_key]}, dims=[axis_key]
+    )
+    data["explained_variance"] = xr.DataArray(
+        explained_variance, coords={"component": data["component"]}, dims=["component"]
+    )
+    data["explained_variance_ratio"] = data["explained_variance"] / total_variance
+
+    # Second pass to project every position on the components
+    loadings = {str(hdf5_file): {} for hdf5_file in hdf5_files}
+    for hdf5_file, positions, batch, _, _ in iter_measurement_batches(
+        hdf5_files, data_type, batch_size, exclude_wafer_edges
+    ):
+        projections = (batch - mean) @ components.T
+        for position, values in zip(positions, projections):
+            loadings[str(hdf5_file)][position] = values
+
+    return _fill_loadings(data, loadings, hdf5_files, single_file)
+
+
+def _solve_nmf_loadings(batch, components, n_iter=100, loadings=None):
+    """
+    Computes the non-negative loadings H minimizing ||batch - H components||^2 with multiplicative updates.
+    """
+    eps = np.finfo(np.float64).eps
+    if loadings is None:
+        loadings = np.full((batch.shape[0], components.shape[0]), batch.mean() + eps)
+
+    numerator = batch @ components.T
+    gram = components @ components.T
+    for _ in range(n_iter):
+        loadings *= numerator / (loadings @ gram + eps)
+
+    return loadings
+
+
+def online_nmf(
+    hdf5_files,
+    data_type,
+    n_components=5,
+    batch_size=64,
+    n_epochs=2,
+    exclude_wafer_edges=True,
+    random_state=0,
+):
+    """
+    Non-negative matrix factorization of the spectra (EDX) or patterns (XRD) of one or many wafers, computed by
+    batches of positions with the online algorithm of Mairal et al. (2010): the components are updated from
+    sufficient statistics accumulated over the batches, so only one batch is held in memory.
+
+    Parameters
+    ----------
+    hdf5_files : str, pathlib.Path or list of them
+        The path to the HDF5 file, or the paths to the files of a library of wafers.
+    data_type : str
+        The type of data, either 'EDX' or 'XRD'.
+    n_components : int, optional
+        The number of components. Defaults to 5.
+    batch_size : int, optional
+        The number of positions read at once. Defaults to 64.
+    n_epochs : int, optional
+        The number of passes over the files to fit the components, the loadings are computed in an extra pass.
+        Defaults to 2.
+    exclude_wafer_edges : bool, optional
+        If True, the positions at the edges of the wafer are skipped. Defaults to True.
+    random_state : int, optional
+        The seed of the random initialization of the components. Defaults to 0.
+
+    Returns
+    -------
+    xarray.Dataset
+        A dataset with the (component, energy or angle) 'components' and the (wafer, component, y, x) 'loadings',
+        see incremental_pca. The 'reconstruction_error' attribute is the relative error of the last pass.
+
+    Notes
+    -----
+    Negative values of the measurements (for example after a background subtraction) are set to 0.
+    """
+    single_file = isinstance(hdf5_files, (str, bytes)) or not hasattr(
+        hdf5_files, "__iter__"
+    )
+    hdf5_files = [hdf5_files] if single_file else list(hdf5_files)
+    rng = np.random.default_rng(random_state)
+    eps = np.finfo(np.float64).eps
+
+    components = None
+    gram_sum = None
+    cross_sum = None
+    axis, axis_units = None, None
+
+    for _ in range(n_epochs):
+        for _, _, batch, batch_axis, batch_units in iter_measurement_batches(
+            hdf5_files, data_type, batch_size, exclude_wafer_edges
+        ):
+            batch = np.clip(batch, 0, None)
+            if components is None:
+                axis, axis_units = batch_axis, batch_units
+                scale = np.sqrt(batch.mean() / n_components)
+                components = scale * rng.random((n_components, batch.shape[1]))
+                gram_sum = np.zeros((n_components, n_components))
+                cross_sum = np.zeros((n_components, batch.shape[1]))
+
+            loadings = _solve_nmf_loadings(batch, components)
+            gram_sum += loadings.T @ loadings
+            cross_sum += loadings.T @ batch
+
+            # Block update of the components from the accumulated statistics
+            for _ in range(10):
+                components *= cross_sum / (gram_sum @ components + eps)
+
+    if components is None:
+        raise ValueError(f"No {data_type} measurement found in the files.")
+
+    # Normalizing the components, the loadings carry the intensities
+    norms = np.linalg.norm(components, axis=1)
+    norms[norms == 0] = 1
+    components = components / norms[:, np.newaxis]
+
+    loadings = {str(hdf5_file): {} for hdf5_file in hdf5_files}
+    squared_error = 0.0
+    squared_norm = 0.0
+    for hdf5_file, positions, batch, _, _ in iter_measurement_batches(
+        hdf5_files, data_type, batch_size, exclude_wafer_edges
+    ):
+        batch = np.clip(batch, 0, None)
+        batch_loadings = _solve_nmf_loadings(batch, components, n_iter=200)
+        squared_error += ((batch - batch_loadings @ components) ** 2).sum()
+        squared_norm += (batch**2).sum()
+        for position, values in zip(positions, batch_loadings):
+            loadings[str(hdf5_file)][position] = values
+
+    data = _make_result_dataset(hdf5_files, data_type, components, axis, axis_units)
+    data.attrs["reconstruction_error"] = float(
+        np.sqrt(squared_error / max(squared_norm, eps))
+    )
+
+    return _fill_loadings(data, loadings, hdf5_files, single_file)
@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+"""
+Resampling of the results measured by a technique at its own positions onto
+another wafer grid. The interpolation weights are computed once for a set of
+positions, then applied to every variable with a single vectorized gather.
+
+@author: williamrigaut
+"""
+import numpy as np
+from packages.readers.lazy_import import lazy_import
+
+xr = lazy_import("xarray")
+
+# Methods available to resample the values
+REGRID_METHODS = ["nearest", "linear", "idw"]
+
+
+def make_wafer_grid(positions, pitch=None):
+    """
+    Creates a regular grid covering a set of positions.
+
+    Parameters
+    ----------
+    positions : list of tuple
+        The (x, y) positions, for example the positions of get_manifest_positions.
+    pitch : float or tuple of float, optional
+        The distance between two points of the grid, or the (x, y) distances. If None, the smallest distance
+        between two x values is used along x, and between two y values along y.
+
+    Returns
+    -------
+    list
+        The sorted x values of the grid.
+    list
+        The sorted y values of the grid.
+    """
+    positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+    if len(positions) == 0:
+        raise ValueError("No position to make a grid from.")
+
+    if pitch is None or np.ndim(pitch) == 0:
+        pitch = [pitch, pitch]
+
+    grid = []
+    for i in range(2):
+        axis_pitch = pitch[i]
+        if axis_pitch is None:
+            # Each axis has its own pitch, so that the last value of a coarser axis is kept
+            steps = np.diff(np.unique(positions[:, i]))
+            steps = steps[steps > 0]
+            axis_pitch = steps.min() if len(steps) > 0 else 1.0
+        start, stop = positions[:, i].min(), positions[:, i].max()
+        n = int(np.floor((stop - start) / axis_pitch + 1e-6)) + 1
+        grid.append([round(float(start + k * axis_pitch), 1) for k in range(n)])
+
+    return grid[0], grid[1]
+
+
+def _get_neighbors(source_points, target_points, n_neighbors, chunk_size=4096):
+    """
+    Finds the n_neighbors nearest source points of every target point, by chunks of target points to bound the
+    memory used by the distance matrix.
+    """
+    n_neighbors = min(n_neighbors, len(source_points))
+    indices = np.empty((len(target_points), n_neighbors), dtype=np.intp)
+    distances = np.empty((len(target_points), n_neighbors))
+
+    for start in range(0, len(target_points), chunk_size):
+        chunk = target_points[start : start + chunk_size]
+        squared = ((chunk[:, np.newaxis, :] - source_points[np.newaxis]) ** 2).sum(-1)
+        if n_neighbors < len(source_points):
+            nearest = np.argpartition(squared, n_neighbors - 1, axis=1)[:, :n_neighbors]
+        else:
+            nearest = np.broadcast_to(
+                np.arange(len(source_points)), squared.shape
+            ).copy()
+        nearest_squared = np.take_along_axis(squared, nearest, axis=1)
+        # Sorting the neighbors by distance, the first one is the nearest
+        order = np.argsort(nearest_squared, axis=1)
+        indices[start : start + len(chunk)] = np.take_along_axis(nearest, order, 1)
+        distances[start : start + len(chunk)] = np.sqrt(
+            np.take_along_axis(nearest_squared, order, 1)
+        )
+
+    return indices, distances
+
+
+def _get_linear_weights(source_points, target_points):
+    """
+    Computes the barycentric weights of the target points in the Delaunay triangulation of the source points.
+    The target points outside of the convex hull of the source points get no weight.
+    """
+    try:
+        from scipy.spatial import Delaunay
+    except ImportError:
+        raise ImportError(
+            "scipy is needed for the linear regridding, install it with 'pip install scipy'."
+        )
+
+    triangulation = Delaunay(source_points)
+    simplices = triangulation.find_simplex(target_points)
+    inside = simplices >= 0
+
+    # Barycentric coordinates from the affine transforms of the simplices
+    transforms = triangulation.transform[simplices]
+    partial = np.einsum(
+        "nij,nj->ni", transforms[:, :2], target_points - transforms[:, 2]
+    )
+    weights = np.column_stack([partial, 1 - partial.sum(axis=1)])
+    indices = triangulation.simplices[simplices]
+
+    weights[~inside] = 0
+    indices[~inside] = 0
+
+    return indices, weights, inside
+
+
+def compute_regrid_weights(
+    source_points,
+    x_vals,
+    y_vals,
+    method="nearest",
+    n_neighbors=4,
+    power=2,
+    max_distance=None,
+):
+    """
+    Computes the weights resampling values measured at a set of positions onto a grid.
+
+    Parameters
+    ----------
+    source_points : array-like
+        The (n_points, 2) array of the (x, y) positions where the values are measured.
+    x_vals : list of float
+        The x values of the target grid.
+    y_vals : list of float
+        The y values of the target grid.
+    method : str, optional
+        'nearest' takes the value of the nearest position, 'linear' interpolates linearly in the Delaunay
+        triangulation of the positions (needs the optional scipy package) and 'idw' averages the values of the
+        n_neighbors nearest positions with weights 1 / distance**power. Defaults to 'nearest'.
+    n_neighbors : int, optional
+        Only used by 'idw', the number of positions averaged. Defaults to 4.
+    power : float, optional
+        Only used by 'idw', the power of the inverse distance. Defaults to 2.
+    max_distance : float, optional
+        The grid points farther than max_distance from the nearest position are left empty (NaN). The grid points
+        outside of the convex hull of the positions are always empty with 'linear'. If None, there is no limit.
+        Defaults to None.
+
+    Returns
+    -------
+    dict
+        The weights, a dictionary with the keys:
+        - 'indices' : the (n_grid_points, k) indices of the positions used for each point of the grid.
+        - 'weights' : the (n_grid_points, k) weights of these positions, 0 for the empty points.
+        - 'valid' : the (n_grid_points,) mask of the points of the grid which get a value.
+        - 'shape' : the (len(y_vals), len(x_vals)) shape of the grid.
+        - 'x', 'y', 'method' : the grid and the method.
+    """
+    if method not in REGRID_METHODS:
+        raise ValueError(f"Method {method} must be one of {REGRID_METHODS}.")
+
+    source_points = np.asarray(source_points, dtype=np.float64).reshape(-1, 2)
+    if len(source_points) == 0:
+        raise ValueError("No position to regrid from.")
+    grid_x, grid_y = np.meshgrid(
+        np.asarray(x_vals, dtype=np.float64), np.asarray(y_vals, dtype=np.float64)
+    )
+    target_points = np.column_stack([grid_x.ravel(), grid_y.ravel()])
+
+    # The nearest position is also used by 'linear' for max_distance
+    indices, distances = _get_neighbors(
+        source_points, target_points, n_neighbors if method == "idw" else 1
+    )
+    valid = np.ones(len(target_points), dtype=bool)
+    if max_distance is not None:
+        valid &= distances[:, 0] <= max_distance
+
+    if method == "nearest":
+        weights = np.ones_like(distances)
+    elif method == "idw":
+        with np.errstate(divide="ignore"):
+            weights = 1 / distances**power
+        # Grid points on a position take its value
+        exact = distances[:, 0] == 0
+        weights[exact] = 0
+        weights[exact, 0] = 1
+        weights /= weights.sum(axis=1, keepdims=True)
+    else:
+        indices, weights, inside = _get_linear_weights(source_points, target_points)
+        valid &= inside
+
+    weights[~valid] = 0
+
+    return {
+        "indices": indices,
+        "weights": weights,
+        "valid": valid,
+        "shape": (len(y_vals), len(x_vals)),
+        "x": list(x_vals),
+        "y": list(y_vals),
+        "method": method,
+    }
+
+
+def apply_regrid_weights(values, regrid_weights):
+    """
+    Resamples values onto the grid of precomputed weights.
+
+    Parameters
+    ----------
+    values : array-like
+        The values at the positions given to compute_regrid_weights, with the positions along the last dimension,
+        for example (n_points,) or (n_phases, n_points).
+    regrid_weights : dict
+        The weights returned by compute_regrid_weights.
+
+    Returns
+    -------
+    numpy.ndarray
+        The values on the grid, with the shape values.shape[:-1] + (len(y_vals), len(x_vals)).
+
+    Notes
+    -----
+    The NaN values are skipped and the weights of the other positions are normalized, a grid point is NaN if
+    none of its positions has a value.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    indices = regrid_weights["indices"]
+    weights = regrid_weights["weights"]
+
+    gathered = values[..., indices]
+    measured = ~np.isnan(gathered)
+    total = (weights * measured).sum(axis=-1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        result = np.where(measured, gathered * weights, 0).sum(axis=-1) / total
+    result[..., (total == 0) | ~regrid_weights["valid"]] = np.nan
+
+    return result.reshape(values.shape[:-1] + regrid_weights["shape"])
+
+
+def regrid_dataset(data, x_vals, y_vals, method="nearest", **kwargs):
+    """
+    Resamples every (y, x) map of a dataset onto another grid. The weights are computed once and applied to all
+    the variables.
+
+    Parameters
+    ----------
+    data : xarray.Dataset
+        The dataset, its variables having 'y' and 'x' as last dimensions, for example a dataset returned by
+        get_full_dataset. The positions where all the variables are NaN are not used.
+    x_vals : list of float
+        The x values of the target grid.
+    y_vals : list of float
+        The y values of the target grid.
+    method : str, optional
+        The interpolation method, see compute_regrid_weights. Defaults to 'nearest'.
+    **kwargs
+        The options of compute_regrid_weights (n_neighbors, power, max_distance).
+
+    Returns
+    -------
+    xarray.Dataset
+        The dataset on the grid (x_vals, y_vals), with the attributes of the variables and coordinates.
+    """
+    names = [name for name in data.data_vars if data[name].dims[-2:] == ("y", "x")]
+    measured = np.zeros((data.sizes["y"], data.sizes["x"]), dtype=bool)
+    for name in names:
+        values = data[name].values
+        measured |= ~np.isnan(values.reshape((-1,) + measured.shape)).all(axis=0)
+
+    grid_x, grid_y = np.meshgrid(data["x"].values, data["y"].values)
+    source_points = np.column_stack([grid_x[measured], grid_y[measured]])
+    regrid_weights = compute_regrid_weights(
+        source_points, x_vals, y_vals, method, **kwargs
+    )
+
+    coords = {
+        name: coord
+        for name, coord in data.coords.items()
+        if name not in ["x", "y"] and set(coord.dims).isdisjoint(["x", "y"])
+    }
+    regridded = xr.Dataset(coords=coords)
+    regridded["y"] = ("y", list(y_vals), data["y"].attrs)
+    regridded["x"] = ("x", list(x_vals), data["x"].attrs)
+    for name in names:
+        values = data[name].values[..., measured]
+        regridded[name] = xr.DataArray(
+            apply_regrid_weights(values, regrid_weights),
+            dims=data[name].dims,
+            attrs=data[name].attrs,
+        )
+    regridded.attrs = dict(data.attrs)
+    regridded.attrs["regrid_method"] = method
+
+    return regridded
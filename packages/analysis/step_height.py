@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+"""
+Step height (film thickness) of the profilometer profiles: detection of the
+step and levelling of the profiles, computed for batches of profiles at once.
+
+@author: williamrigaut
+"""
+import numpy as np
+from packages.readers.inspect_hdf5 import inspect
+from packages.readers.read_profil import iter_profiles
+from packages.readers.lazy_import import lazy_import
+
+xr = lazy_import("xarray")
+
+# Length units of the profiles and heights, in meters
+LENGTH_UNITS = {
+    "m": 1.0,
+    "mm": 1e-3,
+    "um": 1e-6,
+    "µm": 1e-6,
+    "μm": 1e-6,
+    "nm": 1e-9,
+    "A": 1e-10,
+    "Å": 1e-10,
+    "angstrom": 1e-10,
+    "pm": 1e-12,
+}
+
+
+def _get_window_sums(values, window):
+    """
+    Returns the sums of the values in the windows [i - window, i) and [i, i + window) for every point i.
+    """
+    cumsum = np.zeros(values.shape[:-1] + (values.shape[-1] + 1,))
+    np.cumsum(values, axis=-1, out=cumsum[..., 1:])
+    n = values.shape[-1]
+    index = np.arange(n)
+    before = cumsum[..., index] - cumsum[..., np.clip(index - window, 0, n)]
+    after = cumsum[..., np.clip(index + window, 0, n)] - cumsum[..., index]
+
+    return before, after
+
+
+def detect_steps(profile, window=20):
+    """
+    Finds the position of the step of each profile, where the mean heights before and after the point differ the most.
+
+    Parameters
+    ----------
+    profile : numpy.ndarray
+        The (n_profiles, n_points) heights, NaN values are ignored.
+    window : int, optional
+        The number of points averaged on each side of the step. Defaults to 20.
+
+    Returns
+    -------
+    numpy.ndarray
+        The (n_profiles,) index of the first point after the step, -1 if the profile is shorter than 2 * window points.
+    """
+    profile = np.atleast_2d(np.asarray(profile, dtype=np.float64))
+    measured = ~np.isnan(profile)
+
+    sum_before, sum_after = _get_window_sums(np.where(measured, profile, 0), window)
+    count_before, count_after = _get_window_sums(measured.astype(np.float64), window)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        contrast = np.abs(sum_after / count_after - sum_before / count_before)
+    # Only the points with full windows on both sides are candidates
+    contrast[(count_before < window) | (count_after < window)] = -np.inf
+
+    step_index = np.argmax(contrast, axis=-1)
+    step_index[np.isneginf(contrast.max(axis=-1))] = -1
+
+    return step_index
+
+
+def fit_steps(distance, profile, step_index, margin=20):
+    """
+    Fits the profiles with a tilted baseline and a step: height = slope * distance + offset + step * (index >= step_index).
+    The tilt is fitted on both sides of the step at once, so it does not matter on which side the film is.
+
+    Parameters
+    ----------
+    distance : numpy.ndarray
+        The (n_profiles, n_points) distances along the scans.
+    profile : numpy.ndarray
+        The (n_profiles, n_points) heights, NaN values are ignored.
+    step_index : numpy.ndarray
+        The (n_profiles,) index of the step, see detect_steps.
+    margin : int, optional
+        The number of points on each side of the step left out of the fit (edge of the film). Defaults to 20.
+
+    Returns
+    -------
+    dict
+        The (n_profiles,) arrays 'step' (height after the step minus height before), 'slope', 'offset' and
+        'residual' (root mean square of the residuals), NaN for the profiles without step.
+    """
+    distance = np.atleast_2d(np.asarray(distance, dtype=np.float64))
+    profile = np.atleast_2d(np.asarray(profile, dtype=np.float64))
+    step_index = np.asarray(step_index)[:, np.newaxis]
+    index = np.arange(profile.shape[-1])
+
+    used = (
+        ~np.isnan(profile)
+        & ~np.isnan(distance)
+        & (np.abs(index - step_index) >= margin)
+        & (step_index >= 0)
+    )
+    # Basis of the fit (distance, 1, step) for every point, the unused points have no weight
+    basis = np.stack(
+        [
+            np.where(used, distance, 0),
+            used.astype(np.float64),
+            used & (index >= step_index),
+        ],
+        axis=-1,
+    ).astype(np.float64)
+    heights = np.where(used, profile, 0)
+
+    # Normal equations of all the profiles, solved at once
+    gram = np.einsum("npi,npj->nij", basis, basis)
+    moments = np.einsum("npi,np->ni", basis, heights)
+    solution = np.einsum("nij,nj->ni", np.linalg.pinv(gram), moments)
+
+    n_used = used.sum(axis=-1)
+    residuals = np.where(used, profile - np.einsum("npi,ni->np", basis, solution), 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        residual = np.sqrt((residuals**2).sum(axis=-1) / n_used)
+
+    # Profiles without enough points on each side of the step
+    failed = ((used & (index >= step_index)).sum(axis=-1) < 2) | (
+        (used & (index < step_index)).sum(axis=-1) < 2
+    )
+    fit = {
+        "slope": solution[:, 0],
+        "offset": solution[:, 1],
+        "step": solution[:, 2],
+        "residual": residual,
+    }
+    for key in fit:
+        fit[key][failed] = np.nan
+
+    return fit
+
+
+def level_profiles(distance, profile, slope, offset):
+    """
+    Removes the tilted baseline fitted by fit_steps from the profiles.
+
+    Returns
+    -------
+    numpy.ndarray
+        The (n_profiles, n_points) levelled heights, the substrate is at 0.
+    """
+    return (
+        np.asarray(profile)
+        - np.asarray(slope)[:, np.newaxis] * np.asarray(distance)
+        - np.asarray(offset)[:, np.newaxis]
+    )
+
+
+def compute_step_heights(distance, profile, window=20, margin=None):
+    """
+    Detects the step of a batch of profiles and fits their baseline and step height.
+
+    Parameters
+    ----------
+    distance : numpy.ndarray
+        The (n_profiles, n_points) distances along the scans.
+    profile : numpy.ndarray
+        The (n_profiles, n_points) heights, NaN values are ignored.
+    window : int, optional
+        The number of points averaged on each side of the step to detect it. Defaults to 20.
+    margin : int, optional
+        The number of points around the step left out of the fit. If None, window is used.
+
+    Returns
+    -------
+    dict
+        The (n_profiles,) arrays 'step_height' (absolute height of the step), 'step_position' (distance of the step),
+        'slope', 'offset' and 'residual', see fit_steps.
+    """
+    distance = np.atleast_2d(np.asarray(distance, dtype=np.float64))
+    profile = np.atleast_2d(np.asarray(profile, dtype=np.float64))
+    step_index = detect_steps(profile, window)
+    fit = fit_steps(distance, profile, step_index, window if margin is None else margin)
+
+    rows = np.arange(len(step_index))
+    fit["step_position"] = np.where(
+        step_index >= 0, distance[rows, np.clip(step_index, 0, None)], np.nan
+    )
+    fit["step_height"] = np.abs(fit.pop("step"))
+
+    return fit
+
+
+def _get_length_factor(units, target_units):
+    """
+    Returns the factor converting lengths from units to target_units, raises a ValueError if one of the units
+    is not a known length unit.
+    """
+    if units == target_units:
+        return 1.0
+    for value in [units, target_units]:
+        if value not in LENGTH_UNITS:
+            raise ValueError(
+                f"Cannot convert the heights from {units} to {target_units}, {value} is not one of {list(LENGTH_UNITS)}."
+            )
+
+    return LENGTH_UNITS[units] / LENGTH_UNITS[target_units]
+
+
+def get_thickness_map(
+    hdf5_file, batch_size=64, window=20, margin=None, exclude_wafer_edges=True
+):
+    """
+    Recomputes the film thickness of every position of a wafer from the profilometer profiles, read by batches.
+
+    Parameters
+    ----------
+    hdf5_file : str, pathlib.Path or file-like object
+        The path to the HDF5 file.
+    batch_size : int, optional
+        The number of profiles read and fitted at once. Defaults to 64.
+    window : int, optional
+        The number of points averaged on each side of the step to detect it. Defaults to 20.
+    margin : int, optional
+        The number of points around the step left out of the fit. If None, window is used.
+    exclude_wafer_edges : bool, optional
+        If True, the positions at the edges of the wafer are skipped. Defaults to True.
+
+    Returns
+    -------
+    xarray.Dataset
+        A dataset with the (y, x) maps 'step_height', 'step_position', 'slope', 'offset' and 'residual', along
+        with the 'measured_height' saved in the file, converted to the units of the profiles, and the
+        'height_difference' between both.
+
+    Raises
+    ------
+    ValueError
+        If the units of the measured heights cannot be converted to the units of the profiles.
+
+    Examples
+    --------
+    >>> thickness = get_thickness_map(hdf5_file)
+    >>> thickness["height_difference"].plot()
+    """
+    results = {}
+    for positions, distance, profile, measured_height in iter_profiles(
+        hdf5_file, batch_size, exclude_wafer_edges
+    ):
+        fit = compute_step_heights(distance, profile, window, margin)
+        fit["measured_height"] = measured_height
+        for i, position in enumerate(positions):
+            results[position] = {key: values[i] for key, values in fit.items()}
+
+    if len(results) == 0:
+        raise ValueError(f"No PROFIL profile found in {hdf5_file}.")
+
+    x_vals = sorted(set(x for x, _ in results))
+    y_vals = sorted(set(y for _, y in results))
+    x_index = {x: i for i, x in enumerate(x_vals)}
+    y_index = {y: j for j, y in enumerate(y_vals)}
+    names = [
+        "step_height",
+        "step_position",
+        "slope",
+        "offset",
+        "residual",
+        "measured_height",
+    ]
+
+    maps = {name: np.full((len(y_vals), len(x_vals)), np.nan) for name in names}
+    for (x, y), values in results.items():
+        for name in names:
+            maps[name][y_index[y], x_index[x]] = values[name]
+
+    data = xr.Dataset(
+        {name: (["y", "x"], values) for name, values in maps.items()},
+        coords={"y": y_vals, "x": x_vals},
+    )
+
+    # Units of the profiles, the measured heights are converted to the units of the profiles
+    variables = inspect(hdf5_file)["techniques"]["PROFIL"]["variables"]
+    height_units = variables.get("measurement/profile", {}).get("units", None)
+    distance_units = variables.get("measurement/distance", {}).get("units", None)
+    measured_units = variables.get("results/measured_height", {}).get("units", None)
+    if height_units not in [None, "None"] and measured_units not in [None, "None"]:
+        data["measured_height"] = data["measured_height"] * _get_length_factor(
+            measured_units, height_units
+        )
+    elif measured_units != height_units:
+        print(
+            "Warning, the units of the measured heights or of the profiles are missing, the heights are compared as read."
+        )
+    data["height_difference"] = data["step_height"] - data["measured_height"]
+
+    units = {
+        "step_height": height_units,
+        "offset": height_units,
+        "residual": height_units,
+        "measured_height": height_units,
+        "height_difference": height_units,
+        "step_position": distance_units,
+        "slope": f"{height_units}/{distance_units}",
+        "x": variables["instrument/x_pos"]["units"],
+        "y": variables["instrument/y_pos"]["units"],
+    }
+    for name, value in units.items():
+        if value is not None and "None" not in value:
+            data[name].attrs["units"] = value
+
+    return data
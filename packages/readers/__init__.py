@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Readers of the HDF5 files of high-throughput experiments.
+
+The submodules and their main functions are imported on first use (PEP 562),
+so that importing the package, or reading the metadata of a file, does not
+import xarray, pandas or the readers which are not used.
+
+@author: williamrigaut
+"""
+import importlib
+
+# Functions available from the package, as {name: submodule}
+_LAZY_FUNCTIONS = {
+    "open_hdf5": "hdf5_io",
+    "set_hdf5_options": "hdf5_io",
+    "use_hdf5_options": "hdf5_io",
+    "inspect": "inspect_hdf5",
+    "inspect_folder": "inspect_hdf5",
+    "get_manifest_positions": "inspect_hdf5",
+    "get_edx_composition": "read_edx",
+    "get_edx_spectrum": "read_edx",
+    "get_moke_results": "read_moke",
+    "get_moke_loop": "read_moke",
+    "get_xrd_results": "read_xrd",
+    "get_xrd_pattern": "read_xrd",
+    "get_xrd_image": "read_xrd",
+    "get_thickness": "read_profil",
+    "get_profile": "read_profil",
+    "iter_profiles": "read_profil",
+    "get_full_dataset": "read_hdf5",
+    "refresh_full_dataset": "read_hdf5",
+    "get_measurement_data": "read_hdf5",
+    "search_measurement_data_from_type": "read_hdf5",
+    "create_simplified_dataset": "read_hdf5",
+    "save_dataset": "read_hdf5",
+    "create_pyramid_dataset": "pyramid",
+    "create_virtual_dataset": "virtual_dataset",
+    "get_virtual_cube": "virtual_dataset",
+    "convert_wafer": "convert",
+    "update_catalog": "catalog",
+    "query_catalog": "catalog",
+    "load_full_dataset_async": "read_async",
+    "gather_full_datasets": "read_async",
+}
+
+# Submodules of the package
+_SUBMODULES = [
+    "catalog",
+    "convert",
+    "hdf5_io",
+    "inspect_hdf5",
+    "lazy_import",
+    "pyramid",
+    "read_async",
+    "read_cache",
+    "read_edx",
+    "read_hdf5",
+    "read_moke",
+    "read_plan",
+    "read_profil",
+    "read_xrd",
+    "virtual_dataset",
+    "watch_folder",
+]
+
+__all__ = list(_LAZY_FUNCTIONS) + _SUBMODULES
+
+
+def __getattr__(name):
+    """
+    Imports a submodule, or the submodule of a function, the first time it is used.
+    """
+    if name in _SUBMODULES:
+        return importlib.import_module(f"{__name__}.{name}")
+    if name in _LAZY_FUNCTIONS:
+        module = importlib.import_module(f"{__name__}.{_LAZY_FUNCTIONS[name]}")
+        value = getattr(module, name)
+        # Next accesses do not go through __getattr__
+        globals()[name] = value
+        return value
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
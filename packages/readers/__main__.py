@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+Command-line batch converter for HDF5 files from high-throughput experiments.
+
+Usage:
+    python -m packages.readers "data/*.hdf5" [--outputs results simplified] [--workers 4]
+
+The completed conversions are recorded in a checkpoint file, so that an
+interrupted run started again with the same checkpoint only converts the
+remaining files.
+
+@author: williamrigaut
+"""
+import argparse
+import glob
+import json
+import os
+import pathlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tqdm import tqdm
+from packages.readers.convert import OUTPUT_SUFFIXES, convert_wafer, is_converted_file
+
+
+def read_checkpoint(checkpoint_file):
+    """
+    Reads the conversions already completed from a checkpoint file.
+
+    Parameters
+    ----------
+    checkpoint_file : str or pathlib.Path
+        The path to the checkpoint file, one JSON record per line.
+
+    Returns
+    -------
+    dict
+        A dictionary with the (file, output) tuples as keys and the (size, modification time) of the converted file as values.
+    """
+    completed = {}
+    if not os.path.exists(checkpoint_file):
+        return completed
+
+    with open(checkpoint_file, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Last line truncated by an interruption
+                continue
+            for output in record["outputs"]:
+                completed[(record["file"], output)] = (record["size"], record["mtime"])
+
+    return completed
+
+
+def write_checkpoint(checkpoint_file, hdf5_file, outputs):
+    """
+    Appends a completed conversion to a checkpoint file.
+
+    Parameters
+    ----------
+    checkpoint_file : str or pathlib.Path
+        The path to the checkpoint file.
+    hdf5_file : str or pathlib.Path
+        The converted HDF5 file.
+    outputs : dict
+        The written outputs, as returned by convert_wafer.
+    """
+    stat = os.stat(hdf5_file)
+    record = {
+        "file": str(pathlib.Path(hdf5_file).resolve()),
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "outputs": outputs,
+    }
+    with open(checkpoint_file, "a") as f:
+        f.write(json.dumps(record) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+    return None
+
+
+def get_pending_files(patterns, outputs, completed):
+    """
+    Lists the files matching the glob patterns that still need to be converted.
+
+    Parameters
+    ----------
+    patterns : list of str
+        The glob patterns of the HDF5 files.
+    outputs : list of str
+        The outputs to write for every file.
+    completed : dict
+        The completed conversions, see read_checkpoint.
+
+    Returns
+    -------
+    list
+        A list of (file, outputs) tuples with the outputs missing for each file.
+    """
+    files = sorted(
+        set(
+            pathlib.Path(name).resolve()
+            for pattern in patterns
+            for name in glob.glob(pattern, recursive=True)
+        )
+    )
+
+    pending = []
+    for hdf5_file in files:
+        if is_converted_file(hdf5_file):
+            continue
+        stat = hdf5_file.stat()
+        missing = [
+            output
+            for output in outputs
+            if completed.get((str(hdf5_file), output), None)
+            != (stat.st_size, stat.st_mtime)
+        ]
+        if len(missing) > 0:
+            pending.append((hdf5_file, missing))
+
+    return pending
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m packages.readers",
+        description="Convert HDF5 wafer files in parallel.",
+    )
+    parser.add_argument(
+        "patterns", nargs="+", help="Glob patterns of the HDF5 files to convert."
+    )
+    parser.add_argument(
+        "--outputs",
+        nargs="+",
+        choices=sorted(OUTPUT_SUFFIXES.keys()),
+        default=["results"],
+        help="Outputs to write for every file.",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count(), help="Number of processes."
+    )
+    parser.add_argument(
+        "--output-dir",
+        default=None,
+        help="Folder of the outputs, next to the sources if not given.",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        default="convert_checkpoint.jsonl",
+        help="Checkpoint file used to resume an interrupted run.",
+    )
+    args = parser.parse_args(argv)
+
+    if args.output_dir is not None:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    completed = read_checkpoint(args.checkpoint)
+    pending = get_pending_files(args.patterns, args.outputs, completed)
+    print(f"{len(pending)} files to convert")
+
+    failed = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {
+            executor.submit(
+                convert_wafer, hdf5_file, outputs, args.output_dir
+            ): hdf5_file
+            for hdf5_file, outputs in pending
+        }
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            hdf5_file = futures[future]
+            try:
+                written = future.result()
+            except Exception as error:
+                tqdm.write(f"Warning, conversion of {hdf5_file} failed: {error}")
+                failed += 1
+                continue
+            write_checkpoint(args.checkpoint, hdf5_file, written)
+
+    return 1 if failed > 0 else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,447 @@
+# -*- coding: utf-8 -*-
+"""
+Functions to build and query a SQLite catalog of the results of many HDF5
+files from high-throughput experiments.
+
+@author: williamrigaut
+"""
+import contextlib
+import datetime
+import json
+import math
+import os
+import pathlib
+import sqlite3
+import h5py
+from packages.readers.hdf5_io import open_hdf5
+from packages.readers.read_hdf5 import get_full_dataset
+from packages.readers.inspect_hdf5 import inspect, parse_position
+from packages.readers.lazy_import import lazy_import
+
+pd = lazy_import("pandas")
+
+# Comparison operators accepted in the queries
+OPERATORS = ["<", "<=", ">", ">=", "=", "!="]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    file_id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    size INTEGER,
+    mtime REAL,
+    indexed TEXT,
+    manifest TEXT,
+    exclude_wafer_edges INTEGER
+);
+CREATE TABLE IF NOT EXISTS results (
+    file_id INTEGER NOT NULL,
+    x REAL NOT NULL,
+    y REAL NOT NULL,
+    variable TEXT NOT NULL,
+    value REAL,
+    units TEXT
+);
+CREATE TABLE IF NOT EXISTS datasets (
+    file_id INTEGER NOT NULL,
+    technique TEXT NOT NULL,
+    x REAL NOT NULL,
+    y REAL NOT NULL,
+    variable TEXT NOT NULL,
+    path TEXT NOT NULL,
+    shape TEXT,
+    dtype TEXT
+);
+CREATE INDEX IF NOT EXISTS results_variable ON results (variable, value);
+CREATE INDEX IF NOT EXISTS results_position ON results (file_id, x, y);
+CREATE INDEX IF NOT EXISTS datasets_position ON datasets (file_id, technique, x, y);
+"""
+
+
+@contextlib.contextmanager
+def _connect(catalog_file):
+    """
+    Opens a connection to the catalog, committed and closed when leaving the context.
+    """
+    connection = sqlite3.connect(catalog_file)
+    try:
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+
+def _json_default(value):
+    """
+    Converts the tuples and numpy types of a manifest for json.
+    """
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    return str(value)
+
+
+def _remove_file(connection, file_id):
+    """
+    Removes all the rows of a file from the catalog.
+    """
+    connection.execute("DELETE FROM results WHERE file_id = ?", (file_id,))
+    connection.execute("DELETE FROM datasets WHERE file_id = ?", (file_id,))
+    connection.execute("DELETE FROM files WHERE file_id = ?", (file_id,))
+
+    return None
+
+
+def _get_partial_datasets(hdf5_file, manifest):
+    """
+    Finds the positions containing the datasets of a manifest which are not measured at every position.
+
+    Returns
+    -------
+    dict
+        A dictionary with the techniques as keys and sets of ((x, y), variable) as values, only for the
+        techniques having such datasets.
+    """
+    partial = {}
+
+    with open_hdf5(hdf5_file) as h5f:
+        for technique, content in manifest["techniques"].items():
+            variables = set(
+                variable
+                for variable, info in content["variables"].items()
+                if info["count"] != content["n_positions"]
+            )
+            if len(variables) == 0:
+                continue
+            found = set()
+
+            def visit(name, info):
+                position_name, _, relative_path = name.decode("utf-8").partition("/")
+                if relative_path in variables and info.type == h5py.h5o.TYPE_DATASET:
+                    position = parse_position(position_name)
+                    if position is not None:
+                        found.add((position, relative_path))
+
+                return None
+
+            # Same low level walk as inspect, only the names are read
+            h5py.h5o.visit(h5f[content["group"]].id, visit, info=True)
+            partial[technique] = found
+
+    return partial
+
+
+def _create_tables(connection):
+    """
+    Creates the tables of the catalog, and adds the columns missing from catalogs made by older versions.
+    """
+    connection.executescript(SCHEMA)
+    columns = [row[1] for row in connection.execute("PRAGMA table_info(files)")]
+    if "exclude_wafer_edges" not in columns:
+        connection.execute("ALTER TABLE files ADD COLUMN exclude_wafer_edges INTEGER")
+
+    return None
+
+
+def add_file_to_catalog(connection, hdf5_file, exclude_wafer_edges=False):
+    """
+    Adds the metadata, results and dataset locations of an HDF5 file to an opened catalog.
+
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+        The connection to the catalog.
+    hdf5_file : str or pathlib.Path
+        The path to the HDF5 file to add.
+    exclude_wafer_edges : bool, optional
+        If True, the results measured at the edges of the wafer are not added. Defaults to False.
+
+    Returns
+    -------
+    int
+        The id of the file in the catalog.
+    """
+    path = str(pathlib.Path(hdf5_file).resolve())
+    stat = os.stat(path)
+    manifest = inspect(path)
+
+    row = connection.execute(
+        "SELECT file_id FROM files WHERE path = ?", (path,)
+    ).fetchone()
+    if row is not None:
+        _remove_file(connection, row[0])
+
+    cursor = connection.execute(
+        "INSERT INTO files (path, size, mtime, indexed, manifest, exclude_wafer_edges) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        (
+            path,
+            stat.st_size,
+            stat.st_mtime,
+            datetime.datetime.now().isoformat(),
+            json.dumps(manifest, default=_json_default),
+            int(exclude_wafer_edges),
+        ),
+    )
+    file_id = cursor.lastrowid
+
+    # Scalar results of every position
+    data = get_full_dataset(path, exclude_wafer_edges=exclude_wafer_edges)
+    rows = []
+    for variable in data.data_vars:
+        values = data[variable].values
+        units = data[variable].attrs.get("units", None)
+        units = None if units is None else str(units)
+        for i, y in enumerate(data["y"].values):
+            for j, x in enumerate(data["x"].values):
+                if not math.isnan(values[i, j]):
+                    rows.append(
+                        (
+                            file_id,
+                            float(x),
+                            float(y),
+                            variable,
+                            float(values[i, j]),
+                            units,
+                        )
+                    )
+    connection.executemany("INSERT INTO results VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    # Location of the datasets of every position, the datasets missing at some positions are only recorded
+    # where they are found
+    partial = _get_partial_datasets(path, manifest)
+    rows = []
+    for technique, content in manifest["techniques"].items():
+        found = partial.get(technique, None)
+        for x, y in content["positions"]:
+            position_group = f"{content['group']}/({x},{y})"
+            for variable, info in content["variables"].items():
+                if found is not None and info["count"] != content["n_positions"]:
+                    if ((x, y), variable) not in found:
+                        continue
+                rows.append(
+                    (
+                        file_id,
+                        technique,
+                        x,
+                        y,
+                        variable,
+                        f"{position_group}/{variable}",
+                        json.dumps(list(info["shape"])),
+                        info["dtype"],
+                    )
+                )
+    connection.executemany("INSERT INTO datasets VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    return file_id
+
+
+def update_catalog(catalog_file, hdf5_files, exclude_wafer_edges=False):
+    """
+    Adds HDF5 files to a catalog, creating it if needed. Files already in the catalog are only read again
+    if their size, modification time or exclude_wafer_edges changed.
+
+    Parameters
+    ----------
+    catalog_file : str or pathlib.Path
+        The path to the SQLite catalog.
+    hdf5_files : list of str or pathlib.Path
+        The paths to the HDF5 files to add.
+    exclude_wafer_edges : bool, optional
+        If True, the results measured at the edges of the wafer are not added. Defaults to False, so that
+        the catalog indexes every position of the library.
+
+    Returns
+    -------
+    list
+        The paths of the files that were (re)indexed.
+    """
+    indexed = []
+
+    with _connect(catalog_file) as connection:
+        _create_tables(connection)
+
+        for hdf5_file in hdf5_files:
+            path = str(pathlib.Path(hdf5_file).resolve())
+            stat = os.stat(path)
+            row = connection.execute(
+                "SELECT size, mtime, exclude_wafer_edges FROM files WHERE path = ?",
+                (path,),
+            ).fetchone()
+            if row is not None and tuple(row) == (
+                stat.st_size,
+                stat.st_mtime,
+                int(exclude_wafer_edges),
+            ):
+                continue
+
+            try:
+                add_file_to_catalog(connection, path, exclude_wafer_edges)
+            except (OSError, KeyError, ValueError) as error:
+                print(f"Warning, {path} could not be indexed: {error}")
+                continue
+            # Committing each file so that an interrupted update keeps the files already indexed
+            connection.commit()
+            indexed.append(path)
+
+    return indexed
+
+
+def remove_missing_files(catalog_file):
+    """
+    Removes the files that do not exist anymore from a catalog.
+
+    Parameters
+    ----------
+    catalog_file : str or pathlib.Path
+        The path to the SQLite catalog.
+
+    Returns
+    -------
+    list
+        The paths of the removed files.
+    """
+    removed = []
+
+    with _connect(catalog_file) as connection:
+        for file_id, path in connection.execute(
+            "SELECT file_id, path FROM files"
+        ).fetchall():
+            if not os.path.exists(path):
+                _remove_file(connection, file_id)
+                removed.append(path)
+
+    return removed
+
+
+def query_catalog(catalog_file, conditions, variables=None):
+    """
+    Finds the positions of all the files of a catalog matching conditions on their results.
+
+    Parameters
+    ----------
+    catalog_file : str or pathlib.Path
+        The path to the SQLite catalog.
+    conditions : list of tuples
+        The conditions as (variable, operator, value) tuples, all of them must be true.
+        For example [("Nd Composition", ">", 12), ("coercivity_m0", ">", 1)], the compositions are in at.%.
+    variables : list of str, optional
+        Other variables to return for the matching positions. Missing values are NaN.
+
+    Returns
+    -------
+    pandas.DataFrame
+        A DataFrame with the columns 'file', 'x', 'y' and one column per variable of the conditions and variables.
+
+    Examples
+    --------
+    >>> query_catalog("library.sqlite", [("Nd Composition", ">", 12), ("coercivity_m0", ">", 1)])
+    """
+    if len(conditions) == 0:
+        raise ValueError("At least one condition is needed.")
+    variables = [] if variables is None else list(variables)
+
+    condition_variables = []
+    for variable, operator, _ in conditions:
+        if operator not in OPERATORS:
+            raise ValueError(f"Operator {operator} must be one of {OPERATORS}.")
+        if variable not in condition_variables:
+            condition_variables.append(variable)
+    variables = [
+        variable for variable in variables if variable not in condition_variables
+    ]
+
+    # One join of the results table per variable, the first condition drives the query through the index
+    aliases = {variable: f"r{i}" for i, variable in enumerate(condition_variables)}
+    aliases.update({variable: f"v{i}" for i, variable in enumerate(variables)})
+    first = aliases[condition_variables[0]]
+    parameters = [condition_variables[0]]
+    joins = []
+    for variable in condition_variables[1:]:
+        alias = aliases[variable]
+        joins.append(
+            f"JOIN results {alias} ON {alias}.file_id = {first}.file_id "
+            f"AND {alias}.x = {first}.x AND {alias}.y = {first}.y AND {alias}.variable = ?"
+        )
+        parameters.append(variable)
+    for variable in variables:
+        alias = aliases[variable]
+        joins.append(
+            f"LEFT JOIN results {alias} ON {alias}.file_id = {first}.file_id "
+            f"AND {alias}.x = {first}.x AND {alias}.y = {first}.y AND {alias}.variable = ?"
+        )
+        parameters.append(variable)
+
+    where = [f"{first}.variable = ?"]
+    where_parameters = []
+    for variable, operator, value in conditions:
+        where.append(f"{aliases[variable]}.value {operator} ?")
+        where_parameters.append(value)
+
+    columns = ", ".join(
+        f"{aliases[variable]}.value AS c{i}"
+        for i, variable in enumerate(condition_variables + variables)
+    )
+    query = (
+        f"SELECT f.path, {first}.x, {first}.y, {columns} FROM results {first} "
+        f"JOIN files f ON f.file_id = {first}.file_id "
+        + " ".join(joins)
+        + " WHERE "
+        + " AND ".join(where)
+        + f" ORDER BY f.path, {first}.y, {first}.x"
+    )
+    # The parameters of the joins come before the ones of the where clause
+    parameters = parameters[1:] + [parameters[0]] + where_parameters
+
+    with _connect(catalog_file) as connection:
+        rows = connection.execute(query, parameters).fetchall()
+
+    return pd.DataFrame(
+        rows, columns=["file", "x", "y"] + condition_variables + variables
+    ).astype({variable: float for variable in condition_variables + variables})
+
+
+def get_dataset_locations(catalog_file, hdf5_file, technique, x_pos, y_pos):
+    """
+    Returns the location of the datasets measured at a position, as stored in a catalog.
+
+    Parameters
+    ----------
+    catalog_file : str or pathlib.Path
+        The path to the SQLite catalog.
+    hdf5_file : str or pathlib.Path
+        The path to the HDF5 file.
+    technique : str
+        The type of data, either 'EDX', 'MOKE', 'XRD' or 'PROFIL'.
+    x_pos : float
+        The x position of the measurement.
+    y_pos : float
+        The y position of the measurement.
+
+    Returns
+    -------
+    dict
+        A dictionary with the dataset paths relative to the position group as keys and
+        dictionaries with the 'path' in the file, 'shape' and 'dtype' as values.
+    """
+    path = str(pathlib.Path(hdf5_file).resolve())
+
+    with _connect(catalog_file) as connection:
+        rows = connection.execute(
+            "SELECT d.variable, d.path, d.shape, d.dtype FROM datasets d "
+            "JOIN files f ON f.file_id = d.file_id "
+            "WHERE f.path = ? AND d.technique = ? AND d.x = ? AND d.y = ?",
+            (
+                path,
+                technique.upper(),
+                round(float(x_pos), 1),
+                round(float(y_pos), 1),
+            ),
+        ).fetchall()
+
+    return {
+        variable: {
+            "path": dataset_path,
+            "shape": tuple(json.loads(shape)),
+            "dtype": dtype,
+        }
+        for variable, dataset_path, shape, dtype in rows
+    }
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Functions to convert HDF5 files from high-throughput experiments into
+simplified datasets and results maps.
+
+@author: williamrigaut
+"""
+import os
+import pathlib
+from packages.readers.read_hdf5 import (
+    get_full_dataset,
+    get_measurement_data,
+    create_simplified_dataset,
+    save_dataset,
+)
+from packages.readers.virtual_dataset import create_virtual_dataset
+
+# Suffixes of the files written by the conversion, they must never be converted again
+OUTPUT_SUFFIXES = {
+    "simplified": "_simplified.hdf5",
+    "results": "_results.hdf5",
+    "measurement": "_measurement.hdf5",
+    "virtual": "_virtual.hdf5",
+}
+
+
+def is_converted_file(hdf5_file):
+    """
+    Checks if a file is an output of convert_wafer.
+
+    Parameters
+    ----------
+    hdf5_file : str or pathlib.Path
+        The path to the HDF5 file.
+
+    Returns
+    -------
+    bool
+        True if the file name ends with one of the conversion suffixes.
+    """
+    name = pathlib.Path(hdf5_file).name
+    return any(name.endswith(suffix) for suffix in OUTPUT_SUFFIXES.values())
+
+
+def get_output_path(hdf5_file, output, output_dir=None):
+    """
+    Builds the path of a conversion output from the path of the source file.
+
+    Parameters
+    ----------
+    hdf5_file : str or pathlib.Path
+        The path to the source HDF5 file.
+    output : str
+        The type of output, one of the keys of OUTPUT_SUFFIXES.
+    output_dir : str or pathlib.Path, optional
+        The folder where the output is written. If None, the output is written next to the source file.
+
+    Returns
+    -------
+    pathlib.Path
+        The path to the output file.
+    """
+    hdf5_file = pathlib.Path(hdf5_file)
+    output_dir = hdf5_file.parent if output_dir is None else pathlib.Path(output_dir)
+
+    return output_dir / f"{hdf5_file.stem}{OUTPUT_SUFFIXES[output]}"
+
+
+def convert_wafer(hdf5_file, outputs=("simplified", "results"), output_dir=None):
+    """
+    Converts an HDF5 file into a simplified dataset (see create_simplified_dataset), a results map (see get_full_dataset),
+    the measurement data of every technique (see get_measurement_data) and/or a virtual dataset view of the
+    measurements (see virtual_dataset.create_virtual_dataset).
+
+    Parameters
+    ----------
+    hdf5_file : str or pathlib.Path
+        The path to the HDF5 file to convert.
+    outputs : list of str, optional
+        The outputs to write, 'simplified', 'results', 'measurement' and/or 'virtual'. Defaults to 'simplified' and 'results'.
+    output_dir : str or pathlib.Path, optional
+        The folder where the outputs are written. If None, the outputs are written next to the source file.
+
+    Returns
+    -------
+    dict
+        A dictionary with the path of each written output.
+
+    Notes
+    -----
+    The outputs are written to temporary '.part' files next to their final paths and renamed once all of them
+    are written, so that a failed conversion leaves no partial output and keeps the outputs of a previous conversion.
+    """
+    written = {}
+    tmp_files = {}
+
+    try:
+        for output in outputs:
+            save_file = get_output_path(hdf5_file, output, output_dir)
+            tmp_file = save_file.with_name(f"{save_file.name}.part")
+            tmp_files[output] = tmp_file
+
+            if output == "simplified":
+                create_simplified_dataset(hdf5_file, tmp_file)
+            elif output == "results":
+                data = get_full_dataset(hdf5_file)
+                save_dataset(data, tmp_file)
+            elif output == "measurement":
+                measurement_tree = get_measurement_data(hdf5_file, "all")
+                for i, data_type in enumerate(measurement_tree.children):
+                    save_dataset(
+                        measurement_tree[data_type].to_dataset(),
+                        tmp_file,
+                        group=data_type,
+                        mode="w" if i == 0 else "a",
+                    )
+            elif output == "virtual":
+                create_virtual_dataset(hdf5_file, tmp_file)
+            else:
+                raise ValueError(f"Unknown output {output}.")
+
+            written[output] = str(save_file)
+
+        for output, tmp_file in tmp_files.items():
+            # No file is written for the measurement output of a file without measurements
+            if tmp_file.exists():
+                os.replace(tmp_file, written[output])
+    finally:
+        for tmp_file in tmp_files.values():
+            if tmp_file.exists():
+                tmp_file.unlink()
+
+    return written
@@ -0,0 +1,443 @@
+# -*- coding: utf-8 -*-
+"""
+Low level functions shared by the readers to access HDF5 datasets.
+
+@author: williamrigaut
+"""
+import contextlib
+import contextvars
+import threading
+import time
+import h5py
+import numpy as np
+
+# Options given to h5py.File when the readers open a file. The HT files contain thousands of
+# small groups and datasets: a larger raw data chunk cache (with a prime number of slots) keeps
+# the chunks of the XRD images in memory, and a page buffer avoids small metadata reads on
+# files written with the paged file space strategy (it has no effect on other files).
+DEFAULT_HDF5_OPTIONS = {
+    "driver": None,
+    "libver": None,
+    "rdcc_nbytes": 32 * 1024**2,
+    "rdcc_nslots": 10007,
+    "rdcc_w0": 0.75,
+    "page_buf_size": None,
+}
+
+_hdf5_options = dict(DEFAULT_HDF5_OPTIONS)
+# Options of use_hdf5_options, local to the thread (and asyncio task) setting them
+_context_hdf5_options = contextvars.ContextVar("hdf5_options", default=None)
+
+# Options given to fsspec.open for the files read from URLs, see set_fsspec_options
+DEFAULT_FSSPEC_OPTIONS = {
+    "block_size": 1024**2,
+    "cache_type": "blockcache",
+    "cache_options": {"maxblocks": 64},
+}
+
+_fsspec_options = dict(DEFAULT_FSSPEC_OPTIONS)
+# Files opened from URLs with the version of the remote file they were opened at, shared by the threads
+_remote_files = {}
+_remote_lock = threading.Lock()
+
+# Keys of the fsspec file information identifying a version of a remote file, the first one found is used
+REMOTE_VERSION_KEYS = [
+    "ETag",
+    "etag",
+    "mtime",
+    "LastModified",
+    "last_modified",
+    "updated",
+    "created",
+]
+
+# Time in seconds during which the version of a remote file is reused without asking the filesystem again,
+# a change of the file is only seen after this time (0 asks the filesystem at every read)
+REMOTE_VERSION_MAX_AGE = 5.0
+# Versions of the remote files with the time they were asked at, see get_remote_version
+_remote_versions = {}
+
+
+def get_hdf5_options():
+    """
+    Returns the options currently used by the readers to open HDF5 files.
+
+    Returns
+    -------
+    dict
+        A copy of the options given to h5py.File, see set_hdf5_options. Inside use_hdf5_options, the options
+        of the context.
+    """
+    context_options = _context_hdf5_options.get()
+    if context_options is not None:
+        return dict(context_options)
+
+    return dict(_hdf5_options)
+
+
+def _update_hdf5_options(hdf5_options, options):
+    """
+    Updates a dictionary of options given to h5py.File, see set_hdf5_options.
+    """
+    for key, value in options.items():
+        hdf5_options[key] = value
+        # The core driver must not write the file back when it is closed
+        if key == "driver" and value == "core":
+            hdf5_options["backing_store"] = False
+        elif key == "driver":
+            hdf5_options.pop("backing_store", None)
+
+    return None
+
+
+def set_hdf5_options(**options):
+    """
+    Sets the options used by the readers to open HDF5 files for the rest of the session.
+
+    Parameters
+    ----------
+    **options
+        Options given to h5py.File, the most useful ones being:
+        - rdcc_nbytes, rdcc_nslots, rdcc_w0 : size, number of slots and preemption policy of the raw data chunk cache.
+        - page_buf_size : size of the page buffer in bytes, for files written with the paged file space strategy.
+        - libver : the HDF5 library version bounds, for example 'latest'.
+        - driver : the HDF5 file driver, 'sec2' (default), 'stdio' or 'core' to read a whole (small) file in memory at opening.
+        Any other keyword accepted by h5py.File can be given, None removes an option.
+
+    Notes
+    -----
+    With the 'core' driver the file is read again in memory every time it is opened, it is only
+    useful for small files or for functions opening the file once.
+    """
+    _update_hdf5_options(_hdf5_options, options)
+
+    return None
+
+
+def reset_hdf5_options():
+    """
+    Restores the default options used by the readers to open HDF5 files, see DEFAULT_HDF5_OPTIONS.
+    """
+    _hdf5_options.clear()
+    _hdf5_options.update(DEFAULT_HDF5_OPTIONS)
+
+    return None
+
+
+@contextlib.contextmanager
+def use_hdf5_options(**options):
+    """
+    Context manager setting the options used by the readers to open HDF5 files (see set_hdf5_options)
+    and restoring the previous options when leaving the context.
+
+    Examples
+    --------
+    >>> with use_hdf5_options(rdcc_nbytes=256 * 1024**2, libver="latest"):
+    ...     data = get_full_dataset(hdf5_file)
+
+    Notes
+    -----
+    The options are stored in a context variable: they only apply to the thread (or asyncio task) entering
+    the context, the files opened at the same time by other threads keep the options of the session.
+    """
+    context_options = get_hdf5_options()
+    _update_hdf5_options(context_options, options)
+    token = _context_hdf5_options.set(context_options)
+    try:
+        yield dict(context_options)
+    finally:
+        _context_hdf5_options.reset(token)
+
+
+def is_remote_file(hdf5_file):
+    """
+    Checks if a file is given as an fsspec URL, for example 's3://bucket/wafer.hdf5' or 'https://server/wafer.hdf5'.
+
+    Parameters
+    ----------
+    hdf5_file : str, pathlib.Path or file-like object
+        The HDF5 file.
+
+    Returns
+    -------
+    bool
+        True if the file is a URL with a protocol.
+    """
+    return isinstance(hdf5_file, str) and "://" in hdf5_file
+
+
+def is_file_object(hdf5_file):
+    """
+    Checks if a file is given as a file-like object opened in binary mode.
+
+    Parameters
+    ----------
+    hdf5_file : str, pathlib.Path or file-like object
+        The HDF5 file.
+
+    Returns
+    -------
+    bool
+        True if the file has read and seek methods.
+    """
+    return hasattr(hdf5_file, "read") and hasattr(hdf5_file, "seek")
+
+
+def get_remote_filesystem(url):
+    """
+    Returns the fsspec filesystem of a URL, created with the options of set_fsspec_options.
+
+    Parameters
+    ----------
+    url : str
+        The fsspec URL of the file.
+
+    Returns
+    -------
+    tuple
+        The (filesystem, path) of the file in its filesystem.
+    """
+    try:
+        import fsspec
+    except ImportError:
+        raise ImportError(
+            "fsspec is needed to read HDF5 files from URLs, install it with 'pip install fsspec'."
+        )
+
+    return fsspec.core.url_to_fs(url, **_fsspec_options)
+
+
+def _open_remote_file(url):
+    """
+    Opens an fsspec URL, the file objects are kept open and reused by the next calls so that
+    the blocks already downloaded are not fetched again (see close_remote_files). The file is
+    opened again when the remote file changed, so that its old blocks are not used anymore.
+    """
+    version = get_remote_version(url)
+
+    with _remote_lock:
+        if url in _remote_files:
+            remote_file, opened_version = _remote_files[url]
+            if not remote_file.closed and opened_version == version:
+                return remote_file
+
+        # The previous file object is not closed, other threads may still be reading it
+        filesystem, path = get_remote_filesystem(url)
+        remote_file = filesystem.open(path, mode="rb")
+        _remote_files[url] = (remote_file, version)
+
+    return remote_file
+
+
+def get_remote_file_info(url):
+    """
+    Returns the information given by the filesystem of an fsspec URL (size, modification time, ETag, ...).
+
+    Parameters
+    ----------
+    url : str
+        The fsspec URL of the file.
+
+    Returns
+    -------
+    dict
+        The dictionary returned by the info method of the filesystem, its keys depend on the filesystem.
+    """
+    filesystem, path = get_remote_filesystem(url)
+
+    return filesystem.info(path)
+
+
+def get_remote_version(url):
+    """
+    Identifies the version of a remote file from the information of its filesystem.
+
+    Parameters
+    ----------
+    url : str
+        The fsspec URL of the file.
+
+    Returns
+    -------
+    tuple
+        The (size, version) of the file, the version being the first of REMOTE_VERSION_KEYS found in the
+        information of the file, or None if there is none.
+
+    Notes
+    -----
+    Every read of a URL needs its version (to reuse the open file and the cached measurements), the
+    version is kept for REMOTE_VERSION_MAX_AGE seconds so that successive reads make a single request.
+    """
+    now = time.monotonic()
+    with _remote_lock:
+        if url in _remote_versions:
+            asked_at, remote_version = _remote_versions[url]
+            if now - asked_at < REMOTE_VERSION_MAX_AGE:
+                return remote_version
+
+    info = get_remote_file_info(url)
+    version = None
+    for key in REMOTE_VERSION_KEYS:
+        if info.get(key, None) is not None:
+            version = str(info[key])
+            break
+    remote_version = (info.get("size", None), version)
+
+    with _remote_lock:
+        _remote_versions[url] = (now, remote_version)
+
+    return remote_version
+
+
+def close_remote_files():
+    """
+    Closes the files opened from fsspec URLs and frees their block caches, the versions of the
+    remote files are asked again at the next read.
+    """
+    with _remote_lock:
+        for remote_file, _ in _remote_files.values():
+            remote_file.close()
+        _remote_files.clear()
+        _remote_versions.clear()
+
+    return None
+
+
+def set_fsspec_options(**options):
+    """
+    Sets the options used to open fsspec URLs, the files already opened are closed.
+
+    Parameters
+    ----------
+    **options
+        Options given to fsspec.open, for example block_size, cache_type and cache_options
+        or the storage options of the filesystem (credentials, ...).
+
+    Notes
+    -----
+    HDF5 reads many small metadata blocks scattered in the file, the default is a cache of
+    64 blocks of 1 MiB ('blockcache') so that the metadata of neighbouring groups is read with
+    few requests and kept between the reads of different positions.
+    """
+    close_remote_files()
+    _fsspec_options.update(options)
+
+    return None
+
+
+@contextlib.contextmanager
+def open_hdf5(hdf5_file, mode="r", **options):
+    """
+    Opens an HDF5 file with the options set for the session (see set_hdf5_options) or the current
+    context (see use_hdf5_options).
+
+    Parameters
+    ----------
+    hdf5_file : str, pathlib.Path or file-like object
+        The path to the HDF5 file to open, an fsspec URL (for example 's3://bucket/wafer.hdf5',
+        see set_fsspec_options) or a file-like object opened in binary mode.
+    mode : str, optional
+        The mode used to open the file. Defaults to 'r'.
+    **options
+        Options overriding the session options for this file only.
+
+    Yields
+    ------
+    h5py.File
+        The opened HDF5 file, closed when leaving the context.
+    """
+    file_options = get_hdf5_options()
+    file_options.update(options)
+    # The core driver must be written back to the disk when the file is opened for writing
+    if mode != "r" and file_options.get("driver", None) == "core":
+        file_options["backing_store"] = True
+
+    if is_remote_file(hdf5_file):
+        if mode != "r":
+            raise ValueError("Files opened from URLs can only be read.")
+        hdf5_file = _open_remote_file(hdf5_file)
+    if is_file_object(hdf5_file):
+        # File-like objects are read by h5py with its own driver
+        file_options.pop("driver", None)
+        file_options.pop("backing_store", None)
+
+    file_options = {
+        key: value for key, value in file_options.items() if value is not None
+    }
+
+    h5f = h5py.File(hdf5_file, mode, **file_options)
+    try:
+        yield h5f
+    finally:
+        h5f.close()
+
+
+def get_memmap(dataset):
+    """
+    Returns a read-only memory map on the data of an HDF5 dataset, without reading it.
+
+    Parameters
+    ----------
+    dataset : h5py.Dataset
+        The HDF5 dataset to map.
+
+    Returns
+    -------
+    numpy.memmap or None
+        A memory map with the shape and dtype of the dataset, or None if the dataset can not be mapped.
+
+    Notes
+    -----
+    Only datasets stored contiguously in the file, without filters or external storage, can be mapped.
+    Chunked, compressed, compact or not yet allocated datasets return None.
+    """
+    if dataset.shape is None or dataset.ndim == 0 or dataset.size == 0:
+        return None
+    # Only plain numerical types have the same layout in the file and in memory
+    if dataset.dtype.kind not in "biufc" or dataset.dtype.hasobject:
+        return None
+    # The file must be a regular file on disk (no core, file-like or remote file)
+    if dataset.file.driver not in ["sec2", "stdio"]:
+        return None
+
+    dcpl = dataset.id.get_create_plist()
+    if dcpl.get_layout() != h5py.h5d.CONTIGUOUS or dcpl.get_external_count() > 0:
+        return None
+
+    offset = dataset.id.get_offset()
+    if offset is None:
+        return None
+
+    return np.memmap(
+        dataset.file.filename,
+        mode="r",
+        dtype=dataset.dtype,
+        offset=offset,
+        shape=dataset.shape,
+        order="C",
+    )
+
+
+def read_dataset(dataset, mmap=False):
+    """
+    Reads the data of an HDF5 dataset.
+
+    Parameters
+    ----------
+    dataset : h5py.Dataset
+        The HDF5 dataset to read.
+    mmap : bool, optional
+        If True, a read-only memory map is returned when the dataset is stored contiguously (see get_memmap),
+        the data is then only read from the file when it is accessed. Defaults to False.
+
+    Returns
+    -------
+    numpy.ndarray or numpy.memmap
+        The data of the dataset.
+    """
+    if mmap:
+        data = get_memmap(dataset)
+        if data is not None:
+            return data
+
+    return dataset[()]
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+Functions to summarize the content of HDF5 files from high-throughput
+experiments without reading the data.
+
+@author: williamrigaut
+"""
+import pathlib
+import re
+import h5py
+from packages.readers.hdf5_io import open_hdf5
+
+# Position groups are named after their coordinates, for example '(-5.0,10.0)'
+POSITION_PATTERN = re.compile(r"^\((-?\d+(?:\.\d+)?),(-?\d+(?:\.\d+)?)\)$")
+
+
+def _decode(value):
+    """
+    Converts an HDF5 attribute to a python string.
+    """
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+    return str(value)
+
+
+def parse_position(group_name):
+    """
+    Reads the position of a measurement from the name of its group.
+
+    Parameters
+    ----------
+    group_name : str
+        The name of the group, for example '(-5.0,10.0)'.
+
+    Returns
+    -------
+    tuple or None
+        The (x, y) position rounded to 0.1, or None if the name is not a position.
+    """
+    match = POSITION_PATTERN.match(group_name)
+    if match is None:
+        return None
+
+    return round(float(match.group(1)), 1), round(float(match.group(2)), 1)
+
+
+def get_technique_groups(h5f):
+    """
+    Finds the root group of each technique in an opened HDF5 file, with the same rules as make_group_path:
+    a group with an 'hdf5_reader' attribute (modified dataset) is preferred over the original group.
+
+    Parameters
+    ----------
+    h5f : h5py.File
+        The opened HDF5 file.
+
+    Returns
+    -------
+    dict
+        A dictionary with the data types ('EDX', 'MOKE', 'XRD', 'PROFIL', ...) as keys and the group paths as values.
+    """
+    technique_groups = {}
+    modified = set()
+
+    for group in h5f["./"]:
+        attrs = h5f[f"./{group}"].attrs
+        if "HT_type" not in attrs.keys():
+            continue
+
+        data_type = _decode(attrs["HT_type"]).upper()
+        if data_type in modified:
+            continue
+        technique_groups[data_type] = f"./{group}"
+        if "hdf5_reader" in attrs.keys():
+            modified.add(data_type)
+
+    return technique_groups
+
+
+def inspect(hdf5_file):
+    """
+    Summarizes the content of an HDF5 file by walking once through its groups and attributes, without reading any dataset.
+
+    Parameters
+    ----------
+    hdf5_file : str, pathlib.Path or file-like object
+        The path to the HDF5 file to inspect.
+
+    Returns
+    -------
+    dict
+        A manifest of the file with the keys 'file' and 'techniques'. For each technique, 'techniques' contains:
+        - group : the path to the root group of the technique.
+        - hdf5_reader, note : the modification of the dataset, or None.
+        - positions : the sorted list of (x, y) positions, read from the names of the position groups.
+        - n_positions : the number of positions.
+        - variables : a dictionary with the paths of the datasets relative to a position group as keys
+          (for example 'results/Element Nd/AtomPercent') and dictionaries with their 'shape', 'dtype', 'units'
+          and 'count' (number of positions containing the dataset) as values.
+        - elements (EDX), quantities (MOKE and PROFIL) or phases (XRD) : the names of the results found.
+    """
+    manifest = {"file": str(hdf5_file), "techniques": {}}
+
+    with open_hdf5(hdf5_file) as h5f:
+        technique_groups = get_technique_groups(h5f)
+
+        for data_type, group in technique_groups.items():
+            root = h5f[group]
+            positions = []
+            variables = {}
+
+            def visit(name, info):
+                # name is 'position/relative/path', everything outside position groups is skipped
+                name = name.decode("utf-8")
+                position_name, _, relative_path = name.partition("/")
+                position = parse_position(position_name)
+                if position is None:
+                    return None
+                if relative_path == "":
+                    positions.append(position)
+                elif info.type == h5py.h5o.TYPE_DATASET:
+                    paths[relative_path] = paths.get(relative_path, 0) + 1
+                    first_paths.setdefault(relative_path, name)
+
+                return None
+
+            # Low level visit: only the names and object types are read, no h5py object is created
+            paths = {}
+            first_paths = {}
+            h5py.h5o.visit(root.id, visit, info=True)
+
+            # Metadata of the first occurrence of each dataset
+            for relative_path, count in paths.items():
+                dataset = root[first_paths[relative_path]]
+                units = dataset.attrs.get("units", None)
+                variables[relative_path] = {
+                    "shape": dataset.shape,
+                    "dtype": str(dataset.dtype),
+                    "units": None if units is None else _decode(units),
+                    "count": count,
+                }
+
+            technique = {
+                "group": group,
+                "hdf5_reader": None,
+                "note": None,
+                "positions": sorted(set(positions)),
+                "n_positions": len(set(positions)),
+                "variables": variables,
+            }
+            if "hdf5_reader" in root.attrs.keys():
+                technique["hdf5_reader"] = _decode(root.attrs["hdf5_reader"])
+                technique["note"] = _decode(root.attrs.get("note", ""))
+
+            result_names = _get_result_names(data_type, variables)
+            technique.update(result_names)
+            manifest["techniques"][data_type] = technique
+
+    return manifest
+
+
+def _get_result_names(data_type, variables):
+    """
+    Lists the elements, quantities or phases found in the results of a technique, see inspect.
+    """
+    names = []
+    for path in variables:
+        parts = path.split("/")
+        if parts[0] != "results" or len(parts) < 2:
+            continue
+
+        if data_type == "EDX":
+            if "TRTResult" in parts[1]:
+                continue
+            name = parts[1].split()[-1]
+        elif data_type == "XRD":
+            if len(parts) < 3 or parts[1] != "phases":
+                continue
+            name = parts[2]
+        else:
+            if parts[1] == "parameters":
+                continue
+            name = parts[1]
+
+        if name not in names:
+            names.append(name)
+
+    if data_type == "EDX":
+        return {"elements": names}
+    elif data_type == "XRD":
+        return {"phases": names}
+
+    return {"quantities": names}
+
+
+def get_manifest_positions(manifest, data_type):
+    """
+    Returns the positions of a technique from a manifest, see inspect.
+
+    Parameters
+    ----------
+    manifest : dict
+        The manifest returned by inspect.
+    data_type : str
+        The type of data, either 'EDX', 'MOKE', 'XRD' or 'PROFIL'.
+
+    Returns
+    -------
+    list
+        The sorted list of (x, y) positions, empty if the technique is not in the file.
+    """
+    technique = manifest["techniques"].get(data_type.upper(), None)
+    if technique is None:
+        return []
+
+    return list(technique["positions"])
+
+
+def inspect_folder(folder, pattern="*.hdf5"):
+    """
+    Summarizes the content of all the HDF5 files of a folder, see inspect.
+
+    Parameters
+    ----------
+    folder : str or pathlib.Path
+        The folder containing the HDF5 files.
+    pattern : str, optional
+        The glob pattern of the HDF5 files. Defaults to '*.hdf5'.
+
+    Returns
+    -------
+    dict
+        A dictionary with the paths of the files as keys and their manifests as values.
+        Files that can not be read are skipped with a warning.
+    """
+    manifests = {}
+
+    for hdf5_file in sorted(pathlib.Path(folder).glob(pattern)):
+        try:
+            manifests[str(hdf5_file)] = inspect(hdf5_file)
+        except OSError:
+            print(f"Warning, {hdf5_file} is not a readable HDF5 file.")
+
+    return manifests
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+Lazy imports of the heavy libraries (xarray, pandas), which are only imported
+the first time one of their attributes is used.
+
+@author: williamrigaut
+"""
+import importlib
+
+
+class LazyModule:
+    """
+    Placeholder for a module, imported on the first access to one of its attributes.
+
+    Parameters
+    ----------
+    name : str
+        The name of the module, for example 'xarray'.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        # Only called for the attributes of the module, the import is thread safe
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attribute)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module '{self._name}' ({state})>"
+
+
+def lazy_import(name):
+    """
+    Returns a module imported on first use, to be used instead of a module level import.
+
+    Parameters
+    ----------
+    name : str
+        The name of the module.
+
+    Returns
+    -------
+    LazyModule
+        The placeholder of the module.
+
+    Examples
+    --------
+    >>> xr = lazy_import("xarray")
+    >>> xr.Dataset()  # xarray is imported here
+    """
+    return LazyModule(name)
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""
+Functions to write and read downsampled versions (pyramids) of the XRD images
+and of the spectra, to browse a wafer without reading the full resolution data.
+
+@author: williamrigaut
+"""
+import h5py
+import numpy as np
+from packages.readers.hdf5_io import open_hdf5, read_dataset
+from packages.readers.inspect_hdf5 import get_technique_groups, parse_position
+from packages.readers.lazy_import import lazy_import
+
+xr = lazy_import("xarray")
+
+# Methods available to downsample the spectra
+SPECTRUM_METHODS = ["max", "mean", "decimate"]
+
+# Datasets of each technique downsampled by create_pyramid_dataset, as
+# (path in the position group, name in the output file, kind of data)
+PYRAMID_DATASETS = {
+    "EDX": [
+        ("measurement/counts", "counts", "spectrum"),
+        ("measurement/energy", "energy", "axis"),
+    ],
+    "XRD": [
+        ("measurement/CdTe", "CdTe", "image"),
+        (
+            "measurement/CdTe_integrate/intensity",
+            "CdTe_integrate_intensity",
+            "spectrum",
+        ),
+        ("measurement/CdTe_integrate/q", "CdTe_integrate_q", "axis"),
+    ],
+}
+
+
+def get_level_name(name, level):
+    """
+    Returns the name of the dataset containing a level of a pyramid.
+
+    Parameters
+    ----------
+    name : str
+        The name of the full resolution dataset, for example 'CdTe'.
+    level : int
+        The level of the pyramid, the data is binned by 2**level. Level 0 is the full resolution.
+
+    Returns
+    -------
+    str
+        The name of the dataset, for example 'CdTe_binned_4' for level 2.
+    """
+    if level == 0:
+        return name
+
+    return f"{name}_binned_{2**level}"
+
+
+def bin_image(image, factor):
+    """
+    Downsamples an image by averaging blocks of factor x factor pixels.
+
+    Parameters
+    ----------
+    image : numpy.ndarray
+        The image, the binning is done on its last two dimensions.
+    factor : int
+        The size of the blocks. The last rows and columns are dropped if the shape is not a multiple of factor.
+
+    Returns
+    -------
+    numpy.ndarray
+        The binned image, in float32 unless the image is stored with a higher precision.
+    """
+    image = np.asarray(image)
+    if factor == 1:
+        return image
+
+    ny, nx = image.shape[-2] // factor, image.shape[-1] // factor
+    blocks = image[..., : ny * factor, : nx * factor].reshape(
+        image.shape[:-2] + (ny, factor, nx, factor)
+    )
+
+    return blocks.mean(axis=(-3, -1), dtype=np.float64).astype(
+        np.result_type(image.dtype, np.float32)
+    )
+
+
+def pool_spectrum(spectrum, factor, method="max"):
+    """
+    Downsamples a spectrum along its last dimension.
+
+    Parameters
+    ----------
+    spectrum : numpy.ndarray
+        The spectrum.
+    factor : int
+        The number of points merged into one. The last points are dropped if the length is not a multiple of factor.
+    method : str, optional
+        'max' keeps the maximum of each group of points, so that narrow peaks stay visible, 'mean' averages them
+        and 'decimate' keeps the first point of each group. Defaults to 'max'.
+
+    Returns
+    -------
+    numpy.ndarray
+        The downsampled spectrum.
+    """
+    if method not in SPECTRUM_METHODS:
+        raise ValueError(f"Method {method} must be one of {SPECTRUM_METHODS}.")
+
+    spectrum = np.asarray(spectrum)
+    if factor == 1:
+        return spectrum
+
+    n = spectrum.shape[-1] // factor
+    if method == "decimate":
+        return spectrum[..., : n * factor : factor].copy()
+
+    groups = spectrum[..., : n * factor].reshape(spectrum.shape[:-1] + (n, factor))
+    if method == "max":
+        return groups.max(axis=-1)
+
+    return groups.mean(axis=-1)
+
+
+def _downsample(values, factor, kind, method):
+    """
+    Downsamples an image, a spectrum or its axis, the axis is averaged unless the spectrum is decimated.
+    """
+    if kind == "image":
+        return bin_image(values, factor)
+    if kind == "axis":
+        return pool_spectrum(
+            values, factor, "decimate" if method == "decimate" else "mean"
+        )
+
+    return pool_spectrum(values, factor, method)
+
+
+def create_pyramid_dataset(hdf5_file, hdf5_save_file, levels=3, spectrum_method="max"):
+    """
+    Adds downsampled XRD images and EDX/XRD spectra to a simplified HDF5 dataset (see create_simplified_dataset).
+
+    Parameters
+    ----------
+    hdf5_file : str, pathlib.Path or file-like object
+        The path to the input HDF5 file.
+    hdf5_save_file : str or pathlib.Path
+        The path to the output HDF5 file, the pyramids are added to the position groups '(x,y)' of the file
+        and the groups are created if needed.
+    levels : int, optional
+        The number of levels written, the data of level i is binned by 2**i. Defaults to 3 (2x, 4x and 8x).
+    spectrum_method : str, optional
+        The method used to downsample the spectra, see pool_spectrum. Defaults to 'max'.
+
+    Notes
+    -----
+    Each level is saved next to the full resolution data with the suffix '_binned_<factor>', for example
+    'CdTe_binned_2', 'CdTe_binned_4' and 'CdTe_binned_8' for the XRD images (see get_level_name).
+    """
+    if spectrum_method not in SPECTRUM_METHODS:
+        raise ValueError(f"Method {spectrum_method} must be one of {SPECTRUM_METHODS}.")
+
+    with open_hdf5(hdf5_file) as h5f, h5py.File(hdf5_save_file, "a") as h5f_save:
+        technique_groups = get_technique_groups(h5f)
+
+        for datatype, datasets in PYRAMID_DATASETS.items():
+            if datatype not in technique_groups:
+                continue
+            group = h5f[technique_groups[datatype]]
+
+            for group_name in group.keys():
+                position = parse_position(group_name)
+                if position is None:
+                    continue
+                coord = "({:.1f},{:.1f})".format(*position)
+                node = h5f_save.require_group(coord)
+
+                for path, name, kind in datasets:
+                    if path not in group[group_name]:
+                        continue
+                    dataset = group[group_name][path]
+                    values = dataset[()]
+
+                    for level in range(1, levels + 1):
+                        factor = 2**level
+                        level_name = get_level_name(name, level)
+                        if level_name in node:
+                            del node[level_name]
+                        node.create_dataset(
+                            level_name,
+                            data=_downsample(values, factor, kind, spectrum_method),
+                        )
+                        if "units" in dataset.attrs:
+                            node[level_name].attrs["units"] = dataset.attrs["units"]
+                        node[level_name].attrs["HT_type"] = datatype.lower()
+                        node[level_name].attrs["binning"] = factor
+                        if kind == "spectrum":
+                            node[level_name].attrs["pooling"] = spectrum_method
+
+    return None
+
+
+def read_image_level(node, name, level=0, mmap=False):
+    """
+    Reads a level of an image pyramid from an opened HDF5 group.
+
+    Parameters
+    ----------
+    node : h5py.Group
+        The group containing the full resolution image and its pyramid.
+    name : str
+        The name of the full resolution image.
+    level : int, optional
+        The level to read, see get_level_name. Defaults to 0 (full resolution).
+    mmap : bool, optional
+        If True, the dataset is returned as a read-only memory map when possible (see hdf5_io.read_dataset).
+
+    Returns
+    -------
+    numpy.ndarray
+        The data of the level. If the level was not written in the file, it is computed from the full
+        resolution image with bin_image.
+    """
+    level_name = get_level_name(name, level)
+    if level_name in node:
+        return read_dataset(node[level_name], mmap)
+
+    return bin_image(node[name][()], 2**level)
+
+
+def get_xrd_overview(hdf5_file, level=3):
+    """
+    Reads the binned XRD images of all the positions of a dataset written by create_pyramid_dataset.
+
+    Parameters
+    ----------
+    hdf5_file : str, pathlib.Path or file-like object
+        The path to the HDF5 file containing the pyramids.
+    level : int, optional
+        The level of the images, see get_level_name. Defaults to 3 (images binned by 8).
+
+    Returns
+    -------
+    xarray.DataArray
+        The images with the dimensions 'y', 'x', 'pixel y' and 'pixel x', NaN where no image was measured.
+    """
+    images = {}
+    level_name = get_level_name("CdTe", level)
+
+    with open_hdf5(hdf5_file) as h5f:
+        for group_name in h5f.keys():
+            position = parse_position(group_name)
+            if position is None or level_name not in h5f[group_name]:
+                continue
+            images[position] = h5f[group_name][level_name][()]
+
+    if len(images) == 0:
+        raise ValueError(f"No {level_name} image found in {hdf5_file}.")
+
+    x_vals = sorted(set(x for x, _ in images))
+    y_vals = sorted(set(y for _, y in images))
+    shape = next(iter(images.values())).shape
+    overview = np.full((len(y_vals), len(x_vals)) + shape, np.nan, dtype=np.float32)
+    for (x, y), image in images.items():
+        overview[y_vals.index(y), x_vals.index(x)] = image
+
+    return xr.DataArray(
+        overview,
+        coords=[y_vals, x_vals, np.arange(shape[0]), np.arange(shape[1])],
+        dims=["y", "x", "pixel y", "pixel x"],
+        attrs={"binning": 2**level},
+    )
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""
+Asynchronous functions to load HDF5 files from slow or remote storage
+without blocking the event loop (for example a Jupyter kernel).
+
+@author: williamrigaut
+"""
+import asyncio
+import functools
+import hashlib
+import os
+import pathlib
+import shutil
+import tempfile
+from packages.readers.hdf5_io import (
+    get_remote_filesystem,
+    get_remote_version,
+    is_remote_file,
+)
+from packages.readers.read_hdf5 import get_full_dataset, get_measurement_data
+
+
+def _copy_remote_file(url, cache_dir):
+    """
+    Streams an fsspec URL into the local cache folder, see fetch_file.
+    """
+    size, version = get_remote_version(url)
+    name = pathlib.PurePosixPath(url.split("?", 1)[0]).name
+    url_digest = hashlib.sha1(url.encode("utf-8")).hexdigest()[:16]
+    version_digest = hashlib.sha1(f"{size}_{version}".encode("utf-8")).hexdigest()[:8]
+    local_file = cache_dir / f"{url_digest}_{version_digest}_{name}"
+
+    # Without a version, the remote file may have changed since the copy and is downloaded again
+    if version is not None and local_file.exists():
+        if size is None or local_file.stat().st_size == size:
+            return local_file
+
+    filesystem, path = get_remote_filesystem(url)
+    descriptor, tmp_file = tempfile.mkstemp(
+        suffix=".part", prefix=f".{local_file.name}.", dir=cache_dir
+    )
+    try:
+        with os.fdopen(descriptor, "wb") as target:
+            with filesystem.open(path, mode="rb") as source:
+                shutil.copyfileobj(source, target, 1024**2)
+        os.replace(tmp_file, local_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+    # The copies of older versions of the file are not used anymore
+    for old_file in cache_dir.glob(f"{url_digest}_*_{name}"):
+        if old_file != local_file:
+            try:
+                old_file.unlink()
+            except OSError:
+                pass
+
+    return local_file
+
+
+def fetch_file(hdf5_file, cache_dir):
+    """
+    Copies a file from a slow storage into a local cache folder, unless an identical copy is already present.
+
+    Parameters
+    ----------
+    hdf5_file : str or pathlib.Path
+        The path to the file on the slow storage, or an fsspec URL (for example 's3://bucket/wafer.hdf5').
+    cache_dir : str or pathlib.Path
+        The local folder where the file is copied.
+
+    Returns
+    -------
+    pathlib.Path
+        The path to the local copy of the file.
+
+    Notes
+    -----
+    The name of the copy starts with a hash of the full path of the file, so that files with the same name
+    in different folders are cached separately. For URLs, it also contains a hash of the size and version
+    (ETag, modification time, ...) of the remote file, the copy of a previous version is removed.
+    """
+    cache_dir = pathlib.Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    if is_remote_file(hdf5_file):
+        return _copy_remote_file(hdf5_file, cache_dir)
+
+    hdf5_file = pathlib.Path(hdf5_file).resolve()
+    digest = hashlib.sha1(str(hdf5_file).encode("utf-8")).hexdigest()[:16]
+    local_file = cache_dir / f"{digest}_{hdf5_file.name}"
+
+    stat = hdf5_file.stat()
+    if local_file.exists():
+        local_stat = local_file.stat()
+        if local_stat.st_size == stat.st_size and local_stat.st_mtime == stat.st_mtime:
+            return local_file
+
+    # Copying to a unique temporary name first so that an interrupted copy is never used,
+    # and concurrent copies of the same file do not write into each other
+    descriptor, tmp_file = tempfile.mkstemp(
+        suffix=".part", prefix=f".{local_file.name}.", dir=cache_dir
+    )
+    os.close(descriptor)
+    try:
+        shutil.copyfile(hdf5_file, tmp_file)
+        os.utime(tmp_file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        os.replace(tmp_file, local_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+    return local_file
+
+
+async def _run_blocking(executor, function, *args, **kwargs):
+    """
+    Runs a blocking function in an executor and waits for its result.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        executor, functools.partial(function, *args, **kwargs)
+    )
+
+
+async def load_full_dataset_async(
+    hdf5_file,
+    exclude_wafer_edges=True,
+    hdf5_options=None,
+    executor=None,
+    cache_dir=None,
+    semaphore=None,
+):
+    """
+    Asynchronous version of get_full_dataset.
+
+    Parameters
+    ----------
+    hdf5_file : str or pathlib.Path
+        The path to the HDF5 file to read the data from, or an fsspec URL.
+    exclude_wafer_edges : bool, optional
+        If True, the data measured at the edges of the wafer is excluded. Defaults to True.
+    hdf5_options : dict, optional
+        Options used to open the HDF5 file (see hdf5_io.set_hdf5_options).
+    executor : concurrent.futures.Executor, optional
+        The executor running get_full_dataset. If None, the default thread pool of the event loop is used.
+        h5py only runs one thread at a time, a ProcessPoolExecutor is needed to read several files in parallel.
+    cache_dir : str or pathlib.Path, optional
+        If given, the file is first copied into this local folder (see fetch_file), in a thread of the event loop.
+    semaphore : asyncio.Semaphore, optional
+        A semaphore bounding the number of files loaded at the same time.
+
+    Returns
+    -------
+    xarray.Dataset
+        The dataset returned by get_full_dataset.
+
+    Examples
+    --------
+    >>> data = await load_full_dataset_async(hdf5_file)
+    """
+    semaphore = asyncio.Semaphore(1) if semaphore is None else semaphore
+
+    async with semaphore:
+        if cache_dir is not None:
+            hdf5_file = await _run_blocking(None, fetch_file, hdf5_file, cache_dir)
+        data = await _run_blocking(
+            executor,
+            get_full_dataset,
+            hdf5_file,
+            exclude_wafer_edges=exclude_wafer_edges,
+            hdf5_options=hdf5_options,
+        )
+
+    return data
+
+
+async def load_measurement_data_async(
+    hdf5_file,
+    datatype,
+    exclude_wafer_edges=True,
+    hdf5_options=None,
+    executor=None,
+    cache_dir=None,
+    semaphore=None,
+):
+    """
+    Asynchronous version of get_measurement_data, see load_full_dataset_async for the parameters.
+
+    Returns
+    -------
+    xarray.DataTree
+        The DataTree returned by get_measurement_data.
+    """
+    semaphore = asyncio.Semaphore(1) if semaphore is None else semaphore
+
+    async with semaphore:
+        if cache_dir is not None:
+            hdf5_file = await _run_blocking(None, fetch_file, hdf5_file, cache_dir)
+        measurement_tree = await _run_blocking(
+            executor,
+            get_measurement_data,
+            hdf5_file,
+            datatype,
+            exclude_wafer_edges=exclude_wafer_edges,
+            hdf5_options=hdf5_options,
+        )
+
+    return measurement_tree
+
+
+async def gather_full_datasets(
+    hdf5_files,
+    max_concurrency=4,
+    exclude_wafer_edges=True,
+    hdf5_options=None,
+    executor=None,
+    cache_dir=None,
+    return_exceptions=False,
+):
+    """
+    Loads many HDF5 files concurrently with load_full_dataset_async.
+
+    Parameters
+    ----------
+    hdf5_files : list of str or pathlib.Path
+        The paths (or fsspec URLs) to the HDF5 files to read.
+    max_concurrency : int, optional
+        The maximum number of files fetched and read at the same time. Defaults to 4.
+    return_exceptions : bool, optional
+        If True, the exception raised by a file is returned in place of its dataset instead of being raised. Defaults to False.
+    exclude_wafer_edges, hdf5_options, executor, cache_dir
+        See load_full_dataset_async.
+
+    Returns
+    -------
+    dict
+        A dictionary with the paths of the files as keys and their datasets as values.
+
+    Examples
+    --------
+    >>> from concurrent.futures import ProcessPoolExecutor
+    >>> with ProcessPoolExecutor(4) as executor:
+    ...     library = await gather_full_datasets(hdf5_files, executor=executor, cache_dir="/tmp/wafers")
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    results = await asyncio.gather(
+        *[
+            load_full_dataset_async(
+                hdf5_file,
+                exclude_wafer_edges=exclude_wafer_edges,
+                hdf5_options=hdf5_options,
+                executor=executor,
+                cache_dir=cache_dir,
+                semaphore=semaphore,
+            )
+            for hdf5_file in hdf5_files
+        ],
+        return_exceptions=return_exceptions,
+    )
+
+    return {str(hdf5_file): data for hdf5_file, data in zip(hdf5_files, results)}
@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+"""
+In-memory cache of the measurements read at one position, to make repeated
+reads of the same positions instantaneous in interactive use.
+
+@author: williamrigaut
+"""
+import collections
+import os
+import threading
+import numpy as np
+from packages.readers.hdf5_io import (
+    get_remote_version,
+    is_file_object,
+    is_remote_file,
+)
+
+
+class MeasurementCache:
+    """
+    Least recently used cache of measurement data, bounded by the total size of the cached arrays.
+
+    Parameters
+    ----------
+    max_bytes : int, optional
+        The maximum size of the cached arrays in bytes. Defaults to 256 MiB.
+
+    Notes
+    -----
+    The keys are (file fingerprint, technique, x, y, field) tuples, see get_file_fingerprint.
+    """
+
+    def __init__(self, max_bytes=256 * 1024**2):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, count=True):
+        """
+        Returns the value cached for a key, or None if the key is not in the cache.
+        If count is False, the lookup is not counted in the hits and misses (see count_lookup).
+        """
+        with self._lock:
+            if key not in self._entries:
+                if count:
+                    self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            if count:
+                self.hits += 1
+            return self._entries[key][0]
+
+    def count_lookup(self, hit):
+        """
+        Counts a hit or a miss, for a value cached in several entries.
+        """
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        return None
+
+    def put(self, key, value, nbytes=None):
+        """
+        Adds a value to the cache, the least recently used values are removed if the cache is full.
+        Values larger than the cache are not added.
+        """
+        if nbytes is None:
+            nbytes = getattr(value, "nbytes", 0)
+        if nbytes > self.max_bytes:
+            return None
+
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, nbytes)
+            self.nbytes += nbytes
+            self._evict()
+
+        return None
+
+    def _evict(self):
+        """
+        Removes the least recently used values until the cache fits in max_bytes.
+        """
+        while self.nbytes > self.max_bytes and len(self._entries) > 0:
+            _, (_, nbytes) = self._entries.popitem(last=False)
+            self.nbytes -= nbytes
+            self.evictions += 1
+
+        return None
+
+    def resize(self, max_bytes):
+        """
+        Changes the maximum size of the cache.
+        """
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+        return None
+
+    def clear(self):
+        """
+        Removes all the values from the cache and resets the statistics.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+        return None
+
+    def info(self):
+        """
+        Returns the statistics of the cache.
+
+        Returns
+        -------
+        dict
+            A dictionary with the keys 'hits', 'misses', 'evictions', 'entries', 'nbytes' and 'max_bytes'.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "nbytes": self.nbytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Cache shared by the readers, see search_measurement_data_from_type
+measurement_cache = MeasurementCache()
+
+
+def get_file_fingerprint(hdf5_file):
+    """
+    Identifies a version of an HDF5 file, so that the cached values are not used anymore once the file is modified.
+
+    Parameters
+    ----------
+    hdf5_file : str, pathlib.Path or file-like object
+        The HDF5 file.
+
+    Returns
+    -------
+    tuple or None
+        The (path, size, modification time) of the file, the (URL, size, ETag or modification time) for remote files,
+        or None for file-like objects and remote files without information, which can not be cached.
+    """
+    if is_file_object(hdf5_file):
+        return None
+    if is_remote_file(hdf5_file):
+        try:
+            size, version = get_remote_version(hdf5_file)
+        except (OSError, ValueError, NotImplementedError):
+            return None
+        if version is None:
+            return None
+
+        return hdf5_file, size, version
+
+    path = os.path.realpath(hdf5_file)
+    stat = os.stat(path)
+
+    return path, stat.st_size, stat.st_mtime_ns
+
+
+def get_cached_measurement(fingerprint, data_type, x_pos, y_pos):
+    """
+    Returns the measurement of a position from the cache.
+
+    Parameters
+    ----------
+    fingerprint : tuple
+        The fingerprint of the file, see get_file_fingerprint.
+    data_type : str
+        The type of data, either 'EDX', 'MOKE' or 'XRD'.
+    x_pos : float
+        The x position of the measurement.
+    y_pos : float
+        The y position of the measurement.
+
+    Returns
+    -------
+    tuple or None
+        A tuple containing copies of the measurement data and its units, or None if the position is not
+        (or not completely) in the cache.
+    """
+    position = (
+        fingerprint,
+        data_type.lower(),
+        round(float(x_pos), 1),
+        round(float(y_pos), 1),
+    )
+    # The list of fields and their units are stored with the field None, a read is counted once as a hit or a miss
+    fields = measurement_cache.get(position + (None,), count=False)
+    if fields is None:
+        measurement_cache.count_lookup(False)
+        return None
+
+    data = {}
+    for field in fields[0]:
+        value = measurement_cache.get(position + (field,), count=False)
+        if value is None:
+            measurement_cache.count_lookup(False)
+            return None
+        # Copies so that the cached arrays can not be modified by the caller
+        data[field] = np.array(value, copy=True)
+    measurement_cache.count_lookup(True)
+
+    return data, dict(fields[1])
+
+
+def cache_measurement(fingerprint, data_type, x_pos, y_pos, data, data_units):
+    """
+    Adds the measurement of a position to the cache, see get_cached_measurement.
+    """
+    position = (
+        fingerprint,
+        data_type.lower(),
+        round(float(x_pos), 1),
+        round(float(y_pos), 1),
+    )
+    for field, value in data.items():
+        value = np.array(value, copy=True)
+        measurement_cache.put(position + (field,), value, value.nbytes)
+    # Small python objects, counted with an estimated size so that they are also evicted
+    measurement_cache.put(
+        position + (None,), (tuple(data.keys()), dict(data_units)), 1024
+    )
+
+    return None
+
+
+def get_cache_info():
+    """
+    Returns the statistics of the measurement cache (hits, misses, evictions, entries, nbytes and max_bytes).
+    """
+    return measurement_cache.info()
+
+
+def set_cache_size(max_bytes):
+    """
+    Changes the maximum size of the measurement cache in bytes, 0 disables the cache.
+    """
+    measurement_cache.resize(max_bytes)
+
+    return None
+
+
+def clear_measurement_cache():
+    """
+    Removes all the measurements from the cache.
+    """
+    measurement_cache.clear()
+
+    return None
@@ -5,6 +5,7 @@ Functions to read EDX data from HDF5 files
 @author: williamrigaut
 """
 import h5py
+from packages.readers.hdf5_io import open_hdf5, read_dataset
 
 
 def get_edx_composition(hdf5_file, group_path):
@@ -13,7 +14,7 @@ def get_edx_composition(hdf5_file, group_path):
 
     Parameters
     ----------
-    hdf5_file : str or Path
+    hdf5_file : str, pathlib.Path or file-like object
         The path to the HDF5 file to read the data from.
     group_path : str or Path
         The path within the HDF5 file to the group containing the EDX data.
@@ -31,7 +32,7 @@ def get_edx_composition(hdf5_file, group_path):
     composition_units = {}
 
     try:
-        with h5py.File(hdf5_file, "r") as h5f:
+        with open_hdf5(hdf5_file) as h5f:
             # All the elements are stored in the results group
             elements = h5f[group_path].keys()
             for element in elements:
@@ -58,16 +59,19 @@ def get_edx_composition(hdf5_file, group_path):
     return composition, composition_units
 
 
-def get_edx_spectrum(hdf5_file, group_path):
+def get_edx_spectrum(hdf5_file, group_path, mmap=False):
     """
     Reads the EDX spectrum data from an HDF5 file.
 
     Parameters
     ----------
-    hdf5_file : str or pathlib.Path
+    hdf5_file : str, pathlib.Path or file-like object
         The path to the HDF5 file to read the data from.
     group_path : str or pathlib.Path
         The path within the HDF5 file to the group containing the EDX spectrum data.
+    mmap : bool, optional
+        If True, the counts and energy are returned as read-only memory maps when they are stored
+        contiguously in the file (see hdf5_io.read_dataset). Defaults to False.
 
     Returns
     -------
@@ -84,10 +88,10 @@ def get_edx_spectrum(hdf5_file, group_path):
     measurement = {}
     measurement_units = {}
     try:
-        with h5py.File(hdf5_file, "r") as h5f:
+        with open_hdf5(hdf5_file) as h5f:
             # Getting counts and energy datasets (with corresponding units)
-            measurement["counts"] = h5f[group_path]["counts"][()]
-            measurement["energy"] = h5f[group_path]["energy"][()]
+            measurement["counts"] = read_dataset(h5f[group_path]["counts"], mmap)
+            measurement["energy"] = read_dataset(h5f[group_path]["energy"], mmap)
             measurement_units["counts"] = h5f[group_path]["counts"].attrs["units"]
             measurement_units["energy"] = h5f[group_path]["energy"].attrs["units"]
     except KeyError:
@@ -5,16 +5,44 @@ HDF5 files for high-throughput experiment.
 
 @author: williamrigaut
 """
-
+import collections
 import h5py
 import math
-import xarray as xr
 import numpy as np
 from packages.readers.read_edx import get_edx_composition, get_edx_spectrum
 from packages.readers.read_moke import get_moke_results, get_moke_loop
 from packages.readers.read_xrd import get_xrd_results, get_xrd_pattern, get_xrd_image
-from packages.readers.read_profil import get_thickness
-from tqdm import tqdm
+from packages.readers.read_profil import get_thickness, get_profile
+from packages.readers.hdf5_io import open_hdf5, use_hdf5_options, is_file_object
+from packages.readers.inspect_hdf5 import (
+    inspect,
+    get_manifest_positions,
+    get_technique_groups,
+    parse_position,
+)
+from packages.readers.read_plan import (
+    compile_read_plan,
+    execute_read_plan,
+    get_position_group_name,
+)
+from packages.readers.read_cache import (
+    get_file_fingerprint,
+    get_cached_measurement,
+    cache_measurement,
+)
+from packages.analysis.regrid import compute_regrid_weights, apply_regrid_weights
+from concurrent.futures import ProcessPoolExecutor
+from packages.readers.lazy_import import lazy_import
+
+xr = lazy_import("xarray")
+
+# Results saved for each XRD phase, as (key in the HDF5 file, label in the dataset)
+XRD_RESULT_LABELS = [
+    ("phase_fraction", "Phase Fraction"),
+    ("A", "Lattice Parameter A"),
+    ("B", "Lattice Parameter B"),
+    ("C", "Lattice Parameter C"),
+]
 
 
 def make_group_path(
@@ -25,10 +53,10 @@ def make_group_path(
 
     Parameters
     ----------
-    hdf5_file : str or pathlib.Path
+    hdf5_file : str, pathlib.Path or file-like object
         The path to the HDF5 file to read the data from.
     data_type : str
-        The type of data to read, either 'EDX', 'MOKE' or 'XRD'.
+        The type of data to read, either 'EDX', 'MOKE', 'XRD' or 'PROFIL'.
     measurement_type : str, optional
         The type of measurement to read. If not given, the function will only return the group path for the data type.
     x_pos : float, optional
@@ -41,7 +69,7 @@ def make_group_path(
     str
         The path to the group in the HDF5 file containing the data.
     """
-    with h5py.File(hdf5_file, "r") as h5f:
+    with open_hdf5(hdf5_file) as h5f:
         # Check which group corresponds to the data type
         start_group = None
         for group in h5f["./"]:
@@ -76,7 +104,7 @@ def get_all_positions(hdf5_file, data_type: str):
 
     Parameters
     ----------
-    hdf5_file : str or pathlib.Path
+    hdf5_file : str, pathlib.Path or file-like object
         The path to the HDF5 file to read the data from.
     data_type : str
         The type of data to read, either 'EDX', 'MOKE' or 'XRD'.
@@ -89,7 +117,7 @@ def get_all_positions(hdf5_file, data_type: str):
     positions = []
     data_group = make_group_path(hdf5_file, data_type=data_type)
 
-    with h5py.File(hdf5_file, "r") as h5f:
+    with open_hdf5(hdf5_file) as h5f:
         for group in h5f[data_group]:
             # Skipping scan groupes in MOKE data and alignement scans in ESRF data
             if group in ["scan_parameters", "alignment_scans"]:
@@ -109,7 +137,7 @@ def get_position_units(hdf5_file, data_type: str):
 
     Parameters
     ----------
-    hdf5_file : str or pathlib.Path
+    hdf5_file : str, pathlib.Path or file-like object
         The path to the HDF5 file to read the data from.
     data_type : str
         The type of data to read, either 'EDX', 'MOKE' or 'XRD'.
@@ -123,7 +151,7 @@ def get_position_units(hdf5_file, data_type: str):
 
     root_group = make_group_path(hdf5_file, data_type=data_type)
 
-    with h5py.File(hdf5_file, "r") as h5f:
+    with open_hdf5(hdf5_file) as h5f:
         instrument = h5f[f"{root_group}"]["(0.0,0.0)"]["instrument"]
         position_units["x_pos"] = instrument["x_pos"].attrs["units"]
         position_units["y_pos"] = instrument["y_pos"].attrs["units"]
@@ -131,33 +159,164 @@ def get_position_units(hdf5_file, data_type: str):
     return position_units
 
 
-def get_full_dataset(hdf5_file, exclude_wafer_edges=True):
+def get_position_index(hdf5_file, manifest=None):
     """
-    Reads the measurement data from an HDF5 file and returns an xarray DataArray object containing all the scans of every experiment.
+    Builds an index of the positions measured by every technique of an HDF5 file, along with the
+    group and modification (hdf5_reader) each technique was read from.
 
     Parameters
     ----------
-    hdf5_file : str or Path
+    hdf5_file : str, pathlib.Path or file-like object
         The path to the HDF5 file to read the data from.
-    exclude_wafer_edges : bool, optional
-        If True, the function will exclude the data measured at the edges of the wafer from the returned DataArray. Defaults to True.
+    manifest : dict, optional
+        The manifest of the file returned by inspect_hdf5.inspect. If None, the file is inspected.
 
     Returns
     -------
-    xarray.DataArray
-        A DataArray object containing all the scans of every experiment. The DataArray has a name attribute set to "Measurement Data".
+    dict
+        A dictionary with one entry per data type ('EDX', 'MOKE', 'XRD' and 'PROFIL') present in the file.
+        Each entry is a dictionary with the keys 'group', 'hdf5_reader' and 'positions'.
     """
+    if manifest is None:
+        manifest = inspect(hdf5_file)
+
+    position_index = {}
+
+    for data_type in ["EDX", "MOKE", "XRD", "PROFIL"]:
+        if data_type not in manifest["techniques"]:
+            continue
+        technique = manifest["techniques"][data_type]
 
-    # Looking for EDX positions and scan numbers
-    positions = get_all_positions(hdf5_file, data_type="EDX")
-    position_units = get_position_units(hdf5_file, data_type="EDX")
+        position_index[data_type] = {
+            "group": technique["group"],
+            "hdf5_reader": technique["hdf5_reader"],
+            "positions": list(technique["positions"]),
+        }
+
+    return position_index
+
+
+def _preallocate_results(manifest, x_vals, y_vals, phase_dimension=False):
+    """
+    Creates a dataset with NaN maps for every result listed in the manifest of the file (see inspect_hdf5.inspect).
+    If phase_dimension is True, the XRD results are preallocated with the dimensions ('phase', 'y', 'x').
+
+    Returns
+    -------
+    xarray.Dataset
+        The dataset with the preallocated maps, grouped by technique in the order EDX, MOKE, XRD and PROFIL
+        (see _sort_results_by_discovery for the order of the maps of a technique).
+    list
+        The names of the maps that are only kept if at least one value is found (EDX and XRD results).
+    dict
+        The data type of each map.
+    """
+    techniques = manifest["techniques"]
+    names = []
+    optional_names = []
+    data_types = {}
+
+    if "EDX" in techniques:
+        for path in techniques["EDX"]["variables"]:
+            parts = path.split("/")
+            if len(parts) == 3 and parts[0] == "results" and parts[2] == "AtomPercent":
+                if "TRTResult" not in parts[1]:
+                    optional_names.append(f"{parts[1].split()[-1]} Composition")
+        names += optional_names
+
+    if "MOKE" in techniques:
+        names += techniques["MOKE"]["quantities"]
+    data_types.update({name: "EDX" for name in optional_names})
+    data_types.update({name: "MOKE" for name in names if name not in data_types})
+
+    phase_names = []
+    phases = []
+    if "XRD" in techniques and phase_dimension:
+        variables = techniques["XRD"]["variables"]
+        phases = techniques["XRD"]["phases"]
+        for key, label in XRD_RESULT_LABELS:
+            if any(f"results/phases/{phase}/{key}" in variables for phase in phases):
+                phase_names += [label, f"{label} Uncertainty"]
+        names += phase_names
+        optional_names += phase_names
+    elif "XRD" in techniques:
+        variables = techniques["XRD"]["variables"]
+        for phase in techniques["XRD"]["phases"]:
+            for key, label in XRD_RESULT_LABELS:
+                if f"results/phases/{phase}/{key}" in variables:
+                    names.append(f"{phase} {label}")
+                    optional_names.append(f"{phase} {label}")
+
+    data_types.update({name: "XRD" for name in names if name not in data_types})
+
+    if "PROFIL" in techniques:
+        if "results/measured_height" in techniques["PROFIL"]["variables"]:
+            names.append("measured_height")
+            data_types["measured_height"] = "PROFIL"
+
+    coords = {"y": y_vals, "x": x_vals}
+    if len(phase_names) > 0:
+        coords["phase"] = list(phases)
+
+    data = xr.Dataset(
+        {
+            name: (
+                (
+                    ["phase", "y", "x"],
+                    np.full((len(phases), len(y_vals), len(x_vals)), np.nan),
+                )
+                if name in phase_names
+                else (["y", "x"], np.full((len(y_vals), len(x_vals)), np.nan))
+            )
+            for name in names
+        },
+        coords=coords,
+    )
 
-    x_vals = sorted(set([pos[0] for pos in positions]))
-    y_vals = sorted(set([pos[1] for pos in positions]))
+    return data, optional_names, data_types
 
-    data = xr.Dataset()
 
-    # Retrieve EDX composition
+def _sort_results_by_discovery(data, manifest, data_types, exclude_wafer_edges, regrid):
+    """
+    Orders the maps of each technique by the first position where they have a value, reading the positions
+    sorted by x then y, as when the maps were created while reading the file. The maps found at the same
+    position keep the order of the file, and the XRD maps along a 'phase' dimension the order of XRD_RESULT_LABELS.
+    """
+    x_index = {x: i for i, x in enumerate(data["x"].values)}
+    y_index = {y: j for j, y in enumerate(data["y"].values)}
+    technique_order = ["EDX", "MOKE", "XRD", "PROFIL"]
+
+    indices = {}
+    for data_type in set(data_types.values()):
+        # With a regridding, the results of the other techniques are on the EDX positions
+        positions = get_manifest_positions(manifest, "EDX" if regrid else data_type)
+        kept = [
+            (y_index[y], x_index[x])
+            for x, y in sorted(positions)
+            if x in x_index
+            and y in y_index
+            and not (np.abs(x) + np.abs(y) >= 60 and exclude_wafer_edges)
+        ]
+        indices[data_type] = tuple(np.array(kept, dtype=int).reshape(-1, 2).T)
+
+    keys = {}
+    for rank, name in enumerate(data.data_vars):
+        data_type = data_types[name]
+        first = 0
+        if data[name].dims == ("y", "x"):
+            values = data[name].values[indices[data_type]]
+            found = np.flatnonzero(~np.isnan(values))
+            # The maps without any value are dropped or kept last
+            first = found[0] if len(found) > 0 else len(values)
+        keys[name] = (technique_order.index(data_type), first, rank)
+
+    return data[sorted(keys, key=keys.get)]
+
+
+def _add_edx_results(data, hdf5_file, positions, x_vals, y_vals, exclude_wafer_edges):
+    """
+    Adds the EDX composition of the given positions to the dataset, see get_full_dataset.
+    """
     try:
         for x, y in positions:
             if np.abs(x) + np.abs(y) >= 60 and exclude_wafer_edges:
@@ -194,10 +353,13 @@ def get_full_dataset(hdf5_file, exclude_wafer_edges=True):
         print("Warning: No EDX results found in the file")
         pass
 
-    # Looking for MOKE positions and scan numbers
-    positions = get_all_positions(hdf5_file, data_type="MOKE")
+    return None
 
-    # Retrieve Coercivity (from MOKE results)
+
+def _add_moke_results(data, hdf5_file, positions, x_vals, y_vals, exclude_wafer_edges):
+    """
+    Adds the MOKE results of the given positions to the dataset, see get_full_dataset.
+    """
     try:
         for x, y in positions:
             if np.abs(x) + np.abs(y) >= 60 and exclude_wafer_edges:
@@ -226,10 +388,15 @@ def get_full_dataset(hdf5_file, exclude_wafer_edges=True):
         print("Warning: No MOKE results found in the file")
         pass
 
-    # Looking for XRD positions and scan numbers
-    positions = get_all_positions(hdf5_file, data_type="XRD")
+    return None
+
+
+def _add_xrd_results(data, hdf5_file, positions, x_vals, y_vals, exclude_wafer_edges):
+    """
+    Adds the XRD phase fractions and lattice parameters of the given positions to the dataset, see get_full_dataset.
+    """
+    xrd_phases = {}
 
-    # Retrieve Lattice Parameter (from XRD results)
     try:
         for x, y in positions:
             if np.abs(x) + np.abs(y) >= 60 and exclude_wafer_edges:
@@ -308,18 +475,117 @@ def get_full_dataset(hdf5_file, exclude_wafer_edges=True):
                         ]
 
         # Getting the lattice units in the xarray
-        for phase in xrd_phases.keys():
-            for i, elm in enumerate(["phase_fraction", "A", "B", "C"]):
-                if elm in phase_keys and elm in xrd_units[phase]:
-                    data[lattice_labels[i]].attrs["units"] = xrd_units[phase][elm]
+        _set_xrd_units(data, xrd_phases, xrd_units)
+
+    except KeyError:
+        print("Warning: No XRD results found in the file")
+        pass
+
+    return None
+
+
+def _set_xrd_units(data, xrd_phases, xrd_units):
+    """
+    Sets the units of the XRD results from the results of the last position read, see _add_xrd_results.
+    As in the original loop, the units of every phase are given to the maps of the last phase.
+    """
+    if len(xrd_phases) == 0:
+        return None
+
+    last_phase = list(xrd_phases.keys())[-1]
+    phase_keys = xrd_phases[last_phase].keys()
+    lattice_labels = [f"{last_phase} {label}" for _, label in XRD_RESULT_LABELS]
+
+    for phase in xrd_phases.keys():
+        for i, (elm, _) in enumerate(XRD_RESULT_LABELS):
+            if elm in phase_keys and elm in xrd_units[phase]:
+                data[lattice_labels[i]].attrs["units"] = xrd_units[phase][elm]
+
+    return None
+
+
+def _parse_xrd_value(value):
+    """
+    Reads a refined XRD value stored as a string such as b'8.80103+-0.0001'.
+
+    Returns
+    -------
+    tuple
+        The value and its uncertainty, NaN if the value is undefined or if there is no uncertainty.
+    """
+    text = str(value).replace("b", "").replace("'", "").strip()
+    if "UNDEF" in text:
+        return np.nan, np.nan
+
+    parts = text.split("+-")
+    try:
+        result = float(parts[0])
+    except ValueError:
+        return np.nan, np.nan
+    try:
+        uncertainty = float(parts[1]) if len(parts) > 1 else np.nan
+    except ValueError:
+        uncertainty = np.nan
+
+    return result, uncertainty
+
+
+def _add_xrd_phase_results(
+    data, hdf5_file, positions, x_vals, y_vals, exclude_wafer_edges
+):
+    """
+    Adds the XRD results and uncertainties of the given positions to the ('phase', 'y', 'x') arrays of the dataset,
+    see get_full_dataset with phase_dimension=True. Phases missing from the 'phase' coordinate are ignored.
+    """
+    phase_index = {phase: i for i, phase in enumerate(data["phase"].values)}
+    x_index = {x: i for i, x in enumerate(x_vals)}
+    y_index = {y: i for i, y in enumerate(y_vals)}
+
+    try:
+        for x, y in positions:
+            if np.abs(x) + np.abs(y) >= 60 and exclude_wafer_edges:
+                continue
+            xrd_group_path = make_group_path(
+                hdf5_file, x_pos=x, y_pos=y, data_type="XRD", measurement_type="Results"
+            )
+            xrd_phases, xrd_units = get_xrd_results(
+                hdf5_file, xrd_group_path, result_type="Phases"
+            )
+
+            for phase in xrd_phases.keys():
+                if phase not in phase_index:
+                    continue
+                for key, label in XRD_RESULT_LABELS:
+                    if key not in xrd_phases[phase] or label not in data:
+                        continue
+                    value, uncertainty = _parse_xrd_value(xrd_phases[phase][key])
+                    # Writing in the numpy arrays directly, much faster than .loc for many phases
+                    index = (phase_index[phase], y_index[y], x_index[x])
+                    data[label].values[index] = value
+                    # Compact datasets have no uncertainties, see compact_dataset
+                    if f"{label} Uncertainty" in data:
+                        data[f"{label} Uncertainty"].values[index] = uncertainty
+
+                    if key in xrd_units[phase] and "units" not in data[label].attrs:
+                        data[label].attrs["units"] = xrd_units[phase][key]
+                        if f"{label} Uncertainty" in data:
+                            data[f"{label} Uncertainty"].attrs["units"] = xrd_units[
+                                phase
+                            ][key]
 
     except KeyError:
         print("Warning: No XRD results found in the file")
         pass
 
-    # Looking for PROFIL positions and scan numbers
-    positions = get_all_positions(hdf5_file, data_type="PROFIL")
+    return None
+
 
+def _add_profil_results(
+    data, hdf5_file, positions, x_vals, y_vals, exclude_wafer_edges
+):
+    """
+    Adds the PROFIL measured heights of the given positions to the dataset, see get_full_dataset.
+    """
     try:
         for x, y in positions:
             if np.abs(x) + np.abs(y) >= 60 and exclude_wafer_edges:
@@ -346,33 +612,599 @@ def get_full_dataset(hdf5_file, exclude_wafer_edges=True):
         print("Warning: No PROFIL results found in the file")
         pass
 
-    # Setting the units for x_pos and y_pos
-    data["x"].attrs["units"] = position_units["x_pos"]
-    data["y"].attrs["units"] = position_units["y_pos"]
+    return None
+
+
+def _add_results_from_plan(
+    data,
+    hdf5_file,
+    positions,
+    x_vals,
+    y_vals,
+    exclude_wafer_edges,
+    data_type,
+    phase_dimension=False,
+):
+    """
+    Adds the results of a technique at the given positions to the dataset with a read plan (see read_plan.compile_read_plan).
+    The result datasets are listed once at a reference position, then read at every position in a single opened file.
+    The positions whose structure differs from the reference position are read with the reader of the technique
+    (_add_edx_results, _add_moke_results, _add_xrd_results or _add_profil_results), which gives the same dataset.
+    """
+    readers = {
+        "EDX": _add_edx_results,
+        "MOKE": _add_moke_results,
+        "XRD": _add_xrd_phase_results if phase_dimension else _add_xrd_results,
+        "PROFIL": _add_profil_results,
+    }
+    add_results = readers[data_type]
+
+    positions = [
+        (x, y)
+        for x, y in positions
+        if not (np.abs(x) + np.abs(y) >= 60 and exclude_wafer_edges)
+    ]
+    if len(positions) == 0:
+        return None
+
+    x_index = {x: i for i, x in enumerate(x_vals)}
+    y_index = {y: j for j, y in enumerate(y_vals)}
+    group_names = {}
+    irregular_positions = []
+    for x, y in positions:
+        # Positions outside of the grid are left to the reader of the technique
+        if x in x_index and y in y_index:
+            group_names[get_position_group_name(x, y)] = (x, y)
+        else:
+            irregular_positions.append((x, y))
+
+    plan = None
+    with open_hdf5(hdf5_file) as h5f:
+        technique_groups = get_technique_groups(h5f)
+        if data_type in technique_groups and len(group_names) > 0:
+            technique_group = h5f[technique_groups[data_type]]
+            try:
+                plan = compile_read_plan(
+                    technique_group[next(iter(group_names))], data_type
+                )
+            except KeyError:
+                plan = None
+
+        if plan is None:
+            add_results(data, hdf5_file, positions, x_vals, y_vals, False)
+            return None
+
+        values, irregular = execute_read_plan(technique_group, plan, list(group_names))
+
+    irregular_positions += [group_names[group_name] for group_name in irregular]
+    labels = dict(XRD_RESULT_LABELS)
+    if phase_dimension and data_type == "XRD":
+        phase_index = {phase: i for i, phase in enumerate(data["phase"].values)}
+    # Writing in the numpy arrays directly, much faster than .loc
+    arrays = {}
+
+    def set_value(name, index, value):
+        if name not in arrays:
+            arrays[name] = data[name].values
+        arrays[name][index] = value
+
+    for group_name, position_values in values.items():
+        x, y = group_names[group_name]
+        index = (y_index[y], x_index[x])
+
+        for key, value in position_values.items():
+            if data_type == "XRD":
+                phase, xrd_key = key
+                value, uncertainty = _parse_xrd_value(value)
+                if phase_dimension:
+                    if phase not in phase_index or labels[xrd_key] not in data:
+                        continue
+                    phase_position = (phase_index[phase],) + index
+                    set_value(labels[xrd_key], phase_position, value)
+                    # Compact datasets have no uncertainties, see compact_dataset
+                    if f"{labels[xrd_key]} Uncertainty" in data:
+                        set_value(
+                            f"{labels[xrd_key]} Uncertainty",
+                            phase_position,
+                            uncertainty,
+                        )
+                    continue
+                name = f"{phase} {labels[xrd_key]}"
+            elif data_type == "EDX":
+                name = f"{key} Composition"
+            else:
+                name = key
+
+            # Maps are only created for new results with a value, as in the readers
+            if name not in data and not (
+                data_type in ["EDX", "XRD"] and math.isnan(value)
+            ):
+                data[name] = xr.DataArray(
+                    np.nan, coords=[y_vals, x_vals], dims=["y", "x"]
+                )
+            if name in data:
+                set_value(name, index, value)
+
+    # Units of the reference position
+    if len(values) > 0:
+        for _, key, units, _, _ in plan["entries"]:
+            if units is None:
+                continue
+            if data_type == "XRD":
+                if phase_dimension and labels[key[1]] in data:
+                    for name in [labels[key[1]], f"{labels[key[1]]} Uncertainty"]:
+                        if name in data and "units" not in data[name].attrs:
+                            data[name].attrs["units"] = units
+                continue
+            name = f"{key} Composition" if data_type == "EDX" else key
+            if name in data:
+                data[name].attrs["units"] = units
+
+    if len(irregular_positions) > 0:
+        add_results(data, hdf5_file, irregular_positions, x_vals, y_vals, False)
+
+    # The XRD units are given by the results of the last position, see _set_xrd_units
+    if data_type == "XRD" and not phase_dimension:
+        x, y = positions[-1]
+        if (x, y) not in irregular_positions:
+            xrd_group_path = make_group_path(
+                hdf5_file, x_pos=x, y_pos=y, data_type="XRD", measurement_type="Results"
+            )
+            xrd_phases, xrd_units = get_xrd_results(
+                hdf5_file, xrd_group_path, result_type="Phases"
+            )
+            _set_xrd_units(data, xrd_phases, xrd_units)
+
+    return None
+
+
+def _add_regridded_results(
+    data,
+    hdf5_file,
+    manifest,
+    positions,
+    x_vals,
+    y_vals,
+    exclude_wafer_edges,
+    data_type,
+    phase_dimension=False,
+    target_mask=None,
+    regrid_method="nearest",
+    regrid_options=None,
+):
+    """
+    Reads the results of a technique on the grid of its own positions, then resamples them onto the grid of the
+    dataset (see analysis.regrid.compute_regrid_weights). The weights are computed once for all the results of
+    the technique. target_mask is the (y, x) mask of the positions of the dataset which get a value, all of them if None.
+    """
+    positions = [
+        (x, y)
+        for x, y in positions
+        if not (np.abs(x) + np.abs(y) >= 60 and exclude_wafer_edges)
+    ]
+    if len(positions) == 0:
+        return None
+
+    native_x = sorted(set(x for x, _ in positions))
+    native_y = sorted(set(y for _, y in positions))
+    native, _, _ = _preallocate_results(
+        {"techniques": {data_type: manifest["techniques"][data_type]}},
+        native_x,
+        native_y,
+        phase_dimension,
+    )
+    _add_results_from_plan(
+        native,
+        hdf5_file,
+        positions,
+        native_x,
+        native_y,
+        False,
+        data_type,
+        phase_dimension,
+    )
+
+    regrid_weights = compute_regrid_weights(
+        positions, x_vals, y_vals, regrid_method, **(regrid_options or {})
+    )
+    x_index = np.array([native_x.index(x) for x, _ in positions])
+    y_index = np.array([native_y.index(y) for _, y in positions])
+
+    for name in native.data_vars:
+        values = apply_regrid_weights(
+            native[name].values[..., y_index, x_index], regrid_weights
+        )
+        # Values are only given at the positions of the dataset
+        if target_mask is not None:
+            values[..., ~target_mask] = np.nan
+        if name in data:
+            data[name].values[...] = values
+        else:
+            data[name] = xr.DataArray(values, coords=[y_vals, x_vals], dims=["y", "x"])
+        data[name].attrs.update(native[name].attrs)
+
+    return None
+
+
+def stack_phases(data):
+    """
+    Replaces the '<phase> Phase Fraction' and '<phase> Lattice Parameter A/B/C' maps of a dataset
+    by 'Phase Fraction' and 'Lattice Parameter A/B/C' arrays with the dimensions ('phase', 'y', 'x').
+
+    Parameters
+    ----------
+    data : xarray.Dataset
+        The dataset returned by get_full_dataset.
+
+    Returns
+    -------
+    xarray.Dataset
+        The dataset with a 'phase' coordinate listing the phases. A result missing for a phase is NaN.
+    """
+    phases = []
+    for name in data.data_vars:
+        for _, label in XRD_RESULT_LABELS:
+            if name.endswith(f" {label}"):
+                phase = name[: -len(label) - 1]
+                if phase not in phases:
+                    phases.append(phase)
+    if len(phases) == 0:
+        return data
+
+    stacked = {}
+    for _, label in XRD_RESULT_LABELS:
+        names = [f"{phase} {label}" for phase in phases]
+        if not any(name in data for name in names):
+            continue
+        values = np.full(
+            (len(phases), data.sizes["y"], data.sizes["x"]),
+            np.nan,
+            dtype=np.result_type(*[data[name].dtype for name in names if name in data]),
+        )
+        attrs = {}
+        for i, name in enumerate(names):
+            if name in data:
+                values[i] = data[name].transpose("y", "x").values
+                attrs.update(data[name].attrs)
+        stacked[label] = xr.DataArray(
+            values,
+            coords={"phase": phases, "y": data["y"], "x": data["x"]},
+            dims=["phase", "y", "x"],
+            attrs=attrs,
+        )
+
+    mangled_names = [
+        f"{phase} {label}" for phase in phases for _, label in XRD_RESULT_LABELS
+    ]
+    data = data.drop_vars([name for name in mangled_names if name in data])
+
+    return data.assign(stacked)
+
+
+def compact_dataset(data, sparse_threshold=None):
+    """
+    Reduces the memory used by a dataset returned by get_full_dataset: the values are stored in float32,
+    the phase results along a 'phase' dimension (see stack_phases) and, optionally, the maps with few
+    measured values as sparse arrays.
+
+    Parameters
+    ----------
+    data : xarray.Dataset
+        The dataset returned by get_full_dataset.
+    sparse_threshold : float, optional
+        The maps in which the fraction of measured (not NaN) values is below this threshold are stored as
+        sparse.COO arrays with NaN as fill value, which needs the optional sparse package.
+        Each measured value then also stores its coordinates (8 bytes per dimension), so a threshold around 0.1
+        is a good choice. If None, all the maps are kept as numpy arrays. Defaults to None.
+
+    Returns
+    -------
+    xarray.Dataset
+        The compact dataset.
+    """
+    data = stack_phases(data)
+
+    for name in data.data_vars:
+        if np.issubdtype(data[name].dtype, np.floating):
+            data[name] = data[name].astype(np.float32)
+
+    if sparse_threshold is not None:
+        try:
+            import sparse
+        except ImportError:
+            raise ImportError(
+                "sparse is needed to store the maps as sparse arrays, install it with 'pip install sparse'."
+            )
+
+        for name in data.data_vars:
+            values = data[name].values
+            if values.size > 0 and np.count_nonzero(~np.isnan(values)) < (
+                sparse_threshold * values.size
+            ):
+                data[name] = data[name].copy(
+                    data=sparse.COO.from_numpy(values, fill_value=np.nan)
+                )
 
     return data
 
 
-def search_measurement_data_from_type(hdf5_file, data_type, x_pos, y_pos):
+def get_full_dataset(
+    hdf5_file,
+    exclude_wafer_edges=True,
+    hdf5_options=None,
+    compact=False,
+    sparse_threshold=None,
+    phase_dimension=False,
+    regrid_method=None,
+    regrid_options=None,
+):
+    """
+    Reads the measurement data from an HDF5 file and returns an xarray DataArray object containing all the scans of every experiment.
+
+    Parameters
+    ----------
+    hdf5_file : str, pathlib.Path or file-like object
+        The path to the HDF5 file to read the data from.
+    exclude_wafer_edges : bool, optional
+        If True, the function will exclude the data measured at the edges of the wafer from the returned DataArray. Defaults to True.
+    hdf5_options : dict, optional
+        Options used to open the HDF5 file, such as the chunk cache size or the driver (see hdf5_io.set_hdf5_options).
+        If None, the options of the session are used.
+    compact : bool, optional
+        If True, the values are stored in float32 and the XRD results along a 'phase' dimension (see compact_dataset).
+        Defaults to False.
+    sparse_threshold : float, optional
+        Only used in compact mode, the maps with a lower fraction of measured values are stored as sparse arrays
+        (see compact_dataset). Defaults to None.
+    phase_dimension : bool, optional
+        If True, the XRD results are returned as 'Phase Fraction' and 'Lattice Parameter A/B/C' arrays with the
+        dimensions ('phase', 'y', 'x'), along with their uncertainties ('Phase Fraction Uncertainty', ...), instead of
+        one '<phase> Phase Fraction' map per phase. Defaults to False.
+    regrid_method : str, optional
+        If None, the MOKE, XRD and PROFIL results are read at the EDX positions only. Otherwise, they are read at
+        their own positions and resampled onto the EDX grid with this method, either 'nearest', 'linear' or 'idw'
+        (see analysis.regrid.compute_regrid_weights). Defaults to None.
+    regrid_options : dict, optional
+        The options of the regridding (n_neighbors, power, max_distance), see analysis.regrid.compute_regrid_weights.
+
+    Returns
+    -------
+    xarray.DataArray
+        A DataArray object containing all the scans of every experiment. The DataArray has a name attribute set to "Measurement Data".
+    """
+
+    with use_hdf5_options(**(hdf5_options or {})):
+        # Single walk through the file structure to find the positions and results
+        manifest = inspect(hdf5_file)
+        if "EDX" not in manifest["techniques"]:
+            raise ValueError("Data type EDX not found in HDF5 file.")
+
+        # Looking for EDX positions
+        positions = get_manifest_positions(manifest, "EDX")
+        x_units = manifest["techniques"]["EDX"]["variables"]["instrument/x_pos"]
+        y_units = manifest["techniques"]["EDX"]["variables"]["instrument/y_pos"]
+
+        x_vals = sorted(set([pos[0] for pos in positions]))
+        y_vals = sorted(set([pos[1] for pos in positions]))
+
+        data, optional_names, data_types = _preallocate_results(
+            manifest, x_vals, y_vals, phase_dimension
+        )
+
+        # EDX positions where the other techniques are resampled
+        if regrid_method is not None:
+            target_mask = np.zeros((len(y_vals), len(x_vals)), dtype=bool)
+            for x, y in positions:
+                if not (np.abs(x) + np.abs(y) >= 60 and exclude_wafer_edges):
+                    target_mask[y_vals.index(y), x_vals.index(x)] = True
+
+        # Retrieve EDX composition, Coercivity (from MOKE results), Lattice Parameter (from XRD results)
+        # and thickness (from PROFIL results)
+        for data_type in ["EDX", "MOKE", "XRD", "PROFIL"]:
+            positions = get_manifest_positions(manifest, data_type)
+            if regrid_method is not None and data_type != "EDX":
+                _add_regridded_results(
+                    data,
+                    hdf5_file,
+                    manifest,
+                    positions,
+                    x_vals,
+                    y_vals,
+                    exclude_wafer_edges,
+                    data_type,
+                    phase_dimension,
+                    target_mask,
+                    regrid_method,
+                    regrid_options,
+                )
+                continue
+            _add_results_from_plan(
+                data,
+                hdf5_file,
+                positions,
+                x_vals,
+                y_vals,
+                exclude_wafer_edges,
+                data_type,
+                phase_dimension,
+            )
+
+        data = _sort_results_by_discovery(
+            data, manifest, data_types, exclude_wafer_edges, regrid_method is not None
+        )
+
+        # EDX and XRD maps are only kept if at least one value was found
+        empty_names = [
+            name for name in optional_names if bool(data[name].isnull().all())
+        ]
+        data = data.drop_vars(empty_names)
+
+        # Setting the units for x_pos and y_pos
+        data["x"].attrs["units"] = x_units["units"]
+        data["y"].attrs["units"] = y_units["units"]
+
+        if compact:
+            data = compact_dataset(data, sparse_threshold)
+
+        # Layout of the dataset, used by refresh_full_dataset
+        data.attrs["compact"] = int(compact)
+        data.attrs["phase_dimension"] = int(phase_dimension)
+        if compact and sparse_threshold is not None:
+            data.attrs["sparse_threshold"] = sparse_threshold
+
+        return data
+
+
+def refresh_full_dataset(
+    hdf5_file,
+    data=None,
+    position_index=None,
+    exclude_wafer_edges=True,
+    hdf5_options=None,
+):
+    """
+    Incrementally updates a dataset built with get_full_dataset while the HDF5 file is growing.
+    Only the positions that were appended since the last call are read, except for the techniques
+    whose root group or hdf5_reader modification changed, which are read again entirely.
+
+    Parameters
+    ----------
+    hdf5_file : str, pathlib.Path or file-like object
+        The path to the HDF5 file to read the data from.
+    data : xarray.Dataset, optional
+        The dataset returned by the previous call. If None, the full dataset is read.
+    position_index : dict, optional
+        The position index returned by the previous call (see get_position_index). If None, the full dataset is read.
+    exclude_wafer_edges : bool, optional
+        If True, the function will exclude the data measured at the edges of the wafer. Defaults to True.
+    hdf5_options : dict, optional
+        Options used to open the HDF5 file (see hdf5_io.set_hdf5_options). If None, the options of the session are used.
+
+    Returns
+    -------
+    xarray.Dataset
+        The updated dataset, the new values are patched in place when the grid did not change.
+    dict
+        The position index the dataset is now built from, to give to the next call.
+
+    Notes
+    -----
+    Positions removed from the file are not removed from the dataset. For a dataset with a 'phase' dimension,
+    the phases that were not in the file at the first read are ignored. The layout of the dataset (compact,
+    sparse_threshold and phase_dimension of get_full_dataset) is read from its attributes and kept.
+    """
+
+    with use_hdf5_options(**(hdf5_options or {})):
+        new_index = get_position_index(hdf5_file)
+
+        if data is None or position_index is None:
+            return get_full_dataset(hdf5_file, exclude_wafer_edges), new_index
+
+        # Layout of the dataset, recorded by get_full_dataset
+        compact = bool(data.attrs.get("compact", False))
+        sparse_threshold = data.attrs.get("sparse_threshold", None)
+        phase_dimension = bool(
+            data.attrs.get("phase_dimension", "phase" in data.dims) or compact
+        )
+        if compact:
+            # The sparse maps are updated as numpy arrays and compacted again at the end
+            for name in data.data_vars:
+                if hasattr(data[name].data, "todense"):
+                    data[name] = data[name].copy(data=data[name].data.todense())
+
+        # The grid is always built from the EDX positions, as in get_full_dataset
+        positions = new_index["EDX"]["positions"]
+        x_vals = sorted(set([pos[0] for pos in positions]))
+        y_vals = sorted(set([pos[1] for pos in positions]))
+
+        # Positions of the other techniques in the new rows and columns were outside of the previous grid
+        added_x, added_y = set(), set()
+        if list(data["x"].values) != x_vals or list(data["y"].values) != y_vals:
+            added_x = set(x_vals) - set(data["x"].values)
+            added_y = set(y_vals) - set(data["y"].values)
+            position_units = get_position_units(hdf5_file, data_type="EDX")
+            data = data.reindex(x=x_vals, y=y_vals)
+            data["x"].attrs["units"] = position_units["x_pos"]
+            data["y"].attrs["units"] = position_units["y_pos"]
+
+        for data_type in ["EDX", "MOKE", "XRD", "PROFIL"]:
+            if data_type not in new_index:
+                continue
+            current = new_index[data_type]
+            previous = position_index.get(data_type, None)
+
+            # A new root group or reader modification invalidates all the values of the technique
+            if (
+                previous is None
+                or previous["group"] != current["group"]
+                or previous["hdf5_reader"] != current["hdf5_reader"]
+            ):
+                new_positions = current["positions"]
+            else:
+                new_positions = set(current["positions"]) - set(previous["positions"])
+                new_positions |= set(
+                    (x, y)
+                    for x, y in current["positions"]
+                    if x in added_x or y in added_y
+                )
+                new_positions = sorted(new_positions)
+
+            if len(new_positions) > 0:
+                _add_results_from_plan(
+                    data,
+                    hdf5_file,
+                    new_positions,
+                    x_vals,
+                    y_vals,
+                    exclude_wafer_edges,
+                    data_type,
+                    phase_dimension,
+                )
+
+        if compact:
+            data = compact_dataset(data, sparse_threshold)
+
+        return data, new_index
+
+
+def search_measurement_data_from_type(
+    hdf5_file, data_type, x_pos, y_pos, mmap=False, use_cache=True
+):
     """
     Retrieves measurement data from an HDF5 file for a specified data type and position.
 
     Parameters
     ----------
-    hdf5_file : str or pathlib.Path
+    hdf5_file : str, pathlib.Path or file-like object
         The path to the HDF5 file to read the data from.
     data_type : str
-        The type of data to read, either 'EDX', 'MOKE', or 'XRD'.
+        The type of data to read, either 'EDX', 'MOKE', 'XRD' or 'PROFIL'.
     x_pos : float
         The x position of the measurement.
     y_pos : float
         The y position of the measurement.
+    mmap : bool, optional
+        If True, the EDX and XRD data stored contiguously in the file are returned as read-only memory maps. Defaults to False.
+    use_cache : bool, optional
+        If True, the measurement is kept in the in-memory cache of the readers (see read_cache) and the next
+        calls for the same file and position do not read the file again. Memory maps are never cached. Defaults to True.
 
     Returns
     -------
     tuple
         A tuple containing the measurement data and its units.
+
+    Notes
+    -----
+    If the position is not found in the HDF5 file, the function returns 1 like the readers.
     """
+    fingerprint = None
+    if use_cache and not mmap:
+        fingerprint = get_file_fingerprint(hdf5_file)
+    if fingerprint is not None:
+        cached = get_cached_measurement(fingerprint, data_type, x_pos, y_pos)
+        if cached is not None:
+            return cached
 
     if data_type.lower() == "edx":
         group_path = make_group_path(
@@ -382,7 +1214,7 @@ def search_measurement_data_from_type(hdf5_file, data_type, x_pos, y_pos):
             x_pos=x_pos,
             y_pos=y_pos,
         )
-        data, data_units = get_edx_spectrum(hdf5_file, group_path)
+        result = get_edx_spectrum(hdf5_file, group_path, mmap=mmap)
     elif data_type.lower() == "moke":
         group_path = make_group_path(
             hdf5_file,
@@ -391,7 +1223,7 @@ def search_measurement_data_from_type(hdf5_file, data_type, x_pos, y_pos):
             x_pos=x_pos,
             y_pos=y_pos,
         )
-        data, data_units = get_moke_loop(hdf5_file, group_path)
+        result = get_moke_loop(hdf5_file, group_path)
     elif data_type.lower() == "xrd":
         group_path = make_group_path(
             hdf5_file,
@@ -400,7 +1232,23 @@ def search_measurement_data_from_type(hdf5_file, data_type, x_pos, y_pos):
             x_pos=x_pos,
             y_pos=y_pos,
         )
-        data, data_units = get_xrd_pattern(hdf5_file, group_path)
+        result = get_xrd_pattern(hdf5_file, group_path, mmap=mmap)
+    elif data_type.lower() == "profil":
+        group_path = make_group_path(
+            hdf5_file,
+            data_type="PROFIL",
+            measurement_type="Measurement",
+            x_pos=x_pos,
+            y_pos=y_pos,
+        )
+        result = get_profile(hdf5_file, group_path)
+
+    if result == 1:
+        return 1
+    data, data_units = result
+
+    if fingerprint is not None:
+        cache_measurement(fingerprint, data_type, x_pos, y_pos, data, data_units)
 
     return data, data_units
 
@@ -451,20 +1299,24 @@ def add_measurement_data(dataset, measurement, data_type, x, y, x_vals, y_vals):
     return None
 
 
-def get_current_dataset(data_type, dataset_edx, dataset_moke, dataset_xrd):
+def get_current_dataset(
+    data_type, dataset_edx, dataset_moke, dataset_xrd, dataset_profil=None
+):
     """
     Returns the current dataset based on the given data_type.
 
     Parameters
     ----------
     data_type : str
-        The type of data to read. Must be one of 'EDX', 'MOKE', 'XRD'.
+        The type of data to read. Must be one of 'EDX', 'MOKE', 'XRD', 'PROFIL'.
     dataset_edx : xarray.Dataset
         The Dataset containing the EDX data.
     dataset_moke : xarray.Dataset
         The Dataset containing the MOKE data.
     dataset_xrd : xarray.Dataset
         The Dataset containing the XRD data.
+    dataset_profil : xarray.Dataset, optional
+        The Dataset containing the PROFIL data.
 
     Returns
     -------
@@ -478,95 +1330,158 @@ def get_current_dataset(data_type, dataset_edx, dataset_moke, dataset_xrd):
         current_dataset = dataset_moke
     elif data_type.lower() == "xrd":
         current_dataset = dataset_xrd
+    elif data_type.lower() == "profil":
+        current_dataset = dataset_profil
 
     return current_dataset
 
 
-def get_measurement_data(hdf5_file, datatype, exclude_wafer_edges=True):
+def get_measurement_data(
+    hdf5_file, datatype, exclude_wafer_edges=True, hdf5_options=None
+):
     """
     Reads measurement data from the given HDF5 file and returns an xarray DataTree object containing the measurement data.
 
     Parameters
     ----------
-    hdf5_file : str or pathlib.Path
+    hdf5_file : str, pathlib.Path or file-like object
         The path to the HDF5 file to read the data from.
     data_type : str
-        The type of data to read. Must be one of 'EDX', 'MOKE', 'XRD', or 'all'.
+        The type of data to read. Must be one of 'EDX', 'MOKE', 'XRD', 'PROFIL' or 'all'.
+        With 'all', the PROFIL profiles are read if the file contains them.
     exclude_wafer_edges : bool, optional
         If True, the function will exclude the data measured at the edges of the wafer from the returned DataTree. Defaults to True.
+    hdf5_options : dict, optional
+        Options used to open the HDF5 file, such as the chunk cache size or the driver (see hdf5_io.set_hdf5_options).
+        If None, the options of the session are used.
 
     Returns
     -------
     xarray.DataTree
-        A DataTree object containing the measurement data.
+        A DataTree object containing the measurement data. The PROFIL 'distance' and 'profile' have the
+        dimensions ('y', 'x', 'scan_position'), padded with NaN if the profiles have different lengths.
     """
 
-    # Check if data_type is valid
-    if datatype.lower() == "all":
-        datatypes = ["EDX", "MOKE", "XRD"]
-
-    elif not datatype.lower() in ["edx", "moke", "xrd"]:
-        print("data_type must be one of 'EDX', 'MOKE', 'XRD' or 'all'.")
-        return 1
-    else:
-        datatypes = [datatype]
-
-    measurement_tree = xr.DataTree(name="Measurement Data")
-    dataset_edx = xr.Dataset()
-    dataset_moke = xr.Dataset()
-    dataset_xrd = xr.Dataset()
-
-    for data_type in datatypes:
-        print("Reading", data_type)
-        positions = get_all_positions(hdf5_file, data_type=data_type)
-        x_vals = sorted(set([pos[0] for pos in positions]))
-        y_vals = sorted(set([pos[1] for pos in positions]))
+    with use_hdf5_options(**(hdf5_options or {})):
+        # Check if data_type is valid
+        if datatype.lower() == "all":
+            datatypes = ["EDX", "MOKE", "XRD"]
 
-        # Looking for modified datasets
-        with h5py.File(hdf5_file, "r") as h5f:
-            group = make_group_path(hdf5_file, data_type)
-            if "hdf5_reader" in h5f[group].attrs.keys():
+        elif not datatype.lower() in ["edx", "moke", "xrd", "profil"]:
+            print("data_type must be one of 'EDX', 'MOKE', 'XRD', 'PROFIL' or 'all'.")
+            return 1
+        else:
+            datatypes = [datatype]
+
+        measurement_tree = xr.DataTree(name="Measurement Data")
+        dataset_edx = xr.Dataset()
+        dataset_moke = xr.Dataset()
+        dataset_xrd = xr.Dataset()
+        dataset_profil = xr.Dataset()
+
+        # Single walk through the file structure to find the positions
+        manifest = inspect(hdf5_file)
+        if datatype.lower() == "all" and "PROFIL" in manifest["techniques"]:
+            datatypes.append("PROFIL")
+
+        for data_type in datatypes:
+            print("Reading", data_type)
+            if data_type.upper() not in manifest["techniques"]:
+                raise ValueError(f"Data type {data_type} not found in HDF5 file.")
+            technique = manifest["techniques"][data_type.upper()]
+
+            positions = get_manifest_positions(manifest, data_type)
+            x_vals = sorted(set([pos[0] for pos in positions]))
+            y_vals = sorted(set([pos[1] for pos in positions]))
+            x_index = {x: i for i, x in enumerate(x_vals)}
+            y_index = {y: i for i, y in enumerate(y_vals)}
+
+            # Looking for modified datasets
+            if technique["hdf5_reader"] is not None:
                 print("Modified dataset found for", data_type)
-                print(h5f[group].attrs["note"])
+                print(technique["note"])
 
-        # Add measurement data
-        for x, y in positions:
-            if np.abs(x) + np.abs(y) > 60 and exclude_wafer_edges:
-                continue
-            measurement, units = search_measurement_data_from_type(
-                hdf5_file, data_type, x, y
-            )
             current_dataset = get_current_dataset(
-                data_type, dataset_edx, dataset_moke, dataset_xrd
-            )
-            add_measurement_data(
-                current_dataset, measurement, data_type, x, y, x_vals, y_vals
+                data_type, dataset_edx, dataset_moke, dataset_xrd, dataset_profil
             )
 
-        # Add units for x, y positions for all datasets
-        position_units = get_position_units(hdf5_file, data_type=data_type)
-        current_dataset["x"].attrs["units"] = position_units["x_pos"]
-        current_dataset["y"].attrs["units"] = position_units["y_pos"]
-
-        # Add units for scan axis in all datasets
-        for key in units.keys():
-            if data_type.lower() != "moke":
-                if key in current_dataset:
-                    current_dataset[key].attrs["units"] = units[key]
-            # else:
-            #     if (
-            #         key in current_dataset["index_value"]
-            #         and "units" not in current_dataset["Loops"].attrs
-            #     ):
-            #         print(units[key])
-            #         current_dataset["Loops"].attrs["units"] = units
-
-    # Add datasets to the xarray DataTree
-    measurement_tree["EDX"] = dataset_edx
-    measurement_tree["MOKE"] = dataset_moke
-    measurement_tree["XRD"] = dataset_xrd
-
-    return measurement_tree
+            # Add measurement data, the (y, x, scan) arrays are allocated once from the first measurement
+            arrays = {}
+            scan_axes = {}
+            for x, y in positions:
+                if np.abs(x) + np.abs(y) > 60 and exclude_wafer_edges:
+                    continue
+                # Full wafers are read once, they would only fill the cache
+                measurement, units = search_measurement_data_from_type(
+                    hdf5_file, data_type, x, y, use_cache=False
+                )
+                for key in measurement.keys():
+                    value = measurement[key]
+                    # Special case for intensity where it is stored as shape (3000, 2)
+                    if key == "intensity":
+                        value = measurement[key][0][:2986]
+                    if key not in arrays:
+                        scan_axes[key] = value
+                        arrays[key] = np.full(
+                            (len(y_vals), len(x_vals), len(value)), np.nan
+                        )
+                    if data_type.upper() == "PROFIL":
+                        # Profiles can have different lengths, the shorter ones are padded with NaN
+                        n_missing = len(value) - arrays[key].shape[-1]
+                        if n_missing > 0:
+                            arrays[key] = np.pad(
+                                arrays[key],
+                                ((0, 0), (0, 0), (0, n_missing)),
+                                constant_values=np.nan,
+                            )
+                        arrays[key][y_index[y], x_index[x], : len(value)] = value
+                    else:
+                        arrays[key][y_index[y], x_index[x]] = value
+
+            for key in arrays.keys():
+                if data_type.upper() == "PROFIL":
+                    current_dataset[key] = xr.DataArray(
+                        arrays[key],
+                        coords=[y_vals, x_vals, np.arange(arrays[key].shape[-1])],
+                        dims=["y", "x", "scan_position"],
+                    )
+                    continue
+                current_dataset[key] = xr.DataArray(
+                    arrays[key],
+                    coords=[y_vals, x_vals, scan_axes[key]],
+                    dims=["y", "x", key],
+                )
+
+            # Add units for x, y positions for all datasets
+            current_dataset["x"].attrs["units"] = technique["variables"][
+                "instrument/x_pos"
+            ]["units"]
+            current_dataset["y"].attrs["units"] = technique["variables"][
+                "instrument/y_pos"
+            ]["units"]
+
+            # Add units for scan axis in all datasets
+            for key in units.keys():
+                if data_type.lower() != "moke":
+                    if key in current_dataset:
+                        current_dataset[key].attrs["units"] = units[key]
+                # else:
+                #     if (
+                #         key in current_dataset["index_value"]
+                #         and "units" not in current_dataset["Loops"].attrs
+                #     ):
+                #         print(units[key])
+                #         current_dataset["Loops"].attrs["units"] = units
+
+        # Add datasets to the xarray DataTree
+        measurement_tree["EDX"] = dataset_edx
+        measurement_tree["MOKE"] = dataset_moke
+        measurement_tree["XRD"] = dataset_xrd
+        # The PROFIL node is only added when profiles were read, older trees have no PROFIL child
+        if "PROFIL" in [data_type.upper() for data_type in datatypes]:
+            measurement_tree["PROFIL"] = dataset_profil
+
+        return measurement_tree
 
 
 # def get_xrd_images(hdf5_file, exclude_wafer_edges=True):
@@ -599,27 +1514,252 @@ def get_measurement_data(hdf5_file, datatype, exclude_wafer_edges=True):
 #     return dataset
 
 
-def create_simplified_dataset(hdf5_file, hdf5_save_file):
+def _get_simplified_placeholders(results, datatype):
+    """
+    Returns the NaN datasets saved by create_simplified_dataset for a position missing from a technique,
+    using the results of the reference position (0.0,0.0) to find their names.
+    """
+    datasets = []
+
+    # If EDX (but should never happened)
+    if datatype == "edx":
+        for key in results.keys():
+            if "Element" in key:
+                datasets.append(
+                    (key.split(" ")[-1], np.nan, {"units": "at.%", "HT_type": datatype})
+                )
+    # If MOKE
+    elif datatype == "moke":
+        for key in results.keys():
+            if key == "coercivity_m0":
+                datasets.append(
+                    (key, np.nan, {"units": "Tesla (T)", "HT_type": datatype})
+                )
+    # If XRD
+    elif datatype == "xrd":
+        saving_result_list = ["A", "B", "C", "phase_fraction"]
+
+        for phase in results["phases"].keys():
+            for saving_key in saving_result_list:
+                if saving_key in results["phases"][phase].keys():
+                    datasets.append((f"{phase}_{saving_key}", np.nan, {}))
+
+    return datasets
+
+
+def _get_simplified_datasets(h5f, group, coord, datatype):
+    """
+    Reads the datasets saved by create_simplified_dataset for a position measured by a technique.
+    """
+    datasets = []
+    node = h5f[f"{group}/{coord}"]
+
+    if datatype == "edx":
+        results = node["results"]
+        for key in results.keys():
+            if "Element" in key:
+                try:
+                    atom_percent = results[key]["AtomPercent"]
+                    datasets.append(
+                        (
+                            key.split(" ")[-1],
+                            atom_percent[()],
+                            {
+                                "units": atom_percent.attrs["units"],
+                                "HT_type": datatype,
+                            },
+                        )
+                    )
+                except KeyError:
+                    reference_results = h5f[f"{group}/(0.0,0.0)"]["results"]
+                    if (
+                        key in reference_results.keys()
+                        and "AtomPercent" in reference_results[key].keys()
+                    ):
+                        datasets.append(
+                            (
+                                key.split(" ")[-1],
+                                np.nan,
+                                {
+                                    "units": reference_results[key][
+                                        "AtomPercent"
+                                    ].attrs["units"],
+                                    "HT_type": datatype,
+                                },
+                            )
+                        )
+
+    elif datatype == "moke":
+        results = node["results"]
+        for key in results.keys():
+            if key == "coercivity_m0":
+                datasets.append(
+                    (
+                        key,
+                        results[key]["mean"][()],
+                        {"units": "Tesla (T)", "HT_type": datatype},
+                    )
+                )
+
+    elif datatype == "xrd":
+        saving_result_list = ["A", "B", "C", "phase_fraction"]
+        results = node["results/phases"]
+        measurement = node["measurement"]
+
+        # Fetching the results
+        for phase in results.keys():
+            phase_results = results[phase]
+            for result in saving_result_list:
+                if result in phase_results.keys():
+                    dataset = phase_results[result]
+                    attrs = {}
+                    # Taking into account missing attributes
+                    if "units" in dataset.attrs:
+                        attrs = {"units": dataset.attrs["units"], "HT_type": datatype}
+                    datasets.append(
+                        (
+                            f"{phase}_{result}",
+                            str(dataset[()]).strip().split("+-")[0],
+                            attrs,
+                        )
+                    )
+
+        # Fetching integrated intensity, integrated q and CdTe image
+        datasets.append(
+            (
+                "CdTe_integrate_intensity",
+                measurement["CdTe_integrate/intensity"][()],
+                {"units": "arbitrary unit (a.u.)", "HT_type": datatype},
+            )
+        )
+        datasets.append(
+            (
+                "CdTe_integrate_q",
+                measurement["CdTe_integrate/q"][()],
+                {"units": "Angstrom^-1 (A^-1)", "HT_type": datatype},
+            )
+        )
+        datasets.append(("CdTe", measurement["CdTe"][()], {"HT_type": datatype}))
+
+    return datasets
+
+
+def _extract_simplified_data(h5f, group, coords):
+    """
+    Reads in memory everything create_simplified_dataset saves from a technique group for the given positions.
+
+    Returns
+    -------
+    list
+        One (coord, position_datasets, datasets) tuple per position. position_datasets are the x_pos and y_pos
+        datasets, None if the position has no instrument group. datasets are the datasets of the technique, NaN
+        placeholders if the position was not measured, None if there is no reference position to create them.
+        Each dataset is a (name, data, attributes) tuple.
+    """
+    group_node = h5f[f"{group}"]
+    datatype = group_node.attrs["HT_type"]
+    measured_coords = set(group_node.keys())
+    placeholders = None
+    entries = []
+
+    for coord in coords:
+        position_datasets = None
+        if coord in measured_coords and "instrument" in group_node[coord]:
+            instrument = group_node[coord]["instrument"]
+            position_datasets = []
+            for pos in ["x_pos", "y_pos"]:
+                dataset = instrument[pos]
+                position_datasets.append(
+                    (
+                        pos,
+                        dataset[()],
+                        {"units": dataset.attrs["units"], "HT_type": "position"},
+                    )
+                )
+
+        if coord not in measured_coords:
+            # Giving NaN values for missing data
+            if placeholders is None and "(0.0,0.0)" in measured_coords:
+                placeholders = _get_simplified_placeholders(
+                    h5f[f"{group}/(0.0,0.0)"]["results"], datatype
+                )
+            entries.append((coord, position_datasets, placeholders))
+        else:
+            entries.append(
+                (
+                    coord,
+                    position_datasets,
+                    _get_simplified_datasets(h5f, group, coord, datatype),
+                )
+            )
+
+    return entries
+
+
+def _extract_simplified_task(hdf5_file, group, coords):
+    """
+    Runs _extract_simplified_data in a worker process.
+    """
+    with open_hdf5(hdf5_file) as h5f:
+        return _extract_simplified_data(h5f, group, coords)
+
+
+def _write_simplified_data(h5f_save, group, entries):
+    """
+    Writes the data read by _extract_simplified_data in the output file of create_simplified_dataset.
+    """
+    for coord, position_datasets, datasets in entries:
+        if coord not in h5f_save:
+            # Positions are only created by the techniques which measured them
+            if position_datasets is None:
+                continue
+            node = h5f_save.create_group(f"{coord}")
+            for name, data, attrs in position_datasets:
+                dataset = node.create_dataset(name, data=data)
+                for key, value in attrs.items():
+                    dataset.attrs[key] = value
+
+        if datasets is None:
+            raise KeyError(f"Reference position (0.0,0.0) not found in {group}.")
+
+        node = h5f_save[f"{coord}"]
+        for name, data, attrs in datasets:
+            dataset = node.create_dataset(name, data=data)
+            for key, value in attrs.items():
+                dataset.attrs[key] = value
+
+    return None
+
+
+def create_simplified_dataset(
+    hdf5_file, hdf5_save_file, workers=1, chunk_size=32, positions=None
+):
     """
     Creates a simplified HDF5 dataset with the measurement data sorted by x and y position coordinates.
 
     Parameters
     ----------
-    hdf5_file : str or pathlib.Path
+    hdf5_file : str, pathlib.Path or file-like object
         The path to the input HDF5 file.
     hdf5_save_file : str or pathlib.Path
         The path to the output HDF5 file.
+    workers : int, optional
+        The number of processes reading the input file. The positions are read by chunks in the worker processes
+        while the main process writes the chunks already read, in the same order as a sequential conversion.
+        File-like objects are always read in the main process. Defaults to 1.
+    chunk_size : int, optional
+        The number of positions of a technique read by a worker at once. Defaults to 32.
+    positions : list of tuple or str, optional
+        The (x, y) positions saved. If None, the positions of the -40 to 40 mm grid with 5 mm steps.
+        With 'file', the positions measured by at least one technique, whatever the pitch of the grid.
+        Defaults to None.
     """
 
     group_list = ["edx", "moke", "xrd"]
-    coord_list = [
-        "({:.1f},{:.1f})".format(float(x), float(y))
-        for x in range(-40, 45, 5)
-        for y in range(-40, 45, 5)
-    ]
-
-    with h5py.File(hdf5_file, "r") as h5f, h5py.File(hdf5_save_file, "w") as h5f_save:
 
+    with open_hdf5(hdf5_file) as h5f, h5py.File(hdf5_save_file, "w") as h5f_save:
+        groups = []
+        file_positions = set()
         for group in h5f["./"]:
             try:
                 datatype = h5f[f"{group}"].attrs["HT_type"]
@@ -627,179 +1767,89 @@ def create_simplified_dataset(hdf5_file, hdf5_save_file):
                 continue
 
             if datatype in group_list:
-                for coord in coord_list:
-                    # Check if the group already exists
-                    saved_group_coord = f"{group}/{coord}"
+                groups.append(group)
+                for group_name in h5f[f"{group}"].keys():
+                    position = parse_position(group_name)
+                    if position is not None:
+                        file_positions.add(position)
+
+        if positions is None:
+            positions = [
+                (float(x), float(y))
+                for x in range(-40, 45, 5)
+                for y in range(-40, 45, 5)
+            ]
+        elif isinstance(positions, str):
+            if positions != "file":
+                raise ValueError("positions must be None, 'file' or a list of (x, y).")
+            # Positions measured by any of the techniques, sorted by x then y
+            positions = sorted(file_positions)
+        coord_list = [
+            "({:.1f},{:.1f})".format(float(x), float(y)) for x, y in positions
+        ]
+
+        tasks = []
+        for group in groups:
+            for i in range(0, len(coord_list), chunk_size):
+                tasks.append((group, coord_list[i : i + chunk_size]))
+
+        if workers <= 1 or is_file_object(hdf5_file):
+            for group, coords in tasks:
+                _write_simplified_data(
+                    h5f_save, group, _extract_simplified_data(h5f, group, coords)
+                )
+            return None
+
+        # Bounding the number of chunks held in memory while the writer catches up
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = collections.deque()
+            for group, coords in tasks:
+                pending.append(
+                    (
+                        group,
+                        executor.submit(
+                            _extract_simplified_task, hdf5_file, group, coords
+                        ),
+                    )
+                )
+                if len(pending) >= 2 * workers:
+                    group_done, future = pending.popleft()
+                    _write_simplified_data(h5f_save, group_done, future.result())
+            while len(pending) > 0:
+                group_done, future = pending.popleft()
+                _write_simplified_data(h5f_save, group_done, future.result())
 
-                    if coord not in h5f_save:
-                        try:
-                            instrument = h5f[f"{saved_group_coord}"]["instrument"]
-                        except KeyError:
-                            continue
+    return None
 
-                        h5f_save.create_group(f"{coord}")
 
-                        # Create x and y position datasets
-                        h5f_save[f"{coord}"].create_dataset(
-                            "x_pos", data=instrument["x_pos"]
-                        )
-                        h5f_save[f"{coord}"].create_dataset(
-                            "y_pos", data=instrument["y_pos"]
-                        )
-                        h5f_save[f"{coord}"]["x_pos"].attrs["units"] = instrument[
-                            "x_pos"
-                        ].attrs["units"]
-                        h5f_save[f"{coord}"]["y_pos"].attrs["units"] = instrument[
-                            "y_pos"
-                        ].attrs["units"]
-                        h5f_save[f"{coord}"]["x_pos"].attrs["HT_type"] = "position"
-                        h5f_save[f"{coord}"]["y_pos"].attrs["HT_type"] = "position"
-
-                    if coord not in h5f[f"{group}"].keys():
-                        # Giving NaN values for missing data
-                        node = h5f_save[f"{coord}"]
-                        results = h5f[f"{group}/(0.0,0.0)"]["results"]
-                        # If EDX (but should never happened)
-                        if datatype == "edx":
-                            for key in results.keys():
-                                if "Element" in key:
-                                    node.create_dataset(key.split(" ")[-1], data=np.nan)
-                                    node[key.split(" ")[-1]].attrs["units"] = "at.%"
-                                    node[key.split(" ")[-1]].attrs["HT_type"] = datatype
-                        # If MOKE
-                        elif datatype == "moke":
-                            for key in results.keys():
-                                if key == "coercivity_m0":
-                                    node.create_dataset(key, data=np.nan)
-                                    node[key.split(" ")[-1]].attrs[
-                                        "units"
-                                    ] = "Tesla (T)"
-                                    node[key.split(" ")[-1]].attrs["HT_type"] = datatype
-                                elif key == "max_kerr_rotation":
-                                    pass
-                                    """node.create_dataset(key, data=np.nan)
-                                    node[key.split(" ")[-1]].attrs["HT_type"] = datatype"""
-
-                        # If XRD
-                        elif datatype == "xrd":
-                            saving_result_list = ["A", "B", "C", "phase_fraction"]
-
-                            for phase in results["phases"].keys():
-                                for saving_key in saving_result_list:
-                                    if saving_key in results["phases"][phase].keys():
-                                        node.create_dataset(
-                                            f"{phase}_{saving_key}", data=np.nan
-                                        )
-                        continue
+def save_dataset(dataset, hdf5_save_file, group=None, mode="w"):
+    """
+    Saves an xarray Dataset (for example the one returned by get_full_dataset) in an HDF5 file.
 
-                    # Creates new dataset with current datatype
-                    if datatype == "edx":
-                        node = h5f_save[f"{coord}"]
-                        results = h5f[f"{group}/{coord}"]["results"]
-                        for key in results.keys():
-                            if "Element" in key:
-                                try:
-                                    node.create_dataset(
-                                        key.split(" ")[-1],
-                                        data=results[key]["AtomPercent"][()],
-                                    )
-                                    node[key.split(" ")[-1]].attrs["units"] = results[
-                                        key
-                                    ]["AtomPercent"].attrs["units"]
-                                    node[key.split(" ")[-1]].attrs["HT_type"] = datatype
-                                except KeyError:
-                                    reference_results = h5f[f"{group}/(0.0,0.0)"][
-                                        "results"
-                                    ]
-                                    if (
-                                        key in reference_results.keys()
-                                        and "AtomPercent"
-                                        in reference_results[key].keys()
-                                    ):
-                                        node.create_dataset(
-                                            key.split(" ")[-1],
-                                            data=np.nan,
-                                        )
-                                        node[key.split(" ")[-1]].attrs["units"] = (
-                                            reference_results[key]["AtomPercent"].attrs[
-                                                "units"
-                                            ]
-                                        )
-                                        node[key.split(" ")[-1]].attrs[
-                                            "HT_type"
-                                        ] = datatype
-
-                    elif datatype == "moke":
-                        node = h5f_save[f"{coord}"]
-                        results = h5f[f"{group}/{coord}"]["results"]
-                        for key in results.keys():
-                            if key == "coercivity_m0":
-                                node.create_dataset(
-                                    key,
-                                    data=results[key]["mean"][()],
-                                )
-                                node[key].attrs["units"] = "Tesla (T)"
-                                node[key].attrs["HT_type"] = datatype
-                            elif key == "max_kerr_rotation":
-                                pass
-                                """ node.create_dataset(
-                                    key,
-                                    data=results[key][()],
-                                )
-                                node[key].attrs["units"] = "Degrees (°)"
-                                node[key].attrs["HT_type"] = datatype """
-
-                    elif datatype == "xrd":
-                        saving_result_list = ["A", "B", "C", "phase_fraction"]
-                        node = h5f_save[f"{coord}"]
-                        results = h5f[f"{group}/{coord}"]["results/phases"]
-                        measurement = h5f[f"{group}/{coord}"]["measurement"]
-
-                        # Fetching the results
-                        for phase in results.keys():
-                            for result in saving_result_list:
-                                if result in results[phase].keys():
-
-                                    node.create_dataset(
-                                        f"{phase}_{result}",
-                                        data=(
-                                            str(results[phase][result][()])
-                                            .strip()
-                                            .split("+-")[0]
-                                        ),
-                                    )
-                                    try:
-                                        node[f"{phase}_{result}"].attrs["units"] = (
-                                            results[phase][result].attrs["units"]
-                                        )
-                                        node[f"{phase}_{result}"].attrs[
-                                            "HT_type"
-                                        ] = datatype
-                                    except KeyError:
-                                        # Taking into account missing attributes
-                                        pass
-
-                        # Fetching integrated intensity
-                        node.create_dataset(
-                            "CdTe_integrate_intensity",
-                            data=measurement["CdTe_integrate/intensity"][()],
-                        )
-                        node["CdTe_integrate_intensity"].attrs[
-                            "units"
-                        ] = "arbitrary unit (a.u.)"
-                        node["CdTe_integrate_intensity"].attrs["HT_type"] = datatype
-
-                        # Fetching integrated q
-                        node.create_dataset(
-                            "CdTe_integrate_q",
-                            data=measurement["CdTe_integrate/q"][()],
-                        )
-                        node["CdTe_integrate_q"].attrs["units"] = "Angstrom^-1 (A^-1)"
-                        node["CdTe_integrate_q"].attrs["HT_type"] = datatype
+    Parameters
+    ----------
+    dataset : xarray.Dataset
+        The dataset to save.
+    hdf5_save_file : str or pathlib.Path
+        The path to the output HDF5 file.
+    group : str, optional
+        The group where the dataset is saved inside the HDF5 file. If None, the dataset is saved at the root of the file.
+    mode : str, optional
+        The mode used to open the output file, 'w' to overwrite it or 'a' to add a group to an existing file. Defaults to 'w'.
+
+    Notes
+    -----
+    Every coordinate and data variable is saved as an HDF5 dataset with its attributes, the
+    dimensions of each variable are kept in the 'dims' attribute.
+    """
+    with h5py.File(hdf5_save_file, mode) as h5f_save:
+        node = h5f_save if group is None else h5f_save.require_group(group)
+        node.attrs["HT_type"] = "xarray"
 
-                        # Fetching CdTe image
-                        node.create_dataset(
-                            "CdTe",
-                            data=measurement["CdTe"][()],
-                        )
-                        node["CdTe"].attrs["HT_type"] = datatype
+        for name, variable in dataset.variables.items():
+            node.create_dataset(name, data=variable.values)
+            node[name].attrs["dims"] = list(variable.dims)
+            for key, value in variable.attrs.items():
+                node[name].attrs[key] = value
+
+    return None
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+Read plans: the datasets of the results of a technique are listed once from a
+reference position, then read at every position without walking the tree again.
+
+@author: williamrigaut
+"""
+import h5py
+import numpy as np
+
+# Keys of the XRD phase results read by the plans
+XRD_RESULT_KEYS = ["phase_fraction", "A", "B", "C"]
+
+
+def get_position_group_name(x_pos, y_pos):
+    """
+    Returns the name of the group of a position, with the same format as make_group_path, for example '(-5.0,10.0)'.
+    """
+    return f"({str(round(float(x_pos), 1))},{str(round(float(y_pos), 1))})"
+
+
+def compile_read_plan(position_group, data_type):
+    """
+    Lists the result datasets of a technique from the group of a reference position.
+
+    Parameters
+    ----------
+    position_group : h5py.Group
+        The group of the reference position, for example the group '(0.0,0.0)' of the technique.
+    data_type : str
+        The type of data, either 'EDX', 'MOKE', 'XRD' or 'PROFIL'.
+
+    Returns
+    -------
+    dict
+        The plan, a dictionary with the keys:
+        - 'data_type' : the type of data.
+        - 'entries' : a list of (path relative to the position group, key, units, dtype, shape) tuples. The key
+          identifies the result: the element for EDX, the name of the result for MOKE and PROFIL, a (phase, result)
+          tuple for XRD. units is None if the dataset has no 'units' attribute.
+        - 'structure' : a dictionary with the paths of the groups the results were listed from as keys and their
+          number of members as values, see check_structure.
+
+    Notes
+    -----
+    The results are listed with the same rules as get_edx_composition, get_moke_results, get_xrd_results and
+    get_thickness.
+    """
+    data_type = data_type.upper()
+    results = position_group["results"]
+    entries = []
+    structure = {"results": len(results)}
+
+    def add_entry(path, key):
+        dataset = position_group[path]
+        units = dataset.attrs["units"] if "units" in dataset.attrs else None
+        entries.append((path, key, units, dataset.dtype, dataset.shape))
+
+    if data_type == "EDX":
+        for element in results.keys():
+            # Skipping TRTResult group as it is not part of the composition
+            if "TRTResult" in element:
+                continue
+            structure[f"results/{element}"] = len(results[element])
+            if "AtomPercent" in results[element]:
+                add_entry(f"results/{element}/AtomPercent", element.split()[-1])
+
+    elif data_type == "MOKE":
+        for key in results.keys():
+            node = results.get(key, getclass=True)
+            if node is h5py.Group and key != "parameters":
+                add_entry(f"results/{key}/mean", key)
+            elif node is h5py.Dataset:
+                add_entry(f"results/{key}", key)
+
+    elif data_type == "XRD":
+        phases = results["phases"]
+        structure["results/phases"] = len(phases)
+        for phase in phases.keys():
+            structure[f"results/phases/{phase}"] = len(phases[phase])
+            for key in XRD_RESULT_KEYS:
+                if key in phases[phase]:
+                    add_entry(f"results/phases/{phase}/{key}", (phase, key))
+
+    elif data_type == "PROFIL":
+        # Only the measured height is read, other results do not change the plan
+        structure = {}
+        if "measured_height" in results:
+            add_entry("results/measured_height", "measured_height")
+
+    else:
+        raise ValueError(f"No read plan for data type {data_type}.")
+
+    return {"data_type": data_type, "entries": entries, "structure": structure}
+
+
+def check_structure(position_group, plan):
+    """
+    Checks that a position group has the structure of the reference position of a plan (same number of members
+    in every group the results were listed from).
+
+    Parameters
+    ----------
+    position_group : h5py.Group or h5py.h5g.GroupID
+        The group of the position.
+    plan : dict
+        The plan returned by compile_read_plan.
+
+    Returns
+    -------
+    bool
+        True if the plan can be used for this position.
+    """
+    group_id = (
+        position_group.id if isinstance(position_group, h5py.Group) else position_group
+    )
+
+    for path, n_members in plan["structure"].items():
+        try:
+            if h5py.h5g.open(group_id, path.encode()).get_num_objs() != n_members:
+                return False
+        except (KeyError, ValueError):
+            return False
+
+    return True
+
+
+def execute_read_plan(technique_group, plan, group_names):
+    """
+    Reads the results of a plan at many positions.
+
+    Parameters
+    ----------
+    technique_group : h5py.Group
+        The root group of the technique.
+    plan : dict
+        The plan returned by compile_read_plan.
+    group_names : list of str
+        The names of the position groups to read.
+
+    Returns
+    -------
+    dict
+        A dictionary with the group names as keys and dictionaries {key: value} as values.
+    list
+        The group names whose structure differs from the plan (or missing from the file), which must be read
+        with the readers of the technique.
+    """
+    values = {}
+    irregular = []
+    # The paths are encoded once, the datasets are then opened with the low level API of h5py
+    # which avoids the creation of the high level objects at every read
+    entries = [
+        (path.encode(), key, dtype, shape)
+        for path, key, _, dtype, shape in plan["entries"]
+    ]
+    technique_id = technique_group.id
+
+    for group_name in group_names:
+        try:
+            position_id = h5py.h5g.open(technique_id, group_name.encode())
+        except (KeyError, ValueError):
+            irregular.append(group_name)
+            continue
+        if not check_structure(position_id, plan):
+            irregular.append(group_name)
+            continue
+
+        position_values = {}
+        try:
+            for path, key, dtype, shape in entries:
+                dataset_id = h5py.h5d.open(position_id, path)
+                if dataset_id.shape != shape:
+                    raise KeyError(path)
+                value = np.empty(shape, dtype=dtype)
+                dataset_id.read(h5py.h5s.ALL, h5py.h5s.ALL, value)
+                position_values[key] = value[()]
+        except (KeyError, ValueError):
+            irregular.append(group_name)
+            continue
+        values[group_name] = position_values
+
+    return values, irregular
@@ -5,6 +5,9 @@ Functions to read Profil data from HDF5 files
 @author: williamrigaut
 """
 import h5py
+import numpy as np
+from packages.readers.hdf5_io import open_hdf5
+from packages.readers.inspect_hdf5 import get_technique_groups, parse_position
 
 
 def get_thickness(hdf5_file, group_path, result_type):
@@ -13,7 +16,7 @@ def get_thickness(hdf5_file, group_path, result_type):
     profil_units = {}
 
     try:
-        with h5py.File(hdf5_file, "r") as h5f:
+        with open_hdf5(hdf5_file) as h5f:
             results = h5f[group_path].keys()
             for result in results:
                 if result == result_type:
@@ -25,3 +28,94 @@ def get_thickness(hdf5_file, group_path, result_type):
         return 1
 
     return profil_attrs, profil_units
+
+
+def get_profile(hdf5_file, group_path):
+    """
+    Reads the height profile measured by the profilometer from an HDF5 file.
+
+    Parameters
+    ----------
+    hdf5_file : str, pathlib.Path or file-like object
+        The path to the HDF5 file to read the data from.
+    group_path : str or pathlib.Path
+        The path within the HDF5 file to the group containing the profile data.
+
+    Returns
+    -------
+    tuple
+        A tuple containing two dictionaries:
+        - measurement : dict
+            A dictionary containing the profile with keys 'distance' and 'profile' (height along the scan).
+        - measurement_units : dict
+            A dictionary containing the units for the 'distance' and 'profile' datasets.
+    """
+    measurement = {}
+    measurement_units = {}
+    try:
+        with open_hdf5(hdf5_file) as h5f:
+            for key in ["distance", "profile"]:
+                measurement[key] = h5f[group_path][key][()]
+                measurement_units[key] = h5f[group_path][key].attrs["units"]
+    except KeyError:
+        print("Warning, group path not found in hdf5 file.")
+        return 1
+
+    return measurement, measurement_units
+
+
+def iter_profiles(hdf5_file, batch_size=64, exclude_wafer_edges=True):
+    """
+    Reads the height profiles of all the positions of a wafer by batches, the file is opened once.
+
+    Parameters
+    ----------
+    hdf5_file : str, pathlib.Path or file-like object
+        The path to the HDF5 file to read the data from.
+    batch_size : int, optional
+        The maximum number of profiles of a batch. Defaults to 64.
+    exclude_wafer_edges : bool, optional
+        If True, the positions at the edges of the wafer are skipped, as in get_measurement_data. Defaults to True.
+
+    Yields
+    ------
+    tuple
+        (positions, distance, profile, measured_height) with the list of (x, y) positions of the batch,
+        the (n_positions, n_points) arrays of the distances and heights, padded with NaN when the profiles
+        have different lengths, and the (n_positions,) heights saved in the results (NaN if missing).
+    """
+    with open_hdf5(hdf5_file) as h5f:
+        technique_groups = get_technique_groups(h5f)
+        if "PROFIL" not in technique_groups:
+            raise ValueError("Data type PROFIL not found in HDF5 file.")
+        group = h5f[technique_groups["PROFIL"]]
+
+        positions = []
+        for group_name in group.keys():
+            position = parse_position(group_name)
+            if position is None or "measurement/profile" not in group[group_name]:
+                continue
+            x, y = position
+            if abs(x) + abs(y) > 60 and exclude_wafer_edges:
+                continue
+            positions.append((position, group_name))
+        positions.sort()
+
+        for start in range(0, len(positions), batch_size):
+            batch = positions[start : start + batch_size]
+            nodes = [group[group_name] for _, group_name in batch]
+            profiles = [node["measurement/profile"][()] for node in nodes]
+            n_points = max(len(profile) for profile in profiles)
+
+            distance = np.full((len(batch), n_points), np.nan)
+            profile = np.full((len(batch), n_points), np.nan)
+            measured_height = np.full(len(batch), np.nan)
+            for i, node in enumerate(nodes):
+                profile[i, : len(profiles[i])] = profiles[i]
+                distance[i, : len(profiles[i])] = node["measurement/distance"][()]
+                if "results/measured_height" in node:
+                    measured_height[i] = node["results/measured_height"][()]
+
+            yield [
+                position for position, _ in batch
+            ], distance, profile, measured_height
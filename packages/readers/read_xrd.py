@@ -5,11 +5,13 @@ Functions to read XRD data from HDF5 files
 @author: williamrigaut
 """
 import h5py
+from packages.readers.hdf5_io import open_hdf5, read_dataset
+from packages.readers.pyramid import read_image_level
 
 
-def _get_attrs(name, obj):
+def _get_attrs(name, obj, attrs, units):
     """
-    Extracts attributes from an HDF5 dataset object and stores them in global variables.
+    Extracts attributes from an HDF5 dataset object and stores them in the given dictionaries.
 
     Parameters
     ----------
@@ -17,17 +19,18 @@ def _get_attrs(name, obj):
         Name of the HDF5 dataset, used as key for storing attributes.
     obj : h5py.Dataset
         HDF5 dataset object from which attributes are extracted.
+    attrs : dict
+        The dictionary receiving the data of the dataset.
+    units : dict
+        The dictionary receiving the units of the dataset.
 
     Notes
     -----
     If `obj` is an instance of `h5py.Dataset`, its data is stored in the `attrs`
     dictionary with `name` as the key. If the dataset has a "units" attribute,
-    it is also stored in the `units` dictionary.
+    it is also stored in the `units` dictionary. The dictionaries are local to each
+    call of get_xrd_results, so that files can be read from several threads.
     """
-
-    global attrs
-    global units
-
     if isinstance(obj, h5py.Dataset):
         dataset = obj[()]
         attrs[name] = dataset
@@ -41,7 +44,7 @@ def get_xrd_results(hdf5_file, group_path, result_type):
 
     Parameters
     ----------
-    hdf5_file : str or pathlib.Path
+    hdf5_file : str, pathlib.Path or file-like object
         The path to the HDF5 file containing the data to be extracted.
     group_path : str or pathlib.Path
         The path within the HDF5 file to the group where the data is located.
@@ -59,28 +62,25 @@ def get_xrd_results(hdf5_file, group_path, result_type):
     -----
     If the result is not found, the function returns 1.
     """
-    global attrs
-    global units
-    attrs = {}
-    units = {}
-
     # Nested dictionary for XRD results and units
     parent_attrs = {}
     xrd_units = {}
 
     try:
-        with h5py.File(hdf5_file, "r") as h5f:
+        with open_hdf5(hdf5_file) as h5f:
             result_types = h5f[group_path].keys()
             for result in result_types:
                 if result_type.lower() in result:
                     result_group = h5f[f"{group_path}/{result}"]
                     for elm in result_group:
-                        result_group[elm].visititems(_get_attrs)
+                        attrs = {}
+                        units = {}
+                        result_group[elm].visititems(
+                            lambda name, obj: _get_attrs(name, obj, attrs, units)
+                        )
                         # Retrieve all the elements of the group and put them in the parent dictionary
                         parent_attrs[elm] = attrs
                         xrd_units[elm] = units
-                        attrs = {}
-                        units = {}
 
     except KeyError:
         print("Warning, group path not found in hdf5 file.")
@@ -89,16 +89,19 @@ def get_xrd_results(hdf5_file, group_path, result_type):
     return parent_attrs, xrd_units
 
 
-def get_xrd_pattern(hdf5_file, group_path):
+def get_xrd_pattern(hdf5_file, group_path, mmap=False):
     """
     Reads the XRD pattern data from an HDF5 file.
 
     Parameters
     ----------
-    hdf5_file : str or pathlib.Path
+    hdf5_file : str, pathlib.Path or file-like object
         The path to the HDF5 file containing the data to be extracted.
     group_path : str or pathlib.Path
         The path within the HDF5 file to the group containing the XRD pattern data.
+    mmap : bool, optional
+        If True, the intensity and angle are returned as read-only memory maps when they are stored
+        contiguously in the file (see hdf5_io.read_dataset). Defaults to False.
 
     Returns
     -------
@@ -115,14 +118,16 @@ def get_xrd_pattern(hdf5_file, group_path):
     measurement = {}
     measurement_units = {}
     try:
-        with h5py.File(hdf5_file, "r") as h5f:
+        with open_hdf5(hdf5_file) as h5f:
             # Getting counts and angle datasets (with corresponding units)
             node = h5f[group_path]
             for key in node.keys():
                 if isinstance(node[key], h5py.Group):
                     if key == "CdTe_integrate":
-                        measurement["intensity"] = node[key]["intensity"][()][:2986]
-                        measurement["angle"] = node[key]["q"][()][:2986]
+                        measurement["intensity"] = read_dataset(
+                            node[key]["intensity"], mmap
+                        )[:2986]
+                        measurement["angle"] = read_dataset(node[key]["q"], mmap)[:2986]
                         measurement_units["intensity"] = "a.u."
                         measurement_units["angle"] = "tth (°)"
 
@@ -133,12 +138,40 @@ def get_xrd_pattern(hdf5_file, group_path):
     return measurement, measurement_units
 
 
-def get_xrd_image(hdf5_file, group_path):
+def get_xrd_image(hdf5_file, group_path, mmap=False, level=0):
+    """
+    Reads the 2D camera image from an HDF5 file.
+
+    Parameters
+    ----------
+    hdf5_file : str, pathlib.Path or file-like object
+        The path to the HDF5 file containing the data to be extracted.
+    group_path : str or pathlib.Path
+        The path within the HDF5 file to the group containing the XRD image.
+    mmap : bool, optional
+        If True, the image is returned as a read-only memory map when it is stored contiguously in the file,
+        slicing a region of the image then only reads this region (see hdf5_io.read_dataset). Defaults to False.
+    level : int, optional
+        The level of the image pyramid to read, the image is binned by 2**level (see pyramid.create_pyramid_dataset).
+        If the level is not stored in the file, it is computed from the full resolution image. Defaults to 0.
+
+    Returns
+    -------
+    image : dict
+        A dictionary containing the image with the key '2D_Camera_Image'.
+
+    Notes
+    -----
+    The image is read from the '2D_Camera_Image' dataset, or from the 'CdTe' dataset of the measurement
+    and simplified files. If the group path is not found in the HDF5 file, the function returns 1.
+    """
     image = {}
 
     try:
-        with h5py.File(hdf5_file, "r") as h5f:
-            image["2D_Camera_Image"] = h5f[group_path]["2D_Camera_Image"][()]
+        with open_hdf5(hdf5_file) as h5f:
+            node = h5f[group_path]
+            name = "2D_Camera_Image" if "2D_Camera_Image" in node else "CdTe"
+            image["2D_Camera_Image"] = read_image_level(node, name, level, mmap)
 
     except KeyError:
         print("Warning, group path not found in hdf5 file.")
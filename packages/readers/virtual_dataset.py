@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+Functions to write a companion HDF5 file of virtual datasets, viewing the
+measurements scattered in the position groups of a wafer file as dense
+(y, x, ...) arrays without copying the data.
+
+@author: williamrigaut
+"""
+import os
+import pathlib
+import h5py
+import numpy as np
+from packages.readers.hdf5_io import open_hdf5
+from packages.readers.inspect_hdf5 import get_technique_groups, parse_position
+from packages.readers.lazy_import import lazy_import
+
+xr = lazy_import("xarray")
+
+# Datasets of each technique mapped into virtual arrays, as
+# (path in the position group, name in the virtual file, names of the measurement dimensions)
+VIRTUAL_DATASETS = {
+    "EDX": [
+        ("measurement/counts", "counts", ["channel"]),
+        ("measurement/energy", "energy", ["channel"]),
+    ],
+    "XRD": [
+        ("measurement/CdTe_integrate/intensity", "CdTe_integrate_intensity", ["q"]),
+        ("measurement/CdTe_integrate/q", "CdTe_integrate_q", ["q"]),
+        ("measurement/CdTe", "CdTe", ["pixel y", "pixel x"]),
+    ],
+}
+
+
+def _get_fill_value(dtype):
+    """
+    Returns the value of the positions without data: NaN for floating point datasets, 0 otherwise.
+    """
+    if np.issubdtype(dtype, np.floating):
+        return np.nan
+    return 0
+
+
+def create_virtual_dataset(hdf5_file, hdf5_save_file):
+    """
+    Writes a companion HDF5 file mapping the spectra, patterns and images of every position of a wafer file
+    into dense virtual datasets, no measurement data is copied.
+
+    Parameters
+    ----------
+    hdf5_file : str or pathlib.Path
+        The path to the HDF5 file of the wafer.
+    hdf5_save_file : str or pathlib.Path
+        The path to the virtual dataset file.
+
+    Notes
+    -----
+    Each technique is saved in a group ('EDX' and 'XRD') containing the 'x' and 'y' coordinates and one virtual
+    dataset per measurement, with the shape (y, x, n) for spectra and (y, x, pixel y, pixel x) for images.
+    The positions without data (or with a measurement of a different shape) read as NaN for floating point
+    datasets and 0 for integer datasets (such as the XRD images), the boolean (y, x) dataset 'mapped/<name>'
+    is True at the positions mapped to the source file.
+    Leading dimensions of length 1, such as the first dimension of the XRD intensity, are dropped, the
+    measurements with other leading dimensions are not mapped.
+
+    The source file is referenced with a path relative to the virtual file, both files can be moved together.
+    """
+    hdf5_save_file = pathlib.Path(hdf5_save_file)
+    source_path = os.path.relpath(
+        pathlib.Path(hdf5_file).resolve(), hdf5_save_file.resolve().parent
+    )
+
+    with open_hdf5(hdf5_file) as h5f, h5py.File(hdf5_save_file, "w") as h5f_save:
+        h5f_save.attrs["HT_type"] = "virtual"
+        h5f_save.attrs["source"] = source_path
+        technique_groups = get_technique_groups(h5f)
+
+        for datatype, datasets in VIRTUAL_DATASETS.items():
+            if datatype not in technique_groups:
+                continue
+            group = h5f[technique_groups[datatype]]
+
+            positions = {}
+            for group_name in group.keys():
+                position = parse_position(group_name)
+                if position is not None:
+                    positions[position] = group_name
+            x_vals = sorted(set(x for x, _ in positions))
+            y_vals = sorted(set(y for _, y in positions))
+            x_index = {x: i for i, x in enumerate(x_vals)}
+            y_index = {y: j for j, y in enumerate(y_vals)}
+
+            node = h5f_save.create_group(datatype)
+            node.attrs["HT_type"] = datatype.lower()
+            node.create_dataset("x", data=np.array(x_vals))
+            node.create_dataset("y", data=np.array(y_vals))
+
+            for path, name, dims in datasets:
+                sources = {
+                    position: group[f"{group_name}/{path}"]
+                    for position, group_name in positions.items()
+                    if path in group[group_name]
+                }
+                if len(sources) == 0:
+                    continue
+
+                reference = next(iter(sources.values()))
+                shape = reference.shape
+                # Dropping the leading dimensions of length 1, e.g. (1, 3000) -> (3000,)
+                n_leading = len(shape) - len(dims)
+                if n_leading < 0 or shape[:n_leading] != (1,) * n_leading:
+                    print(
+                        f"Warning, the {datatype} {name} datasets have the shape {shape}, which can not be mapped to the dimensions {dims}."
+                    )
+                    continue
+                mapped = np.zeros((len(y_vals), len(x_vals)), dtype=bool)
+                layout = h5py.VirtualLayout(
+                    shape=(len(y_vals), len(x_vals)) + shape[n_leading:],
+                    dtype=reference.dtype,
+                )
+
+                skipped = 0
+                for (x, y), dataset in sources.items():
+                    if dataset.shape != shape:
+                        skipped += 1
+                        continue
+                    source = h5py.VirtualSource(
+                        source_path, dataset.name, shape=shape, dtype=dataset.dtype
+                    )
+                    layout[y_index[y], x_index[x]] = source[(0,) * n_leading]
+                    mapped[y_index[y], x_index[x]] = True
+                if skipped > 0:
+                    print(
+                        f"Warning, {skipped} {datatype} {name} datasets have a shape different from {shape} and are not mapped."
+                    )
+
+                node.create_virtual_dataset(
+                    name, layout, fillvalue=_get_fill_value(reference.dtype)
+                )
+                node[name].attrs["dims"] = ["y", "x"] + dims
+                if "units" in reference.attrs:
+                    node[name].attrs["units"] = reference.attrs["units"]
+                node[name].attrs["HT_type"] = datatype.lower()
+                node.create_dataset(f"mapped/{name}", data=mapped)
+
+    return None
+
+
+def get_virtual_cube(hdf5_file, data_type, name, x_pos=None, y_pos=None):
+    """
+    Reads a virtual dataset written by create_virtual_dataset, with a single hyperslab read.
+
+    Parameters
+    ----------
+    hdf5_file : str or pathlib.Path
+        The path to the virtual dataset file.
+    data_type : str
+        The type of data, either 'EDX' or 'XRD'.
+    name : str
+        The name of the virtual dataset, for example 'counts', 'CdTe_integrate_intensity' or 'CdTe'.
+    x_pos : float or slice, optional
+        The x position or the range of x positions (in the units of the positions) to read. If None, all the positions are read.
+    y_pos : float or slice, optional
+        The y position or the range of y positions to read. If None, all the positions are read.
+
+    Returns
+    -------
+    xarray.DataArray
+        The data with the dimensions 'y', 'x' and the dimensions of the measurement, and the coordinate 'mapped'
+        which is False at the positions without data.
+
+    Examples
+    --------
+    >>> images = get_virtual_cube("wafer_virtual.hdf5", "XRD", "CdTe", x_pos=slice(-10, 10))
+    """
+    with h5py.File(hdf5_file, "r") as h5f:
+        node = h5f[data_type.upper()]
+        dataset = node[name]
+        x_vals = node["x"][()]
+        y_vals = node["y"][()]
+        dims = [str(dim) for dim in dataset.attrs["dims"]]
+
+        selection = []
+        coords = []
+        for values, position in [(y_vals, y_pos), (x_vals, x_pos)]:
+            if position is None:
+                index = slice(None)
+            elif isinstance(position, slice):
+                start, stop = position.start, position.stop
+                kept = np.nonzero(
+                    (values >= (values[0] if start is None else start))
+                    & (values <= (values[-1] if stop is None else stop))
+                )[0]
+                index = slice(kept[0], kept[-1] + 1) if len(kept) > 0 else slice(0, 0)
+            else:
+                index = int(np.argmin(np.abs(values - position)))
+            selection.append(index)
+            coords.append(values[index])
+
+        data = dataset[tuple(selection)]
+        mapped = (
+            node[f"mapped/{name}"][tuple(selection)]
+            if f"mapped/{name}" in node
+            else None
+        )
+        attrs = {key: dataset.attrs[key] for key in dataset.attrs if key != "dims"}
+
+    # Dimensions of the positions selected with a single value are dropped
+    kept_dims = [
+        dim for dim, index in zip(dims[:2], selection) if isinstance(index, slice)
+    ]
+    coords = {dim: values for dim, values in zip(dims[:2], coords) if dim in kept_dims}
+    if mapped is not None:
+        coords["mapped"] = (kept_dims, mapped)
+
+    return xr.DataArray(data, coords=coords, dims=kept_dims + dims[2:], attrs=attrs)
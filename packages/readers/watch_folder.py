@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+Service watching a folder for new or modified HDF5 files and converting
+them in the background.
+
+Usage:
+    python -m packages.readers.watch_folder <folder> [--workers 2] [--interval 10]
+
+@author: williamrigaut
+"""
+import argparse
+import datetime
+import json
+import os
+import pathlib
+import time
+from concurrent.futures import ProcessPoolExecutor
+from packages.readers.convert import convert_wafer, is_converted_file
+
+MANIFEST_NAME = "conversion_manifest.json"
+
+
+def read_manifest(folder):
+    """
+    Reads the conversion manifest of a folder.
+
+    Parameters
+    ----------
+    folder : str or pathlib.Path
+        The watched folder.
+
+    Returns
+    -------
+    dict
+        A dictionary with one entry per source file name, containing the size and modification time
+        of the converted file, the conversion status and the outputs.
+    """
+    manifest_file = pathlib.Path(folder) / MANIFEST_NAME
+    if not manifest_file.exists():
+        return {}
+
+    with open(manifest_file, "r") as f:
+        return json.load(f)
+
+
+def write_manifest(folder, manifest):
+    """
+    Writes the conversion manifest of a folder. The file is replaced atomically so that a reader
+    never sees a partially written manifest.
+
+    Parameters
+    ----------
+    folder : str or pathlib.Path
+        The watched folder.
+    manifest : dict
+        The manifest to write, see read_manifest.
+    """
+    manifest_file = pathlib.Path(folder) / MANIFEST_NAME
+    tmp_file = manifest_file.with_suffix(".json.tmp")
+
+    with open(tmp_file, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_file, manifest_file)
+
+    return None
+
+
+def scan_folder(folder, pattern="*.hdf5"):
+    """
+    Lists the source HDF5 files of a folder with their size and modification time.
+
+    Parameters
+    ----------
+    folder : str or pathlib.Path
+        The watched folder.
+    pattern : str, optional
+        The glob pattern of the source files. Defaults to '*.hdf5'.
+
+    Returns
+    -------
+    dict
+        A dictionary with the file names as keys and (size, modification time) tuples as values.
+    """
+    files = {}
+
+    for hdf5_file in pathlib.Path(folder).glob(pattern):
+        if is_converted_file(hdf5_file):
+            continue
+        try:
+            stat = hdf5_file.stat()
+        except FileNotFoundError:
+            # The file was removed between the glob and the stat
+            continue
+        files[hdf5_file.name] = (stat.st_size, stat.st_mtime)
+
+    return files
+
+
+def watch_folder(folder, workers=2, interval=10.0, pattern="*.hdf5", once=False):
+    """
+    Watches a folder and converts every new or modified HDF5 file with convert_wafer, using a bounded pool of worker processes.
+    The outputs are written next to the sources and recorded in a manifest.
+
+    Parameters
+    ----------
+    folder : str or pathlib.Path
+        The folder to watch.
+    workers : int, optional
+        The maximum number of files converted at the same time. Defaults to 2.
+    interval : float, optional
+        The time between two scans of the folder in seconds. Defaults to 10.
+    pattern : str, optional
+        The glob pattern of the source files. Defaults to '*.hdf5'.
+    once : bool, optional
+        If True, the function returns once all the files present in the folder are converted. Defaults to False.
+
+    Notes
+    -----
+    The folder is polled. A file is converted only once its size and modification time did not change between two scans,
+    so that files still being written are not read.
+    """
+    folder = pathlib.Path(folder)
+    manifest = read_manifest(folder)
+    previous_scan = {}
+    running = {}
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while True:
+            current_scan = scan_folder(folder, pattern)
+
+            for name, (size, mtime) in sorted(current_scan.items()):
+                if name in running:
+                    continue
+                # Waiting for the file to be stable between two scans
+                if previous_scan.get(name, None) != (size, mtime) and not once:
+                    continue
+                record = manifest.get(name, {})
+                if record.get("size") == size and record.get("mtime") == mtime:
+                    continue
+                # Bounded queue: the other files are submitted at the next scan
+                if len(running) >= workers:
+                    break
+
+                print("Converting", name)
+                future = executor.submit(convert_wafer, folder / name)
+                running[name] = (future, size, mtime)
+
+            # Recording the finished conversions
+            for name, (future, size, mtime) in list(running.items()):
+                if not future.done():
+                    continue
+                del running[name]
+
+                record = {
+                    "size": size,
+                    "mtime": mtime,
+                    "converted": datetime.datetime.now().isoformat(),
+                }
+                try:
+                    record["outputs"] = future.result()
+                    record["status"] = "done"
+                except Exception as error:
+                    print(f"Warning, conversion of {name} failed: {error}")
+                    record["outputs"] = {}
+                    record["status"] = "failed"
+                    record["error"] = repr(error)
+                manifest[name] = record
+                write_manifest(folder, manifest)
+
+            previous_scan = current_scan
+
+            if once and len(running) == 0:
+                pending = [
+                    name
+                    for name, (size, mtime) in current_scan.items()
+                    if manifest.get(name, {}).get("size") != size
+                    or manifest.get(name, {}).get("mtime") != mtime
+                ]
+                if len(pending) == 0:
+                    break
+
+            time.sleep(interval if not once else min(interval, 1.0))
+
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Watch a folder and convert new HDF5 wafer files."
+    )
+    parser.add_argument("folder", help="Folder to watch.")
+    parser.add_argument(
+        "--workers", type=int, default=2, help="Number of parallel conversions."
+    )
+    parser.add_argument(
+        "--interval", type=float, default=10.0, help="Polling interval in seconds."
+    )
+    parser.add_argument(
+        "--pattern", default="*.hdf5", help="Glob pattern of the source files."
+    )
+    parser.add_argument(
+        "--once",
+        action="store_true",
+        help="Convert the files already present and exit.",
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        watch_folder(
+            args.folder,
+            workers=args.workers,
+            interval=args.interval,
+            pattern=args.pattern,
+            once=args.once,
+        )
+    except KeyboardInterrupt:
+        print("Stopped watching", args.folder)
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
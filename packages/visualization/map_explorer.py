@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+Interactive explorer of a wafer map for Jupyter notebooks: clicking on a
+position of the heatmap loads and plots the measurement of this position only.
+
+@author: williamrigaut
+"""
+import numpy as np
+import plotly.graph_objects as go
+import ipywidgets
+from concurrent.futures import ThreadPoolExecutor
+from packages.readers.read_hdf5 import (
+    get_full_dataset,
+    search_measurement_data_from_type,
+)
+
+# Keys of the measurement plotted on the x and y axes for each data type
+MEASUREMENT_AXES = {
+    "edx": ("energy", "counts"),
+    "moke": ("applied field", "magnetization"),
+    "xrd": ("angle", "intensity"),
+}
+
+
+class MapExplorer:
+    """
+    Heatmap of a result of get_full_dataset, linked to the measurement of the clicked position.
+
+    Parameters
+    ----------
+    hdf5_file : str or pathlib.Path
+        The path to the HDF5 file to read the data from.
+    variable : str, optional
+        The result displayed on the heatmap. Defaults to 'coercivity_m0'.
+    data_type : str, optional
+        The measurement loaded on click, either 'EDX', 'MOKE' or 'XRD'. Defaults to 'XRD'.
+    data : xarray.Dataset, optional
+        The dataset returned by get_full_dataset, if it is already loaded. If None, it is read from the file.
+    prefetch_radius : int, optional
+        The neighbours of the clicked position within this number of grid steps are loaded in the background,
+        0 disables the prefetch. Defaults to 1.
+
+    Examples
+    --------
+    >>> explorer = MapExplorer(HDF5_path, variable="Nd Composition", data_type="XRD")
+    >>> explorer.show()
+    """
+
+    def __init__(
+        self,
+        hdf5_file,
+        variable="coercivity_m0",
+        data_type="XRD",
+        data=None,
+        prefetch_radius=1,
+    ):
+        if data_type.lower() not in MEASUREMENT_AXES:
+            raise ValueError("data_type must be one of 'EDX', 'MOKE' or 'XRD'.")
+
+        self.hdf5_file = hdf5_file
+        self.data_type = data_type
+        self.prefetch_radius = prefetch_radius
+        self.data = get_full_dataset(hdf5_file) if data is None else data
+        self.variable = variable
+        # A single background thread, h5py does not read in parallel anyway
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+        values = self.data[variable]
+        self.map_figure = go.FigureWidget(
+            go.Heatmap(
+                z=values.values,
+                x=values["x"].values,
+                y=values["y"].values,
+                colorscale="rainbow",
+                colorbar={"title": values.attrs.get("units", "")},
+            )
+        )
+        self.map_figure.update_layout(
+            title=variable,
+            xaxis_title="Position X (mm)",
+            yaxis_title="Position Y (mm)",
+            width=500,
+            height=450,
+        )
+        self.map_figure.data[0].on_click(self._on_click)
+
+        self.measurement_figure = go.FigureWidget()
+        self.measurement_figure.update_layout(width=600, height=450)
+        self.waterfall_figure = go.FigureWidget()
+        self.waterfall_figure.update_layout(width=1100, height=450)
+
+    def show(self):
+        """
+        Returns the widget containing the heatmap, the measurement and the waterfall plots.
+        """
+        return ipywidgets.VBox(
+            [
+                ipywidgets.HBox([self.map_figure, self.measurement_figure]),
+                self.waterfall_figure,
+            ]
+        )
+
+    def load_position(self, x_pos, y_pos):
+        """
+        Reads the measurement of a position (from the cache of the readers if it was already read).
+
+        Returns
+        -------
+        tuple or None
+            The measurement data and units, or None if nothing was measured at this position.
+        """
+        try:
+            result = search_measurement_data_from_type(
+                self.hdf5_file, self.data_type, x_pos, y_pos
+            )
+        except KeyError:
+            return None
+
+        # The readers return 1 when the position is missing, and no data when it was not integrated
+        if result == 1 or len(result[0]) == 0:
+            return None
+
+        return result
+
+    def _get_curve(self, measurement):
+        """
+        Returns the x and y values of a measurement to plot.
+        """
+        x_key, y_key = MEASUREMENT_AXES[self.data_type.lower()]
+        if x_key not in measurement or y_key not in measurement:
+            return np.array([]), np.array([])
+        x_values = np.asarray(measurement[x_key])
+        y_values = np.asarray(measurement[y_key])
+        # Intensity is stored with an extra first dimension
+        if y_values.ndim > 1:
+            y_values = y_values[0] if len(y_values) > 0 else np.array([])
+
+        return x_values[: len(y_values)], y_values[: len(x_values)]
+
+    def show_position(self, x_pos, y_pos):
+        """
+        Plots the measurement of a position and prefetches the neighbouring positions.
+        """
+        result = self.load_position(x_pos, y_pos)
+        x_key, y_key = MEASUREMENT_AXES[self.data_type.lower()]
+
+        with self.measurement_figure.batch_update():
+            self.measurement_figure.data = []
+            if result is None:
+                self.measurement_figure.update_layout(
+                    title=f"No {self.data_type} measurement at x={x_pos}, y={y_pos}"
+                )
+            else:
+                measurement, units = result
+                x_values, y_values = self._get_curve(measurement)
+                self.measurement_figure.add_scatter(
+                    x=x_values, y=y_values, mode="lines"
+                )
+                self.measurement_figure.update_layout(
+                    title=f"{self.data_type} at x={x_pos}, y={y_pos}",
+                    xaxis_title=f"{x_key} ({units.get(x_key, '')})",
+                    yaxis_title=f"{y_key} ({units.get(y_key, '')})",
+                )
+
+        self.prefetch(x_pos, y_pos)
+
+        return None
+
+    def show_line(self, x_pos=None, y_pos=None):
+        """
+        Plots the measurements of a line of positions as a waterfall, at fixed x or at fixed y.
+        """
+        if (x_pos is None) == (y_pos is None):
+            raise ValueError("Either x_pos or y_pos must be given.")
+
+        if x_pos is not None:
+            line = [(x_pos, y) for y in self.data["y"].values]
+            positions = self.data["y"].values
+            label = f"x={x_pos}"
+        else:
+            line = [(x, y_pos) for x in self.data["x"].values]
+            positions = self.data["x"].values
+            label = f"y={y_pos}"
+
+        x_axis = None
+        rows = []
+        row_positions = []
+        for (x, y), position in zip(line, positions):
+            result = self.load_position(x, y)
+            if result is None:
+                continue
+            x_values, y_values = self._get_curve(result[0])
+            if len(y_values) == 0:
+                continue
+            if x_axis is None:
+                x_axis = x_values
+            rows.append(y_values[: len(x_axis)])
+            row_positions.append(position)
+
+        with self.waterfall_figure.batch_update():
+            self.waterfall_figure.data = []
+            if len(rows) > 0:
+                # Measurements shorter than the first one are padded with NaN
+                waterfall = np.full((len(rows), len(x_axis)), np.nan)
+                for i, row in enumerate(rows):
+                    waterfall[i, : len(row)] = row
+                self.waterfall_figure.add_heatmap(
+                    z=waterfall, x=x_axis, y=row_positions, colorscale="plasma"
+                )
+            self.waterfall_figure.update_layout(
+                title=f"{self.data_type} waterfall at {label}"
+            )
+
+        return None
+
+    def prefetch(self, x_pos, y_pos):
+        """
+        Loads the positions around a position in the background, so that they are in the cache when clicked.
+        """
+        if self.prefetch_radius <= 0:
+            return None
+
+        x_vals = list(self.data["x"].values)
+        y_vals = list(self.data["y"].values)
+        if x_pos not in x_vals or y_pos not in y_vals:
+            return None
+
+        i, j = x_vals.index(x_pos), y_vals.index(y_pos)
+        radius = self.prefetch_radius
+        for x in x_vals[max(i - radius, 0) : i + radius + 1]:
+            for y in y_vals[max(j - radius, 0) : j + radius + 1]:
+                if (x, y) != (x_pos, y_pos):
+                    self._executor.submit(self.load_position, x, y)
+
+        return None
+
+    def _on_click(self, trace, points, selector):
+        """
+        Callback of the heatmap: plots the clicked position and the waterfall of its column.
+        """
+        if len(points.xs) == 0:
+            return None
+
+        x_pos, y_pos = float(points.xs[0]), float(points.ys[0])
+        self.show_position(x_pos, y_pos)
+        self.show_line(x_pos=x_pos)
+
+        return None
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Small synthetic wafer files shared by the tests.
+
+@author: williamrigaut
+"""
+import h5py
+import numpy as np
+import pytest
+
+
+def _add_instrument(group, x, y):
+    instrument = group.create_group("instrument")
+    instrument["x_pos"] = x
+    instrument["x_pos"].attrs["units"] = "mm"
+    instrument["y_pos"] = y
+    instrument["y_pos"].attrs["units"] = "mm"
+
+
+def make_wafer_file(path, seed=0):
+    """
+    Writes a wafer with EDX, MOKE and XRD results on a 5 x 5 grid of positions (5 mm steps), with the EDX spectra
+    and the XRD patterns and images.
+    """
+    rng = np.random.default_rng(seed)
+    positions = [
+        (float(x), float(y)) for x in range(-10, 15, 5) for y in range(-10, 15, 5)
+    ]
+
+    with h5py.File(path, "w") as h5f:
+        h5f.create_group("sample")
+        edx = h5f.create_group("W_EDX")
+        edx.attrs["HT_type"] = "edx"
+        moke = h5f.create_group("W_MOKE")
+        moke.attrs["HT_type"] = "moke"
+        xrd = h5f.create_group("W_ESRF")
+        xrd.attrs["HT_type"] = "xrd"
+
+        for x, y in positions:
+            name = f"({x},{y})"
+
+            group = edx.create_group(name)
+            _add_instrument(group, x, y)
+            results = group.create_group("results")
+            for element in ["Nd", "Fe", "B"]:
+                element_group = results.create_group(f"Element {element}")
+                element_group["AtomPercent"] = rng.random() * 100
+                element_group["AtomPercent"].attrs["units"] = "at.%"
+            measurement = group.create_group("measurement")
+            measurement["counts"] = rng.integers(0, 100, 256).astype(np.float64)
+            measurement["counts"].attrs["units"] = "counts"
+            measurement["energy"] = np.linspace(0, 20, 256)
+            measurement["energy"].attrs["units"] = "keV"
+
+            group = moke.create_group(name)
+            _add_instrument(group, x, y)
+            results = group.create_group("results")
+            for key in ["coercivity_m0", "intercept_field"]:
+                results.create_group(key)["mean"] = rng.random()
+                results[key]["mean"].attrs["units"] = "T"
+
+            group = xrd.create_group(name)
+            _add_instrument(group, x, y)
+            phase = group.create_group("results").create_group("phases/Nd2Fe14B")
+            phase["phase_fraction"] = f"{rng.random() * 100:.3f}+-0.5"
+            phase["phase_fraction"].attrs["units"] = "wt.%"
+            phase["A"] = f"{8.8 + rng.random() * 0.01:.5f}+-0.0001"
+            phase["A"].attrs["units"] = "A"
+            measurement = group.create_group("measurement")
+            measurement["CdTe_integrate/intensity"] = rng.random((1, 50))
+            measurement["CdTe_integrate/q"] = np.linspace(1, 5, 50)[None, :]
+            measurement["CdTe"] = rng.integers(1, 100, (4, 3)).astype(np.int32)
+
+    return path
+
+
+@pytest.fixture
+def wafer_file(tmp_path):
+    """
+    Path to a synthetic wafer file, see make_wafer_file.
+    """
+    return make_wafer_file(tmp_path / "wafer.hdf5")
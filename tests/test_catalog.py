@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the SQLite catalog of a library of wafers.
+
+@author: williamrigaut
+"""
+import h5py
+import pandas as pd
+import pytest
+from packages.readers.catalog import (
+    get_dataset_locations,
+    query_catalog,
+    update_catalog,
+)
+from packages.readers.read_hdf5 import get_full_dataset
+from tests.conftest import make_wafer_file
+
+
+def test_query_catalog(tmp_path):
+    hdf5_files = [
+        make_wafer_file(tmp_path / f"wafer_{i}.hdf5", seed=i) for i in range(2)
+    ]
+    # A position without XRD results
+    with h5py.File(hdf5_files[1], "a") as h5f:
+        del h5f["W_ESRF/(0.0,5.0)/results/phases/Nd2Fe14B/A"]
+    catalog_file = tmp_path / "library.sqlite"
+
+    assert len(update_catalog(catalog_file, hdf5_files)) == 2
+    assert update_catalog(catalog_file, hdf5_files) == []
+
+    conditions = [("Nd Composition", ">", 30), ("coercivity_m0", "<=", 0.6)]
+    variables = ["Nd2Fe14B Lattice Parameter A", "Fe Composition"]
+    table = query_catalog(catalog_file, conditions, variables)
+
+    expected = []
+    for hdf5_file in hdf5_files:
+        data = get_full_dataset(hdf5_file, exclude_wafer_edges=False)
+        frame = data.to_dataframe().reset_index()
+        frame = frame[(frame["Nd Composition"] > 30) & (frame["coercivity_m0"] <= 0.6)]
+        frame.insert(0, "file", str(hdf5_file.resolve()))
+        expected.append(frame)
+    expected = pd.concat(expected).sort_values(["file", "y", "x"])
+    expected = expected[
+        ["file", "x", "y", "Nd Composition", "coercivity_m0"] + variables
+    ].reset_index(drop=True)
+
+    assert len(table) > 0
+    pd.testing.assert_frame_equal(table, expected, check_dtype=False)
+
+    # The variables are left joined, positions without them are kept
+    table = query_catalog(
+        catalog_file,
+        [("Nd Composition", ">=", 0)],
+        ["Nd2Fe14B Lattice Parameter A"],
+    )
+    assert len(table) == 50
+    missing = (
+        (table["file"] == str(hdf5_files[1].resolve()))
+        & (table["x"] == 0.0)
+        & (table["y"] == 5.0)
+    )
+    assert table["Nd2Fe14B Lattice Parameter A"].isna().tolist() == missing.tolist()
+
+    with pytest.raises(ValueError):
+        query_catalog(catalog_file, [("Nd Composition", "LIKE", 30)])
+
+
+def test_dataset_locations(wafer_file, tmp_path):
+    catalog_file = tmp_path / "library.sqlite"
+    update_catalog(catalog_file, [wafer_file])
+
+    locations = get_dataset_locations(catalog_file, wafer_file, "edx", 5, -10)
+
+    assert locations["measurement/counts"]["path"].endswith(
+        "(5.0,-10.0)/measurement/counts"
+    )
+    assert locations["measurement/counts"]["dtype"] == "float64"
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the index of the positions in composition space.
+
+@author: williamrigaut
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from packages.analysis.composition_index import (
+    aggregate_by_composition,
+    build_composition_index,
+    query_composition,
+)
+from tests.conftest import make_wafer_file
+
+
+@pytest.fixture
+def index(tmp_path):
+    hdf5_files = [
+        str(make_wafer_file(tmp_path / f"wafer_{i}.hdf5", seed=i)) for i in range(2)
+    ]
+    return build_composition_index(hdf5_files, elements=["Nd", "Fe", "B"])
+
+
+def test_query_composition_with_and_without_tree(index):
+    pytest.importorskip("scipy")
+    assert index["tree"] is not None
+    index_without_tree = dict(index, tree=None)
+
+    for row in [0, 17, 33]:
+        composition = dict(zip(index["elements"], index["compositions"][row] + 2.0))
+        table = query_composition(index, composition, tolerance=10.0)
+        pd.testing.assert_frame_equal(
+            table, query_composition(index_without_tree, composition, tolerance=10.0)
+        )
+
+        # Same rows as a search through all the positions
+        distance = np.abs(index["compositions"] - index["compositions"][row] - 2.0)
+        expected = np.flatnonzero(distance.max(axis=-1) <= 10.0)
+        assert sorted(zip(table["wafer"], table["x"], table["y"])) == sorted(
+            zip(index["wafer"][expected], index["x"][expected], index["y"][expected])
+        )
+        assert table["distance"].is_monotonic_increasing
+        assert (table["distance"] <= 10.0).all()
+
+
+def test_aggregate_by_composition(index):
+    table = aggregate_by_composition(index, ["coercivity_m0"], bin_width=20.0)
+
+    assert table["count"].sum() == 50
+    assert table["coercivity_m0 count"].sum() == 50
+    np.testing.assert_allclose(
+        (table["coercivity_m0 mean"] * table["count"]).sum(),
+        np.nansum(index["values"][:, index["properties"].index("coercivity_m0")]),
+    )
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the parallel conversion command line.
+
+@author: williamrigaut
+"""
+from packages.readers import convert
+from packages.readers.__main__ import main, read_checkpoint
+
+
+def test_convert_resumes_from_checkpoint(wafer_file, tmp_path, capsys):
+    checkpoint_file = tmp_path / "checkpoint.jsonl"
+    argv = [
+        str(tmp_path / "*.hdf5"),
+        "--outputs",
+        "results",
+        "--workers",
+        "1",
+        "--checkpoint",
+        str(checkpoint_file),
+    ]
+
+    assert main(argv) == 0
+    assert "1 files to convert" in capsys.readouterr().out
+    output_file = convert.get_output_path(wafer_file, "results")
+    assert output_file.exists()
+    stat = wafer_file.stat()
+    assert read_checkpoint(checkpoint_file) == {
+        (str(wafer_file.resolve()), "results"): (stat.st_size, stat.st_mtime)
+    }
+    mtime = output_file.stat().st_mtime_ns
+
+    # The converted files are not converted again
+    assert main(argv) == 0
+    assert "0 files to convert" in capsys.readouterr().out
+    assert output_file.stat().st_mtime_ns == mtime
+
+    # A modified file is converted again
+    with open(wafer_file, "ab") as f:
+        f.write(b"\0")
+    assert main(argv) == 0
+    assert "1 files to convert" in capsys.readouterr().out
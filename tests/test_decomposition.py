@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the incremental decompositions of the measurements.
+
+@author: williamrigaut
+"""
+import h5py
+import numpy as np
+import pytest
+from packages.analysis.decomposition import (
+    incremental_pca,
+    iter_measurement_batches,
+    online_nmf,
+)
+
+
+@pytest.fixture
+def low_rank_wafer(wafer_file):
+    """
+    Synthetic wafer whose EDX spectra are mixtures of three non-negative spectra.
+    """
+    rng = np.random.default_rng(0)
+    spectra = rng.random((3, 256))
+    with h5py.File(wafer_file, "a") as h5f:
+        for group in h5f["W_EDX"].values():
+            group["measurement/counts"][...] = rng.random(3) @ spectra
+
+    return wafer_file
+
+
+def test_incremental_pca_matches_svd(low_rank_wafer):
+    _, positions, matrix, _, _ = next(
+        iter_measurement_batches([low_rank_wafer], "EDX", batch_size=100)
+    )
+    centered = matrix - matrix.mean(axis=0)
+    _, s, vt = np.linalg.svd(centered, full_matrices=False)
+
+    pca = incremental_pca(low_rank_wafer, "EDX", n_components=3, batch_size=4)
+
+    np.testing.assert_allclose(pca["mean"].values, matrix.mean(axis=0))
+    np.testing.assert_allclose(
+        pca["explained_variance"].values, s[:3] ** 2 / (len(matrix) - 1)
+    )
+    np.testing.assert_allclose(pca["explained_variance_ratio"].sum(), 1.0)
+    for k in range(3):
+        component = pca["components"].values[k]
+        sign = np.sign(component @ vt[k])
+        np.testing.assert_allclose(sign * component, vt[k], atol=1e-8)
+
+    x, y = positions[7]
+    np.testing.assert_allclose(
+        pca["loadings"].sel(x=x, y=y).values,
+        (matrix[7] - matrix.mean(axis=0)) @ pca["components"].values.T,
+    )
+
+
+def test_online_nmf(low_rank_wafer):
+    nmf = online_nmf(low_rank_wafer, "EDX", n_components=3, batch_size=8, n_epochs=5)
+
+    assert (nmf["components"].values >= 0).all()
+    assert (nmf["loadings"].values >= 0).all()
+    np.testing.assert_allclose(np.linalg.norm(nmf["components"], axis=1), 1.0)
+    assert nmf.attrs["reconstruction_error"] < 0.05
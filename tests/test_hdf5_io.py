@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the readers on fsspec URLs and file-like objects.
+
+@author: williamrigaut
+"""
+import io
+import uuid
+import numpy as np
+import pytest
+import xarray as xr
+from packages.readers import hdf5_io
+from packages.readers.read_cache import clear_measurement_cache, get_file_fingerprint
+from packages.readers.read_hdf5 import (
+    get_full_dataset,
+    search_measurement_data_from_type,
+)
+from tests.conftest import make_wafer_file
+
+
+@pytest.fixture
+def wafer_url(wafer_file):
+    """
+    URL of a copy of the synthetic wafer in the fsspec memory filesystem.
+    """
+    fsspec = pytest.importorskip("fsspec")
+    path = f"/{uuid.uuid4().hex}/wafer.hdf5"
+    filesystem = fsspec.filesystem("memory")
+    filesystem.pipe(path, wafer_file.read_bytes())
+    yield f"memory://{path}"
+
+    hdf5_io.close_remote_files()
+    filesystem.rm(path)
+
+
+def test_open_hdf5_url(wafer_url):
+    with hdf5_io.open_hdf5(wafer_url) as h5f:
+        assert sorted(h5f.keys()) == ["W_EDX", "W_ESRF", "W_MOKE", "sample"]
+
+    with pytest.raises(ValueError):
+        with hdf5_io.open_hdf5(wafer_url, mode="a"):
+            pass
+
+
+def test_open_hdf5_file_object(wafer_file):
+    with open(wafer_file, "rb") as file_object:
+        with hdf5_io.open_hdf5(file_object) as h5f:
+            assert "W_EDX" in h5f
+
+    with hdf5_io.open_hdf5(io.BytesIO(wafer_file.read_bytes())) as h5f:
+        assert "W_EDX" in h5f
+
+
+def test_get_full_dataset_url_and_file_object(wafer_file, wafer_url):
+    expected = get_full_dataset(wafer_file)
+
+    xr.testing.assert_identical(get_full_dataset(wafer_url), expected)
+    with open(wafer_file, "rb") as file_object:
+        xr.testing.assert_identical(get_full_dataset(file_object), expected)
+
+
+def test_search_measurement_url(wafer_file, wafer_url):
+    clear_measurement_cache()
+    expected, expected_units = search_measurement_data_from_type(
+        wafer_file, "EDX", 5.0, -5.0, use_cache=False
+    )
+
+    for _ in range(2):
+        measurement, units = search_measurement_data_from_type(
+            wafer_url, "EDX", 5.0, -5.0
+        )
+        assert units == expected_units
+        for key in expected:
+            np.testing.assert_array_equal(measurement[key], expected[key])
+
+
+def test_remote_fingerprint_changes_with_the_file(wafer_file, wafer_url):
+    fsspec = pytest.importorskip("fsspec")
+    fingerprint = get_file_fingerprint(wafer_url)
+    assert fingerprint[0] == wafer_url
+    assert fingerprint[1] == wafer_file.stat().st_size
+
+    filesystem = fsspec.filesystem("memory")
+    filesystem.pipe(wafer_url[len("memory://") :], b"modified")
+    hdf5_io.close_remote_files()
+
+    assert get_file_fingerprint(wafer_url) != fingerprint
+    assert get_file_fingerprint(io.BytesIO(b"")) is None
+
+
+def test_open_hdf5_url_reopens_changed_file(wafer_url, tmp_path, monkeypatch):
+    fsspec = pytest.importorskip("fsspec")
+    monkeypatch.setattr(hdf5_io, "REMOTE_VERSION_MAX_AGE", 0)
+    first = get_full_dataset(wafer_url)
+
+    other_file = make_wafer_file(tmp_path / "other.hdf5", seed=1)
+    filesystem = fsspec.filesystem("memory")
+    filesystem.pipe(wafer_url[len("memory://") :], other_file.read_bytes())
+
+    data = get_full_dataset(wafer_url)
+    xr.testing.assert_identical(data, get_full_dataset(other_file))
+    assert not data.identical(first)
+
+
+def test_remote_version_is_reused(wafer_url, monkeypatch):
+    calls = []
+    get_remote_file_info = hdf5_io.get_remote_file_info
+
+    def counted_info(url):
+        calls.append(url)
+        return get_remote_file_info(url)
+
+    monkeypatch.setattr(hdf5_io, "get_remote_file_info", counted_info)
+    clear_measurement_cache()
+    for _ in range(3):
+        search_measurement_data_from_type(wafer_url, "EDX", 5.0, -5.0)
+    assert calls == [wafer_url]
+
+    hdf5_io.close_remote_files()
+    get_file_fingerprint(wafer_url)
+    assert calls == [wafer_url, wafer_url]
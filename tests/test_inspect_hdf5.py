@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the manifest of a wafer file and of the maps preallocated from it.
+
+@author: williamrigaut
+"""
+import h5py
+from packages.readers.inspect_hdf5 import inspect
+from packages.readers.read_hdf5 import get_full_dataset
+
+
+def test_inspect(wafer_file):
+    manifest = inspect(wafer_file)
+
+    assert sorted(manifest["techniques"]) == ["EDX", "MOKE", "XRD"]
+    edx = manifest["techniques"]["EDX"]
+    assert edx["n_positions"] == 25
+    assert edx["positions"][0] == (-10.0, -10.0)
+    assert edx["elements"] == ["B", "Fe", "Nd"]
+    assert edx["variables"]["results/Element Nd/AtomPercent"]["units"] == "at.%"
+    assert edx["variables"]["measurement/counts"]["shape"] == (256,)
+    assert manifest["techniques"]["XRD"]["phases"] == ["Nd2Fe14B"]
+
+
+def test_results_in_discovery_order(wafer_file):
+    # Results only found at (10.0,0.0) and (5.0,0.0): the position groups are visited in the
+    # order of their names, but the maps are in the order of the positions sorted by x then y
+    with h5py.File(wafer_file, "a") as h5f:
+        for name, phase, element in [
+            ("(10.0,0.0)", "Fe", "Co"),
+            ("(5.0,0.0)", "Cu", "Al"),
+        ]:
+            h5f[f"W_ESRF/{name}/results/phases/{phase}/A"] = "2.87+-0.001"
+            h5f[f"W_EDX/{name}/results/Element {element}/AtomPercent"] = 1.0
+
+    data = get_full_dataset(wafer_file)
+
+    assert list(data.data_vars) == [
+        "B Composition",
+        "Fe Composition",
+        "Nd Composition",
+        "Al Composition",
+        "Co Composition",
+        "coercivity_m0",
+        "intercept_field",
+        "Nd2Fe14B Phase Fraction",
+        "Nd2Fe14B Lattice Parameter A",
+        "Cu Lattice Parameter A",
+        "Fe Lattice Parameter A",
+    ]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the interactive map explorer.
+
+@author: williamrigaut
+"""
+import h5py
+import numpy as np
+import pytest
+
+pytest.importorskip("plotly")
+pytest.importorskip("ipywidgets")
+from packages.visualization.map_explorer import MapExplorer
+
+
+def test_show_line_with_ragged_measurements(wafer_file):
+    with h5py.File(wafer_file, "a") as h5f:
+        measurement = h5f["W_EDX/(0.0,5.0)/measurement"]
+        counts = measurement["counts"][:200]
+        del measurement["counts"]
+        measurement["counts"] = counts
+        measurement["counts"].attrs["units"] = "counts"
+        del h5f["W_EDX/(0.0,-5.0)/measurement"]
+
+    explorer = MapExplorer(
+        wafer_file, variable="Nd Composition", data_type="EDX", prefetch_radius=0
+    )
+    explorer.show_line(x_pos=0.0)
+
+    heatmap = explorer.waterfall_figure.data[0]
+    waterfall = np.array(heatmap.z, dtype=float)
+    assert list(heatmap.y) == [-10.0, 0.0, 5.0, 10.0]
+    assert waterfall.shape == (4, 256)
+    np.testing.assert_array_equal(waterfall[2, :200], counts)
+    assert np.isnan(waterfall[2, 200:]).all()
+    assert not np.isnan(waterfall[[0, 1, 3]]).any()
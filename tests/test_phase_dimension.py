@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the XRD results read along a phase dimension.
+
+@author: williamrigaut
+"""
+import h5py
+import numpy as np
+import xarray as xr
+from packages.readers.read_hdf5 import get_full_dataset, stack_phases
+
+
+def test_phase_dimension_equals_stack_phases(wafer_file):
+    # A second phase measured at a few positions only, with a B lattice parameter at one of them
+    with h5py.File(wafer_file, "a") as h5f:
+        for i, name in enumerate(["(0.0,0.0)", "(5.0,-10.0)", "(-10.0,10.0)"]):
+            phase = h5f[f"W_ESRF/{name}/results/phases"].create_group("Fe")
+            phase["phase_fraction"] = f"{10.0 + i}+-0.2"
+            phase["A"] = "2.87+-0.001"
+            phase["A"].attrs["units"] = "A"
+        h5f["W_ESRF/(0.0,0.0)/results/phases/Fe/B"] = "2.9+-0.003"
+
+    data = get_full_dataset(wafer_file, phase_dimension=True)
+    expected = stack_phases(get_full_dataset(wafer_file))
+
+    assert list(data["phase"].values) == ["Nd2Fe14B", "Fe"]
+    assert sorted(data.data_vars) == sorted(
+        list(expected.data_vars)
+        + [
+            "Phase Fraction Uncertainty",
+            "Lattice Parameter A Uncertainty",
+            "Lattice Parameter B Uncertainty",
+        ]
+    )
+    for name in expected.data_vars:
+        xr.testing.assert_identical(
+            data[name].transpose(*expected[name].dims), expected[name]
+        )
+
+    uncertainty = data["Phase Fraction Uncertainty"]
+    assert float(uncertainty.sel(phase="Fe", x=0.0, y=0.0)) == 0.2
+    assert float(uncertainty.sel(phase="Nd2Fe14B", x=5.0, y=5.0)) == 0.5
+    assert np.isnan(float(uncertainty.sel(phase="Fe", x=5.0, y=5.0)))
+    assert int(data["Lattice Parameter B"].notnull().sum()) == 1
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the asynchronous loading of wafer files.
+
+@author: williamrigaut
+"""
+import asyncio
+import os
+import threading
+import uuid
+import pytest
+import xarray as xr
+from concurrent.futures import ThreadPoolExecutor
+from packages.readers import hdf5_io
+from packages.readers.read_async import (
+    fetch_file,
+    gather_full_datasets,
+    load_full_dataset_async,
+)
+from packages.readers.read_hdf5 import get_full_dataset
+from tests.conftest import make_wafer_file
+
+
+def test_fetch_file_copies_once(wafer_file, tmp_path):
+    cache_dir = tmp_path / "cache"
+
+    local_file = fetch_file(wafer_file, cache_dir)
+    mtime = os.stat(local_file).st_mtime_ns
+
+    assert local_file.read_bytes() == wafer_file.read_bytes()
+    assert fetch_file(wafer_file, cache_dir) == local_file
+    assert os.stat(local_file).st_mtime_ns == mtime
+    assert [path.name for path in cache_dir.iterdir()] == [local_file.name]
+
+
+def test_fetch_file_same_name_in_different_folders(tmp_path):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    first = make_wafer_file(tmp_path / "a" / "wafer.hdf5", seed=0)
+    second = make_wafer_file(tmp_path / "b" / "wafer.hdf5", seed=1)
+
+    first_copy = fetch_file(first, tmp_path / "cache")
+    second_copy = fetch_file(second, tmp_path / "cache")
+
+    assert first_copy != second_copy
+    assert first_copy.read_bytes() == first.read_bytes()
+    assert second_copy.read_bytes() == second.read_bytes()
+
+
+def test_fetch_file_concurrent_copies(wafer_file, tmp_path):
+    cache_dir = tmp_path / "cache"
+
+    with ThreadPoolExecutor(4) as executor:
+        local_files = list(
+            executor.map(lambda _: fetch_file(wafer_file, cache_dir), range(4))
+        )
+
+    assert len(set(local_files)) == 1
+    assert local_files[0].read_bytes() == wafer_file.read_bytes()
+    # No temporary file is left in the cache
+    assert [path.name for path in cache_dir.iterdir()] == [local_files[0].name]
+
+
+def test_fetch_file_url(wafer_file, tmp_path):
+    fsspec = pytest.importorskip("fsspec")
+    path = f"/{uuid.uuid4().hex}/wafer.hdf5"
+    filesystem = fsspec.filesystem("memory")
+    filesystem.pipe(path, wafer_file.read_bytes())
+    cache_dir = tmp_path / "cache"
+    try:
+        local_file = fetch_file(f"memory://{path}", cache_dir)
+        assert local_file.name.endswith("_wafer.hdf5")
+        assert local_file.read_bytes() == wafer_file.read_bytes()
+        assert fetch_file(f"memory://{path}", cache_dir) == local_file
+
+        other_file = make_wafer_file(tmp_path / "other.hdf5", seed=1)
+        filesystem.pipe(path, other_file.read_bytes())
+        hdf5_io.close_remote_files()
+        new_file = fetch_file(f"memory://{path}", cache_dir)
+        assert new_file.read_bytes() == other_file.read_bytes()
+        # The copy of the previous version is removed
+        assert [item.name for item in cache_dir.iterdir()] == [new_file.name]
+
+        data = asyncio.run(
+            load_full_dataset_async(f"memory://{path}", cache_dir=cache_dir)
+        )
+        xr.testing.assert_identical(data, get_full_dataset(other_file))
+    finally:
+        hdf5_io.close_remote_files()
+        filesystem.rm(path)
+
+
+def test_load_full_dataset_async(wafer_file, tmp_path):
+    data = asyncio.run(
+        load_full_dataset_async(wafer_file, cache_dir=tmp_path / "cache")
+    )
+
+    xr.testing.assert_identical(data, get_full_dataset(wafer_file))
+
+
+def test_gather_full_datasets(tmp_path):
+    hdf5_files = [
+        make_wafer_file(tmp_path / f"wafer_{i}.hdf5", seed=i) for i in range(3)
+    ]
+
+    library = asyncio.run(gather_full_datasets(hdf5_files, max_concurrency=2))
+
+    assert list(library) == [str(hdf5_file) for hdf5_file in hdf5_files]
+    for hdf5_file in hdf5_files:
+        xr.testing.assert_identical(
+            library[str(hdf5_file)], get_full_dataset(hdf5_file)
+        )
+
+
+def test_hdf5_options_do_not_leak_between_threads(wafer_file):
+    session_options = hdf5_io.get_hdf5_options()
+    seen = []
+    stop = threading.Event()
+
+    def watch():
+        while not stop.is_set():
+            seen.append(hdf5_io.get_hdf5_options()["rdcc_nbytes"])
+
+    watcher = threading.Thread(target=watch)
+    watcher.start()
+    try:
+        asyncio.run(
+            gather_full_datasets(
+                [wafer_file, wafer_file], hdf5_options={"rdcc_nbytes": 1024**2}
+            )
+        )
+    finally:
+        stop.set()
+        watcher.join()
+
+    assert set(seen) == {session_options["rdcc_nbytes"]}
+    assert hdf5_io.get_hdf5_options() == session_options
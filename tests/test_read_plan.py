@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the read plans of the results.
+
+@author: williamrigaut
+"""
+import h5py
+import pytest
+from packages.readers.read_edx import get_edx_composition
+from packages.readers.read_hdf5 import make_group_path
+from packages.readers.read_moke import get_moke_results
+from packages.readers.read_plan import compile_read_plan, execute_read_plan
+from packages.readers.read_xrd import get_xrd_results
+
+POSITIONS = [(float(x), float(y)) for x in range(-10, 15, 5) for y in range(-10, 15, 5)]
+
+
+def _read_position(hdf5_file, data_type, x, y):
+    """
+    Reads the results of a position with the reader of the technique, with the keys of the read plans.
+    """
+    group_path = make_group_path(
+        hdf5_file, x_pos=x, y_pos=y, data_type=data_type, measurement_type="Results"
+    )
+    if data_type == "EDX":
+        composition, _ = get_edx_composition(hdf5_file, group_path)
+        return {element: value["AtomPercent"] for element, value in composition.items()}
+    if data_type == "MOKE":
+        return get_moke_results(hdf5_file, group_path, result_type=None)[0]
+
+    phases, _ = get_xrd_results(hdf5_file, group_path, result_type="Phases")
+    return {
+        (phase, key): value
+        for phase, results in phases.items()
+        for key, value in results.items()
+    }
+
+
+@pytest.mark.parametrize(
+    "data_type, group", [("EDX", "W_EDX"), ("MOKE", "W_MOKE"), ("XRD", "W_ESRF")]
+)
+def test_read_plan_equals_position_reads(wafer_file, data_type, group):
+    # A position with an extra result does not have the structure of the reference position
+    with h5py.File(wafer_file, "a") as h5f:
+        h5f[f"{group}/(5.0,5.0)/results"].copy(
+            h5f[f"{group}/(5.0,5.0)/results"], f"{group}/(5.0,5.0)/results/extra"
+        )
+
+    group_names = [f"({x},{y})" for x, y in POSITIONS] + ["(50.0,50.0)"]
+    with h5py.File(wafer_file, "r") as h5f:
+        plan = compile_read_plan(h5f[f"{group}/(0.0,0.0)"], data_type)
+        values, irregular = execute_read_plan(h5f[group], plan, group_names)
+
+    assert irregular == ["(5.0,5.0)", "(50.0,50.0)"]
+    assert len(values) == len(POSITIONS) - 1
+    for x, y in POSITIONS:
+        if (x, y) != (5.0, 5.0):
+            assert values[f"({x},{y})"] == _read_position(wafer_file, data_type, x, y)
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the incremental refresh of get_full_dataset on a growing file.
+
+@author: williamrigaut
+"""
+import h5py
+import pytest
+import xarray as xr
+from packages.readers.read_hdf5 import (
+    get_full_dataset,
+    get_position_index,
+    refresh_full_dataset,
+)
+from tests.conftest import make_wafer_file
+
+GROUPS = ["W_EDX", "W_MOKE", "W_ESRF"]
+
+
+def _make_partial_file(path, complete_file, removed):
+    """
+    Copies the complete wafer without the positions accepted by removed(x, y).
+    """
+    with h5py.File(complete_file, "r") as source, h5py.File(path, "w") as h5f:
+        for name in source:
+            source.copy(source[name], h5f, name=name)
+        for group in GROUPS:
+            for x in range(-10, 15, 5):
+                for y in range(-10, 15, 5):
+                    if removed(x, y):
+                        del h5f[f"{group}/({float(x)},{float(y)})"]
+
+    return path
+
+
+def _append_positions(path, complete_file):
+    """
+    Appends the positions of the complete wafer missing from the file.
+    """
+    with h5py.File(complete_file, "r") as source, h5py.File(path, "a") as h5f:
+        for group in GROUPS:
+            for name in source[group]:
+                if name not in h5f[group]:
+                    source.copy(source[f"{group}/{name}"], h5f[group], name=name)
+
+    return None
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_refresh_after_appending(tmp_path, compact):
+    complete_file = make_wafer_file(tmp_path / "complete.hdf5")
+    # The column x = 10 and a few other positions are measured later
+    hdf5_file = _make_partial_file(
+        tmp_path / "wafer.hdf5",
+        complete_file,
+        lambda x, y: x == 10 or (x, y) in [(0, 5), (-5, -10)],
+    )
+
+    data = get_full_dataset(hdf5_file, compact=compact)
+    position_index = get_position_index(hdf5_file)
+    assert data.sizes["x"] == 4
+
+    _append_positions(hdf5_file, complete_file)
+    data, position_index = refresh_full_dataset(hdf5_file, data, position_index)
+
+    expected = get_full_dataset(hdf5_file, compact=compact)
+    assert data.sizes["x"] == 5
+    xr.testing.assert_identical(data, expected)
+    xr.testing.assert_identical(data, get_full_dataset(complete_file, compact=compact))
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the resampling of results onto other wafer grids.
+
+@author: williamrigaut
+"""
+import numpy as np
+import pytest
+import xarray as xr
+from packages.analysis.regrid import (
+    apply_regrid_weights,
+    compute_regrid_weights,
+    make_wafer_grid,
+    regrid_dataset,
+)
+
+
+def _linear_field(x, y):
+    return 2.0 * x - 0.5 * y + 3.0
+
+
+def test_linear_regrid_reproduces_a_linear_field():
+    pytest.importorskip("scipy")
+    rng = np.random.default_rng(0)
+    # Scattered positions, with the corners so that the grid is inside their convex hull
+    points = np.vstack(
+        [[[-20, -20], [20, -20], [-20, 20], [20, 20]], rng.uniform(-20, 20, (40, 2))]
+    )
+    x_vals = [-20.0, -12.5, -5.0, 2.5, 10.0, 17.5]
+    y_vals = [-15.0, 0.0, 15.0]
+
+    regrid_weights = compute_regrid_weights(points, x_vals, y_vals, method="linear")
+    values = _linear_field(points[:, 0], points[:, 1])
+    result = apply_regrid_weights(np.stack([values, 2 * values]), regrid_weights)
+
+    grid_x, grid_y = np.meshgrid(x_vals, y_vals)
+    assert regrid_weights["valid"].all()
+    np.testing.assert_allclose(result[0], _linear_field(grid_x, grid_y))
+    np.testing.assert_allclose(result[1], 2 * _linear_field(grid_x, grid_y))
+
+    # Outside of the convex hull of the positions
+    outside = compute_regrid_weights(points, [30.0], [0.0], method="linear")
+    assert np.isnan(apply_regrid_weights(values, outside)).all()
+
+
+def test_regrid_dataset_on_the_same_grid():
+    x_vals, y_vals = [0.0, 5.0, 10.0], [0.0, 7.5]
+    grid_x, grid_y = np.meshgrid(x_vals, y_vals)
+    values = _linear_field(grid_x, grid_y)
+    values[1, 2] = np.nan
+    data = xr.Dataset(
+        {"value": (["y", "x"], values, {"units": "nm"})},
+        coords={"y": y_vals, "x": x_vals},
+    )
+
+    for method in ["nearest", "idw"]:
+        regridded = regrid_dataset(data, x_vals, y_vals, method=method)
+        assert regridded.attrs["regrid_method"] == method
+        assert regridded["value"].attrs == {"units": "nm"}
+        np.testing.assert_array_equal(regridded["value"].values[0], values[0])
+
+
+def test_make_wafer_grid():
+    assert make_wafer_grid([(0, 0), (5, 0), (0, 7.5)]) == ([0.0, 5.0], [0.0, 7.5])
+    assert make_wafer_grid([(0, 0), (10, 10)], pitch=5) == (
+        [0.0, 5.0, 10.0],
+        [0.0, 5.0, 10.0],
+    )
+    assert make_wafer_grid([(0, 0), (10, 10)], pitch=(10, 5)) == (
+        [0.0, 10.0],
+        [0.0, 5.0, 10.0],
+    )
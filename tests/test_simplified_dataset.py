@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the simplified datasets.
+
+@author: williamrigaut
+"""
+import h5py
+import numpy as np
+import pytest
+from packages.readers.read_hdf5 import create_simplified_dataset
+
+
+def _read_file(hdf5_file):
+    """
+    Reads the groups, datasets and attributes of a file, in the order of the file.
+    """
+    content = []
+    with h5py.File(hdf5_file, "r") as h5f:
+
+        def visit(name, node):
+            attrs = dict(node.attrs)
+            if isinstance(node, h5py.Dataset):
+                content.append((name, node[()], attrs))
+            else:
+                content.append((name, None, attrs))
+
+        h5f.visititems(visit)
+        order = list(h5f.keys())
+
+    return order, content
+
+
+def _assert_same_file(first_file, second_file):
+    first_order, first = _read_file(first_file)
+    second_order, second = _read_file(second_file)
+
+    assert first_order == second_order
+    assert [name for name, _, _ in first] == [name for name, _, _ in second]
+    for (name, value, attrs), (_, other_value, other_attrs) in zip(first, second):
+        assert attrs == other_attrs, name
+        np.testing.assert_array_equal(value, other_value, err_msg=name)
+
+
+def test_simplified_dataset_workers(wafer_file, tmp_path):
+    create_simplified_dataset(wafer_file, tmp_path / "w1.hdf5", workers=1)
+    create_simplified_dataset(wafer_file, tmp_path / "w4.hdf5", workers=4, chunk_size=4)
+
+    _assert_same_file(tmp_path / "w1.hdf5", tmp_path / "w4.hdf5")
+    with h5py.File(tmp_path / "w1.hdf5", "r") as h5f:
+        # Default grid of -40 to 40 mm, only the positions measured by a technique are written
+        assert len(h5f.keys()) == 25
+        assert float(h5f["(5.0,-10.0)/x_pos"][()]) == 5.0
+        assert "Nd2Fe14B_phase_fraction" in h5f["(5.0,-10.0)"]
+        assert h5f["(5.0,-10.0)/CdTe"].shape == (4, 3)
+
+
+def test_simplified_dataset_positions(wafer_file, tmp_path):
+    create_simplified_dataset(
+        wafer_file, tmp_path / "file.hdf5", positions="file", workers=2
+    )
+    create_simplified_dataset(
+        wafer_file, tmp_path / "list.hdf5", positions=[(0, 0), (5.0, -10.0)]
+    )
+
+    with h5py.File(tmp_path / "file.hdf5", "r") as h5f:
+        assert len(h5f.keys()) == 25
+    with h5py.File(tmp_path / "list.hdf5", "r") as h5f:
+        assert list(h5f.keys()) == ["(0.0,0.0)", "(5.0,-10.0)"]
+    with pytest.raises(ValueError):
+        create_simplified_dataset(wafer_file, tmp_path / "bad.hdf5", positions="all")
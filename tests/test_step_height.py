@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the step heights of the profilometer profiles.
+
+@author: williamrigaut
+"""
+import numpy as np
+from packages.analysis.step_height import (
+    compute_step_heights,
+    detect_steps,
+    fit_steps,
+    level_profiles,
+)
+
+
+def _make_profiles():
+    """
+    Tilted profiles with a known step, the film being on either side of the step.
+    """
+    rng = np.random.default_rng(0)
+    distance = np.tile(np.linspace(0, 2, 400), (3, 1))
+    step_index = np.array([150, 260, 200])
+    step = np.array([0.5, -0.25, 1.0])
+    slope = np.array([0.1, -0.3, 0.0])
+    offset = np.array([1.0, 0.0, -2.0])
+    index = np.arange(400)
+
+    profile = (
+        slope[:, np.newaxis] * distance
+        + offset[:, np.newaxis]
+        + step[:, np.newaxis] * (index >= step_index[:, np.newaxis])
+        + rng.normal(0, 1e-3, distance.shape)
+    )
+
+    return distance, profile, step_index, step, slope, offset
+
+
+def test_detect_and_fit_steps():
+    distance, profile, step_index, step, slope, offset = _make_profiles()
+    # Missing points do not move the step
+    profile[0, 10:30] = np.nan
+
+    detected = detect_steps(profile)
+    fit = fit_steps(distance, profile, detected)
+
+    np.testing.assert_array_equal(detected, step_index)
+    np.testing.assert_allclose(fit["step"], step, atol=1e-3)
+    np.testing.assert_allclose(fit["slope"], slope, atol=1e-3)
+    np.testing.assert_allclose(fit["offset"], offset, atol=1e-3)
+    assert (fit["residual"] < 2e-3).all()
+
+    levelled = level_profiles(distance, profile, fit["slope"], fit["offset"])
+    np.testing.assert_allclose(np.nanmean(levelled[:, :100], axis=1), 0, atol=1e-3)
+
+
+def test_compute_step_heights():
+    distance, profile, step_index, step, _, _ = _make_profiles()
+    # A profile too short to find a step
+    profile = np.vstack([profile, np.full(400, np.nan)])
+    profile[3, :30] = 0
+    distance = np.vstack([distance, distance[0]])
+
+    fit = compute_step_heights(distance, profile)
+
+    np.testing.assert_allclose(fit["step_height"][:3], np.abs(step), atol=1e-3)
+    np.testing.assert_allclose(fit["step_position"][:3], distance[0, step_index])
+    assert np.isnan(fit["step_height"][3])
+    assert np.isnan(fit["step_position"][3])
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the virtual dataset companion files.
+
+@author: williamrigaut
+"""
+import h5py
+import numpy as np
+from packages.readers.virtual_dataset import create_virtual_dataset, get_virtual_cube
+
+
+def test_virtual_dataset_from_another_folder(wafer_file, tmp_path, monkeypatch):
+    with h5py.File(wafer_file, "a") as h5f:
+        del h5f["W_ESRF/(10.0,10.0)/measurement"]
+        expected_intensity = h5f[
+            "W_ESRF/(5.0,-10.0)/measurement/CdTe_integrate/intensity"
+        ][0]
+        expected_image = h5f["W_ESRF/(10.0,-5.0)/measurement/CdTe"][()]
+        expected_counts = h5f["W_EDX/(0.0,0.0)/measurement/counts"][()]
+    virtual_file = tmp_path / "virtual" / "wafer_virtual.hdf5"
+    virtual_file.parent.mkdir()
+    create_virtual_dataset(wafer_file, virtual_file)
+
+    (tmp_path / "elsewhere").mkdir()
+    monkeypatch.chdir(tmp_path / "elsewhere")
+    intensity = get_virtual_cube(virtual_file, "XRD", "CdTe_integrate_intensity")
+    assert intensity.dims == ("y", "x", "q")
+    assert intensity.shape == (5, 5, 50)
+    np.testing.assert_array_equal(
+        intensity.sel(x=5.0, y=-10.0).values, expected_intensity
+    )
+    assert np.isnan(intensity.sel(x=10.0, y=10.0).values).all()
+
+    images = get_virtual_cube(virtual_file, "XRD", "CdTe", x_pos=slice(0, 10))
+    assert images.dtype == np.int32
+    assert images.shape == (5, 3, 4, 3)
+    np.testing.assert_array_equal(images.sel(x=10.0, y=-5.0).values, expected_image)
+    # The integer images of the missing position are filled with 0, see the mapped coordinate
+    assert (images.sel(x=10.0, y=10.0).values == 0).all()
+    assert not images["mapped"].sel(x=10.0, y=10.0)
+    assert int(images["mapped"].sum()) == 14
+
+    counts = get_virtual_cube(virtual_file, "EDX", "counts", x_pos=0.0, y_pos=0.0)
+    np.testing.assert_array_equal(counts.values, expected_counts)
+    assert bool(counts["mapped"])
+
+
+def test_virtual_dataset_leading_dimensions(wafer_file, tmp_path, capsys):
+    with h5py.File(wafer_file, "a") as h5f:
+        for group in h5f["W_ESRF"].values():
+            del group["measurement/CdTe_integrate/intensity"]
+            group["measurement/CdTe_integrate/intensity"] = np.zeros((2, 50))
+    virtual_file = tmp_path / "wafer_virtual.hdf5"
+    create_virtual_dataset(wafer_file, virtual_file)
+
+    assert "can not be mapped" in capsys.readouterr().out
+    with h5py.File(virtual_file, "r") as h5f:
+        assert "CdTe_integrate_intensity" not in h5f["XRD"]
+        assert "CdTe" in h5f["XRD"]
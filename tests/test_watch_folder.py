@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the conversion of the files of a watched folder.
+
+@author: williamrigaut
+"""
+import pytest
+from packages.readers import convert
+from packages.readers.watch_folder import main, read_manifest
+
+
+def test_watch_folder_once(wafer_file):
+    folder = wafer_file.parent
+
+    assert main([str(folder), "--once", "--workers", "1", "--interval", "0.1"]) == 0
+
+    record = read_manifest(folder)[wafer_file.name]
+    assert record["status"] == "done"
+    assert record["size"] == wafer_file.stat().st_size
+    for output in ["simplified", "results"]:
+        assert record["outputs"][output] == str(
+            convert.get_output_path(wafer_file, output)
+        )
+    assert sorted(path.name for path in folder.iterdir()) == [
+        "conversion_manifest.json",
+        "wafer.hdf5",
+        "wafer_results.hdf5",
+        "wafer_simplified.hdf5",
+    ]
+
+
+def test_failed_conversion_leaves_no_output(wafer_file, monkeypatch):
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(convert, "get_full_dataset", fail)
+    with pytest.raises(OSError):
+        convert.convert_wafer(wafer_file, outputs=("simplified", "results"))
+
+    assert [path.name for path in wafer_file.parent.iterdir()] == ["wafer.hdf5"]